@@ -3,16 +3,71 @@ export TENANT_ID=
 export CLIENT_ID=
 export CLIENT_SECRET=
 
+# Seconds before expiry that a cached access token is refreshed in the background
+export TOKEN_REFRESH_MARGIN=300
+
+# HTTP connection pooling for Graph calls
+export HTTP_POOL_SIZE=20
+export HTTP_POOL_BLOCK=false
+export HTTP_KEEP_ALIVE=true
+export HTTP_GZIP=true
+# Retries of throttled (429/503) and failed idempotent Graph calls, with jittered exponential backoff (seconds)
+export HTTP_MAX_RETRIES=5
+export HTTP_BACKOFF_BASE=0.5
+export HTTP_BACKOFF_CAP=60
+# Per-tenant request rate (requests/second): starting rate and the most it can grow to while Graph is not throttling
+export GRAPH_RATE_LIMIT=20
+export GRAPH_RATE_LIMIT_MAX=200
+# Seconds a per-credential client can sit unused before it is evicted
+export CLIENT_IDLE_TIMEOUT=900
+# Maximum in-flight Graph requests per tenant for the async client
+export ASYNC_MAX_CONCURRENCY=50
+# gunicorn: worker processes, threads per Flask worker, and seconds before a hung worker is restarted
+export WEB_WORKERS=4
+export WEB_THREADS=16
+export WEB_TIMEOUT=300
+# $batch requests (of up to 20 operations) in flight at once for POST /batch
+export BATCH_ROUTE_WORKERS=4
+
 # Folder/File to download, upload, delete
 export SHAREPOINT_URL=https://graph.microsoft.com
+# Azure AD endpoint for access tokens (point both at benchmarks/mock_graph.py to run offline)
+export SHAREPOINT_LOGIN_URL=https://login.microsoftonline.com
+# $top page size used when listing collections (pages are followed via @odata.nextLink)
+export SHAREPOINT_PAGE_SIZE=200
 export SHAREPOINT_SITE=
 export SHAREPOINT_FOLDER=
 export SHAREPOINT_FILE=
 export LOCAL_SHAREPOINT_DOWNLOADS_FOLDER=
 export LOCAL_REQUESTS_DOWNLOADS_FOLDER=
+# Delta links and cached items for incremental syncs
+export DELTA_STATE_DIR=resources/state/delta
+# Large file uploads: chunk size (multiple of 327680 bytes) and where in-progress sessions are kept
+export UPLOAD_CHUNK_SIZE=10485760
+export UPLOAD_STATE_DIR=resources/state/upload
+# Large file downloads: parallel range requests and the size of each range
+export DOWNLOAD_WORKERS=8
+export DOWNLOAD_SEGMENT_SIZE=16777216
+# Bulk downloads: items downloaded at once, and the size above which an item is downloaded in segments
+export BULK_DOWNLOAD_WORKERS=8
+export SEGMENTED_DOWNLOAD_THRESHOLD=67108864
+# Downloaded content is cached here (keyed by item eTag) up to this many bytes
+export CONTENT_CACHE_DIR=resources/cache/content
+export CONTENT_CACHE_MAX_BYTES=1073741824
+# Name -> id lookup cache: TTL/size per lookup type (SITE, ROOT_DRIVE, LIST, DRIVE, ITEM) and TTL of "not found" results
+export METADATA_CACHE_DRIVE_TTL=300
+export METADATA_CACHE_ITEM_TTL=60
+export METADATA_CACHE_NEGATIVE_TTL=30
+# Multi-site pipeline: sites crawled at once, and at most this many per tenant
+export PIPELINE_WORKERS=8
+export PIPELINE_TENANT_CONCURRENCY=4
 export NEW_SHAREPOINT_FOLDER=
 export NEW_SHAREPOINT_FILENAME=
 
 # File name for logs
 export LOG_PATH=
 export LOG_FILENAME=
+# Log records queued for the background writer (records beyond this are dropped), text or json lines, and the fraction of INFO records kept
+export LOG_QUEUE_SIZE=10000
+export LOG_FORMAT=text
+export LOG_INFO_SAMPLE_RATE=1.0
@@ -4,6 +4,9 @@ from routes.get import get
 from routes.put import put
 from routes.patch import patch
 from routes.delete import delete
+from routes.batch import batch
+from routes.metrics import metrics
+import common.metrics as metrics_common
 
 
 app = Flask(__name__)
@@ -11,8 +14,12 @@ app.register_blueprint(get)
 app.register_blueprint(put)
 app.register_blueprint(patch)
 app.register_blueprint(delete)
+app.register_blueprint(batch)
+app.register_blueprint(metrics)
+metrics_common.instrument_flask(app)
 
 
+# development server only, use gunicorn in production (see gunicorn.conf.py)
 if __name__ == "__main__":
     port = int(os.environ.get('PORT', 5010))
-    app.run(debug=True, host='0.0.0.0', port=port)
+    app.run(debug=os.environ.get('FLASK_DEBUG', 'true').lower() == 'true', host='0.0.0.0', port=port)
@@ -0,0 +1,51 @@
+"""
+Production entry point for the async routes (routes/async_get.py)
+
+Lookups, listings and downloads await Graph instead of holding a worker thread, so one worker
+serves many slow Sharepoint requests at once. Run one event loop per CPU with gunicorn:
+    gunicorn async_app:create_app --config gunicorn.conf.py --worker-class aiohttp.GunicornWebWorker
+or a single process:
+    python -m aiohttp.web -H 0.0.0.0 -P 5011 async_app:create_app
+"""
+import os
+from aiohttp import web
+import common.logger as logger_common
+import common.metrics as metrics_common
+from common.async_sharepoint import AsyncClientRegistry
+from routes.async_get import async_get
+
+
+async def start_clients(app):
+    registry = app['clients'] = AsyncClientRegistry(idle_timeout=int(os.getenv('CLIENT_IDLE_TIMEOUT', 900)))
+    await registry.start()
+
+    # log in with the configured application up front so the first request doesn't wait for a token
+    if os.getenv('TENANT_ID') and os.getenv('CLIENT_ID') and os.getenv('CLIENT_SECRET'):
+        try:
+            await registry.get(os.getenv('TENANT_ID'), os.getenv('CLIENT_ID'), os.getenv('CLIENT_SECRET')).login()
+        except Exception as e:
+            logger_common.logger.error(e, exc_info=True)
+            logger_common.logger.error(f'Could not warm sharepoint client for application id: {os.getenv("CLIENT_ID")}')
+
+    logger_common.logger.info(f'async server worker started. Pid: {os.getpid()}')
+
+
+async def close_clients(app):
+    # runs after in-flight requests have finished (or the shutdown timeout has passed)
+    await app['clients'].close()
+    logger_common.logger.info(f'async server worker stopped. Pid: {os.getpid()}')
+
+
+async def create_app(argv=None):
+    # a coroutine, as aiohttp's gunicorn worker only accepts an Application or a coroutine function
+    app = web.Application()
+    app.add_routes(async_get)
+    app.on_startup.append(start_clients)
+    app.on_cleanup.append(close_clients)
+    metrics_common.instrument_aiohttp(app)
+    return app
+
+
+if __name__ == "__main__":
+    port = int(os.environ.get('PORT', 5011))
+    web.run_app(create_app(), host='0.0.0.0', port=port)
@@ -0,0 +1,172 @@
+#!/usr/local/bin/python3
+"""
+End to end benchmark of the Graph clients and Flask routes against benchmarks/mock_graph.py
+
+The mock server runs in-process, so results show client overhead (paging, pooling, retries,
+caching, concurrency) under a chosen latency and throttling profile, not Graph's own speed.
+
+Run from the repository root:
+    python -m benchmarks.graph_client
+    python -m benchmarks.graph_client --latency 0.05 --throttle-rate 0.02 --depth 3 --fanout 5 --files 20
+"""
+import argparse
+import asyncio
+import io
+import os
+import statistics
+import tempfile
+import time
+
+work_directory = tempfile.mkdtemp(prefix='graph-benchmark-')
+
+
+def configure(args, url):
+    # the common modules read their settings on import
+    os.environ.update({
+        'SHAREPOINT_URL': url,
+        'SHAREPOINT_LOGIN_URL': url,
+        'SHAREPOINT_PAGE_SIZE': str(args.page_size),
+        'HTTP_BACKOFF_BASE': '0.05',
+        'GRAPH_RATE_LIMIT': str(args.rate_limit),
+        'GRAPH_RATE_LIMIT_MAX': str(max(args.rate_limit, 1000)),
+        'CONTENT_CACHE_DIR': os.path.join(work_directory, 'cache'),
+        'DELTA_STATE_DIR': os.path.join(work_directory, 'delta'),
+        'UPLOAD_STATE_DIR': os.path.join(work_directory, 'upload'),
+        'LOCAL_FOLDER': os.path.join(work_directory, 'local'),
+    })
+    os.environ.setdefault('LOG_PATH', work_directory)
+    os.environ.setdefault('LOG_FILENAME', 'benchmark')
+    os.makedirs(os.environ['LOCAL_FOLDER'], exist_ok=True)
+
+
+def measure(label, fn, repeat, unit='op'):
+    """Runs fn `repeat` times, printing throughput and latency percentiles. fn may return a count of units done"""
+    durations, units = [], 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        units += fn() or 1
+        durations.append(time.perf_counter() - start)
+
+    total = sum(durations)
+    p95 = statistics.quantiles(durations, n=20)[-1] if len(durations) > 1 else durations[0]
+    print(f'  {label:<36} {units / total:>10.1f} {unit}/s   '
+          f'p50 {statistics.median(durations) * 1000:>8.1f} ms   p95 {p95 * 1000:>8.1f} ms')
+
+
+def run(args):
+    from benchmarks.mock_graph import MockDrive, MockGraph, site_name
+
+    drive = MockDrive(args.depth, args.fanout, args.files, args.file_size)
+    graph = MockGraph(drive, latency=args.latency, jitter=args.jitter, page_size=args.page_size,
+                      throttle_rate=args.throttle_rate, retry_after=args.retry_after).start()
+    configure(args, graph.url)
+
+    import common.sharepoint as sharepoint_common
+    from common.async_sharepoint import AsyncSharepoint
+    from common.content_cache import content_cache
+    from common.token_cache import token_cache, token_key
+
+    credentials = ('tenant', 'client', 'secret')
+    sharepoint = sharepoint_common.Sharepoint(*credentials)
+    documents = sum(1 for item in drive.items.values() if not item['folder'])
+    print(f'mock Graph at {graph.url}: {len(drive.items)} items ({documents} documents of {args.file_size} bytes), '
+          f'latency {args.latency}s, page size {args.page_size}, throttle rate {args.throttle_rate}')
+
+    print('lookups')
+    measure('login (token endpoint)', lambda: bool(token_cache.invalidate(token_key(sharepoint.tenant_id, sharepoint.client_id, sharepoint.client_secret, sharepoint.scope)) or sharepoint.login()), args.repeat)
+    measure('login (cached token)', lambda: bool(sharepoint.login()), args.repeat * 10)
+    measure('site lookup (uncached)', lambda: bool(sharepoint.fetch_site_id_by_name(site_name)), args.repeat)
+    site_id = sharepoint.get_site_id_by_name(site_name)
+    measure('site lookup (metadata cache)', lambda: bool(sharepoint.get_site_id_by_name(site_name)), args.repeat * 10)
+
+    print('listings')
+    top_folder = next(item for item in drive.children('root') if item['folder'])
+    measure('list folder by id', lambda: len(sharepoint.list_drive_items_by_id(site_id, 'root')), args.repeat, 'item')
+    measure('list folder by path', lambda: len(sharepoint.list_drive_items_by_path(site_id, top_folder['name'])), args.repeat, 'item')
+    measure('list drive (list items)', lambda: sum(1 for _ in sharepoint.iter_drives_and_items(site_id, 'list-1')), 1, 'item')
+    for workers in (1, 8):
+        measure(f'walk whole drive ({workers} workers)', lambda: sum(1 for _ in sharepoint.walk(site_id, '/', workers=workers)), 1, 'doc')
+
+    def batch_listing():
+        folders = [item['id'] for item in drive.items.values() if item['folder']]
+        with sharepoint.batch() as graph_batch:
+            futures = [graph_batch.list_children(site_id, folder_id) for folder_id in folders]
+        return len([future.result() for future in futures])
+    measure('list every folder via $batch', batch_listing, 1, 'folder')
+
+    async def async_listing():
+        async with AsyncSharepoint(*credentials) as client:
+            folders = [item['id'] for item in drive.items.values() if item['folder']]
+            listings = await asyncio.gather(*(client.list_drive_items_by_id(site_id, folder_id) for folder_id in folders))
+            return len(listings)
+    measure('list every folder (async)', lambda: asyncio.run(async_listing()), 1, 'folder')
+
+    print('downloads')
+    target = os.path.join(work_directory, 'downloads')
+    os.makedirs(target, exist_ok=True)
+    item_ids = [item['id'] for item in drive.items.values() if not item['folder']][:args.repeat]
+    ids = iter(item_ids * 3)
+    measure('download (uncached)', lambda: bool(sharepoint.download_item_by_id(site_id, next(ids), target, use_cache=False)), len(item_ids))
+    measure('download (content cache miss)', lambda: bool(sharepoint.download_item_by_id(site_id, next(ids), target)), len(item_ids))
+    measure('download (content cache 304)', lambda: bool(sharepoint.download_item_by_id(site_id, next(ids), target)), len(item_ids))
+    print(f'  content cache: {content_cache.stats()}')
+    measure('segmented download', lambda: bool(sharepoint.download_item_segmented(
+        site_id, item_ids[0], target, segment_size=max(args.file_size // 8, 1))), args.repeat)
+
+    bulk_target = os.path.join(work_directory, 'bulk')
+    documents_to_fetch = list(sharepoint.walk(site_id, '/'))
+    measure('bulk download (first run)', lambda: sharepoint.download_items(
+        site_id, documents_to_fetch, bulk_target, progress=lambda stats: None)['downloaded'], 1, 'doc')
+    measure('bulk download (all up to date)', lambda: sharepoint.download_items(
+        site_id, documents_to_fetch, bulk_target, progress=lambda stats: None)['skipped'], 1, 'doc')
+
+    print('uploads')
+    payload = os.urandom(args.file_size)
+    measure('upload stream (single PUT)', lambda: bool(sharepoint.upload_stream_to_drive(
+        site_id, io.BytesIO(payload), len(payload), top_folder['id'], 'upload.bin')), args.repeat)
+    large = os.urandom(327680 * 4)
+    measure('upload stream (session, 4 chunks)', lambda: bool(sharepoint.upload_stream_to_drive(
+        site_id, io.BytesIO(large), len(large), top_folder['id'], 'large.bin', chunk_size=327680)), args.repeat)
+
+    print('routes')
+    from app import app
+    client = app.test_client()
+    headers = {'tenant-id': credentials[0], 'client-id': credentials[1], 'client-secret': credentials[2]}
+
+    def route(method, path, extra_headers={}, **kwargs):
+        response = client.open(path, method=method, headers={**headers, **extra_headers}, **kwargs)
+        body = response.get_data()
+        assert response.status_code < 400, f'{method} {path}: {response.status_code}'
+        return len(body) and 1
+
+    measure('GET children', lambda: route('GET', f'/site-id/{site_id}/drive-id/root/children'), args.repeat)
+    measure('GET item (streamed relay)', lambda: route('GET', f'/site-id/{site_id}/item-id/{item_ids[0]}'), args.repeat)
+    measure('GET item (range relay)', lambda: route('GET', f'/site-id/{site_id}/item-id/{item_ids[0]}',
+                                                    extra_headers={'Range': 'bytes=0-1023'}), args.repeat)
+
+    def batch_route():
+        copies = [{'op': 'copy', 'site_id': site_id, 'item_id': item_id, 'target_folder_id': top_folder['id'],
+                   'target_file_name': f'copy of {item_id}'} for item_id in item_ids]
+        return route('POST', '/batch', json=copies) and len(copies)
+    measure('POST /batch (copy)', batch_route, 1, 'op')
+
+    print(f'mock Graph served {graph.requests} requests, {graph.throttled} answered with 429')
+    graph.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds the mock adds to every request')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--page-size', type=int, default=200)
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of requests answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--rate-limit', type=float, default=500, help='starting client rate limit (requests/second)')
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--files', type=int, default=10, help='documents per folder')
+    parser.add_argument('--file-size', type=int, default=256 * 1024)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    run(args)
@@ -0,0 +1,85 @@
+#!/usr/local/bin/python3
+"""
+Memory of large listings: DriveItem records against the plain dicts listings used to return
+
+Items are parsed from synthetic Graph JSON pages the way the client parses them, so every string
+starts out as its own object, as it does in production.
+
+Run from the repository root:
+    python -m benchmarks.item_memory
+    python -m benchmarks.item_memory --sizes 100000 1000000 --fanout 50
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+from common.graph import drive_item_details
+from common.tree import TreeIndex
+
+
+def dict_item_details(item):
+    """What drive_item_details returned before DriveItem"""
+    return {
+        'name': item['name'],
+        'id': item['id'],
+        'parent_id': item['parentReference']['id'],
+        'content_type': 'Document' if 'file' in item or item.get('@microsoft.graph.downloadUrl') else 'Folder',
+        'created_date_time': item.get('createdDateTime'),
+        'last_modified_date_time': item.get('lastModifiedDateTime')
+    }
+
+
+def graph_pages(size, fanout, page_size=200):
+    """JSON pages of driveItems shaped like a $select-ed listing, `fanout` items per folder"""
+    page = []
+    for i in range(size):
+        item = {
+            'id': f'01ABCDEFGHIJKLMNOPQRSTUV{i:010d}',
+            'name': f'Document {i}.docx',
+            'parentReference': {'driveId': 'b!drive', 'id': f'01ABCDEFGHIJKLMNOPQRSTUV{i // fanout:010d}'},
+            'createdDateTime': '2024-01-01T12:00:00Z',
+            'lastModifiedDateTime': '2024-02-01T12:00:00Z',
+        }
+        item['file' if i % 10 else 'folder'] = {}
+        page.append(item)
+        if len(page) == page_size:
+            yield json.dumps({'value': page})
+            page = []
+    if page:
+        yield json.dumps({'value': page})
+
+
+def measure(label, size, fanout, details):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    items = [details(item) for page in graph_pages(size, fanout) for item in json.loads(page)['value']]
+    items_bytes = tracemalloc.get_traced_memory()[0]
+    tree = TreeIndex(items)
+    tree_bytes = tracemalloc.get_traced_memory()[0] - items_bytes
+
+    seconds = time.perf_counter() - start
+    tracemalloc.stop()
+    print(f'  {label:<10} items {items_bytes / 2 ** 20:>9.1f} MiB ({items_bytes / size:>5.0f} B/item)   '
+          f'tree index {tree_bytes / 2 ** 20:>8.1f} MiB   {seconds:>6.2f} s')
+    del items, tree
+    return items_bytes
+
+
+def run(sizes, fanout):
+    for size in sizes:
+        print(f'{size} items, {fanout} per folder')
+        dicts = measure('dict', size, fanout, dict_item_details)
+        records = measure('DriveItem', size, fanout, drive_item_details)
+        print(f'  DriveItem uses {records / dicts:.0%} of the memory of dicts')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--fanout', type=int, default=50)
+    args = parser.parse_args()
+
+    run(args.sizes, args.fanout)
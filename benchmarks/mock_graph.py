@@ -0,0 +1,503 @@
+#!/usr/local/bin/python3
+"""
+Local stand-in for the Microsoft Graph endpoints the Sharepoint client uses
+
+Serves a synthetic document library (one site, one drive) with configurable latency, page size,
+tree shape and 429 injection. Point the client at it with:
+    export SHAREPOINT_URL=http://127.0.0.1:8081
+    export SHAREPOINT_LOGIN_URL=http://127.0.0.1:8081
+
+Run from the repository root:
+    python -m benchmarks.mock_graph --port 8081 --latency 0.02 --throttle-rate 0.05
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlencode, urlparse
+from common.hashing import QuickXorHash
+
+site_name = 'Test Site'
+site_id = 'site-1'
+list_id = 'list-1'
+
+
+class MockDrive:
+    """
+    In-memory drive: a tree of `depth` folder levels, `fanout` subfolders and `files` documents
+    per folder, document content derived from the item id
+    """
+
+    def __init__(self, depth=3, fanout=4, files=10, file_size=64 * 1024, seed=0):
+        self.items = {}
+        self.content = {}
+        self.version = 0
+        self.deleted = {}
+        self.lock = threading.RLock()
+        self._rng = random.Random(seed)
+        self._next_id = 0
+        self.file_size = file_size
+
+        self.root = self.add('root', None, folder=True, item_id='root')
+        folders = [self.root]
+        for level in range(depth + 1):
+            next_folders = []
+            for folder in folders:
+                for i in range(files):
+                    self.add(f'Document {level}-{i}.docx', folder['id'])
+                if level < depth:
+                    next_folders.extend(self.add(f'Folder {level}-{i}', folder['id'], folder=True) for i in range(fanout))
+            folders = next_folders
+
+    def add(self, name, parent_id, folder=False, item_id=None, content=None):
+        with self.lock:
+            self._next_id += 1
+            self.version += 1
+            item_id = item_id or f'item-{self._next_id}'
+            created = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(hours=self._rng.randrange(24 * 365))
+            item = {'id': item_id, 'name': name, 'parent_id': parent_id, 'folder': folder,
+                    'created': created, 'modified': created, 'version': self.version}
+            self.items[item_id] = item
+            if not folder:
+                self.set_content(item, content if content is not None else self.generate(item_id))
+            return item
+
+    def generate(self, item_id):
+        block = hashlib.sha256(item_id.encode()).digest()
+        return (block * (self.file_size // len(block) + 1))[:self.file_size]
+
+    def set_content(self, item, content):
+        self.content[item['id']] = content
+        item['size'] = len(content)
+        item['quickxor'] = QuickXorHash(content).b64digest()
+        item['etag'] = f'"{{{item["id"]}}},{item["version"]}"'
+
+    def touch(self, item):
+        self.version += 1
+        item['version'] = self.version
+        item['modified'] = datetime.now(timezone.utc)
+        if not item['folder']:
+            item['etag'] = f'"{{{item["id"]}}},{item["version"]}"'
+
+    def children(self, parent_id):
+        with self.lock:
+            return [item for item in self.items.values() if item['parent_id'] == parent_id]
+
+    def by_path(self, path):
+        with self.lock:
+            item = self.root
+            for name in [part for part in unquote(path).split('/') if part]:
+                item = next((child for child in self.children(item['id']) if child['name'] == name), None)
+                if item is None:
+                    return None
+            return item
+
+    def remove(self, item_id):
+        with self.lock:
+            for child in self.children(item_id):
+                self.remove(child['id'])
+            item = self.items.pop(item_id)
+            self.content.pop(item_id, None)
+            self.version += 1
+            self.deleted[item_id] = self.version
+            return item
+
+
+class MockGraph:
+    """
+    Threaded HTTP server emulating Graph and the Azure AD token endpoint over a MockDrive
+
+    :param latency: seconds added to every request (plus up to `jitter` seconds)
+    :param page_size: largest page returned for collections, whatever $top asks for
+    :param throttle_rate: fraction of Graph requests answered with 429 and Retry-After
+    """
+
+    def __init__(self, drive=None, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, page_size=200,
+                 throttle_rate=0.0, retry_after=1):
+        self.drive = drive or MockDrive()
+        self.latency = latency
+        self.jitter = jitter
+        self.page_size = page_size
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.requests = 0
+        self.throttled = 0
+        self.upload_sessions = {}
+        self._rng = random.Random(1)
+        self._lock = threading.Lock()
+
+        mock = self
+
+        class Handler(GraphHandler):
+            graph = mock
+
+        self.server = GraphServer((host, port), Handler)
+        self.url = f'http://{host}:{self.server.server_port}'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def should_throttle(self):
+        with self._lock:
+            self.requests += 1
+            if self.throttle_rate and self._rng.random() < self.throttle_rate:
+                self.throttled += 1
+                return True
+        return False
+
+    # driveItem / listItem json
+    def drive_item(self, item, select=None):
+        parent = self.drive.items.get(item['parent_id'])
+        body = {
+            'id': item['id'],
+            'name': item['name'],
+            'size': item.get('size', 0),
+            'createdDateTime': item['created'].strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'lastModifiedDateTime': item['modified'].strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'eTag': item.get('etag', f'"{{{item["id"]}}},{item["version"]}"'),
+            'cTag': f'"c:{{{item["id"]}}},{item["version"]}"',
+            'parentReference': {'driveId': 'drive-1', 'id': parent['id'] if parent else None}
+        }
+        if item['id'] == 'root':
+            body['root'] = {}
+        if item['folder']:
+            body['folder'] = {'childCount': len(self.drive.children(item['id']))}
+        else:
+            body['file'] = {'mimeType': 'application/octet-stream', 'hashes': {'quickXorHash': item['quickxor']}}
+            body['@microsoft.graph.downloadUrl'] = f"{self.url}/download/{item['id']}"
+        if select:
+            body = {key: value for key, value in body.items() if key in select}
+        return body
+
+    def list_item(self, item):
+        content_type = 'Folder' if item['folder'] else 'Document'
+        return {'id': f"li-{item['id']}", 'contentType': {'name': content_type},
+                'driveItem': self.drive_item(item), 'fields': {'ContentType': content_type}}
+
+    def page(self, path, query, items):
+        """A page of a collection with an @odata.nextLink to the rest"""
+        top = min(int(query.get('$top', self.page_size)), self.page_size)
+        skip = int(query.get('$skiptoken', 0))
+        body = {'value': items[skip:skip + top]}
+        if skip + top < len(items):
+            body['@odata.nextLink'] = f"{self.url}{path}?{urlencode({**query, '$skiptoken': skip + top})}"
+        return body
+
+    def handle(self, method, path, query, headers, body):
+        """Dispatches one request, returning (status, headers, json body or bytes)"""
+        if path.endswith('/oauth2/v2.0/token'):
+            return 200, {}, {'token_type': 'Bearer', 'expires_in': 3599, 'access_token': 'mock-token'}
+
+        if self.should_throttle():
+            return 429, {'Retry-After': str(self.retry_after)}, {'error': {'code': 'TooManyRequests'}}
+
+        if path.startswith('/download/'):
+            return self.download(path.split('/')[-1], headers)
+        if path.startswith('/upload/'):
+            return self.upload(method, path.split('/')[-1], headers, body)
+        if path == '/v1.0/$batch':
+            return self.batch(json.loads(body))
+
+        for pattern, handler in self.routes:
+            match = re.fullmatch(pattern, path.split('/v1.0', 1)[-1])
+            if match and method in handler:
+                return handler[method](self, query, headers, body, *map(unquote, match.groups()))
+
+        return 404, {}, {'error': {'code': 'itemNotFound', 'message': f'{method} {path}'}}
+
+    def collection(self, path, query, items, list_items=False):
+        items = sorted(items, key=lambda item: item['id'])
+        items = [item for item in items if matches_filter(item, query.get('$filter'), list_items)]
+        select = query['$select'].split(',') if query.get('$select') else None
+        values = [self.list_item(item) if list_items else self.drive_item(item, select) for item in items]
+        return 200, {}, self.page(path, query, values)
+
+    def sites(self, query, headers, body):
+        return 200, {}, {'value': [{'displayName': site_name, 'id': f'mock.sharepoint.com,{site_id},web-1'}]}
+
+    def root(self, query, headers, body, site):
+        return 200, {}, self.drive_item(self.drive.root)
+
+    def by_path(self, query, headers, body, site, path):
+        item = self.drive.by_path(path)
+        if item is None:
+            return 404, {}, {'error': {'code': 'itemNotFound'}}
+        return 200, {}, self.drive_item(item, query['$select'].split(',') if query.get('$select') else None)
+
+    def path_children(self, query, headers, body, site, path):
+        folder = self.drive.by_path(path)
+        if folder is None:
+            return 404, {}, {'error': {'code': 'itemNotFound'}}
+        return self.collection(f'/v1.0/sites/{site}/drive/root:/{path}:/children', query, self.drive.children(folder['id']))
+
+    def children(self, query, headers, body, site, item_id):
+        if item_id not in self.drive.items:
+            return 404, {}, {'error': {'code': 'itemNotFound'}}
+        return self.collection(f'/v1.0/sites/{site}/drive/items/{item_id}/children', query, self.drive.children(item_id))
+
+    def search(self, query, headers, body, site, text):
+        found = [item for item in list(self.drive.items.values()) if text.lower() in item['name'].lower()]
+        return self.collection(f"/v1.0/sites/{site}/drive/root/search(q='{text}')", query, found)
+
+    def lists(self, query, headers, body, site):
+        return 200, {}, self.page(f'/v1.0/sites/{site}/lists', query, [{'id': list_id, 'name': 'Documents'}])
+
+    def list_items(self, query, headers, body, site, list_name):
+        items = [item for item in list(self.drive.items.values()) if item['id'] != 'root']
+        return self.collection(f'/v1.0/sites/{site}/lists/{list_name}/items', query, items, list_items=True)
+
+    def delta(self, query, headers, body, site):
+        since = int(query.get('token', 0))
+        with self.drive.lock:
+            changed = [item for item in self.drive.items.values() if item['version'] > since]
+            deleted = [{'id': item_id, 'deleted': {'state': 'deleted'}, 'parentReference': {}}
+                       for item_id, version in self.drive.deleted.items() if version > since and since]
+            version = self.drive.version
+        status, response_headers, page = self.collection(f'/v1.0/sites/{site}/drive/root/delta', query, changed)
+        if '@odata.nextLink' not in page:
+            page['value'].extend(deleted)
+            # like Graph, the delta link carries the query of the original request
+            delta_query = {key: value for key, value in query.items() if key not in ('$skiptoken', 'token')}
+            page['@odata.deltaLink'] = f"{self.url}/v1.0/sites/{site}/drive/root/delta?{urlencode({**delta_query, 'token': version})}"
+        return status, response_headers, page
+
+    def get_item(self, query, headers, body, site, item_id):
+        item = self.drive.items.get(item_id)
+        if item is None:
+            return 404, {}, {'error': {'code': 'itemNotFound'}}
+        return 200, {}, self.drive_item(item, query['$select'].split(',') if query.get('$select') else None)
+
+    def update_item(self, query, headers, body, site, item_id):
+        changes = body if isinstance(body, dict) else json.loads(body)
+        with self.drive.lock:
+            item = self.drive.items.get(item_id)
+            if item is None:
+                return 404, {}, {'error': {'code': 'itemNotFound'}}
+            if changes.get('parentReference', {}).get('id'):
+                item['parent_id'] = changes['parentReference']['id']
+            if changes.get('name'):
+                item['name'] = changes['name']
+            self.drive.touch(item)
+            return 200, {}, self.drive_item(item)
+
+    def delete_item(self, query, headers, body, site, item_id):
+        if item_id not in self.drive.items:
+            return 404, {}, {'error': {'code': 'itemNotFound'}}
+        self.drive.remove(item_id)
+        return 204, {}, None
+
+    def copy_item(self, query, headers, body, site, item_id):
+        changes = body if isinstance(body, dict) else json.loads(body)
+        with self.drive.lock:
+            item = self.drive.items.get(item_id)
+            if item is None or item['folder']:
+                return 404, {}, {'error': {'code': 'itemNotFound'}}
+            self.drive.add(changes.get('name') or item['name'], changes['parentReference']['id'],
+                           content=self.drive.content[item_id])
+        return 202, {'Location': f'{self.url}/monitor/{item_id}'}, None
+
+    def content(self, query, headers, body, site, item_id):
+        item = self.drive.items.get(item_id)
+        if item is None:
+            return 404, {}, {'error': {'code': 'itemNotFound'}}
+        if headers.get('If-None-Match') == item['etag']:
+            return 304, {'ETag': item['etag']}, None
+        return self.download(item_id, headers)
+
+    def put_content(self, query, headers, body, site, parent_id, name):
+        return 201, {}, self.drive_item(self.store(parent_id, name, body))
+
+    def create_upload_session(self, query, headers, body, site, parent_id, name):
+        session_id = hashlib.sha1(f'{parent_id}/{name}/{time.time()}'.encode()).hexdigest()
+        self.upload_sessions[session_id] = {'parent_id': parent_id, 'name': name, 'data': bytearray()}
+        return 200, {}, {'uploadUrl': f'{self.url}/upload/{session_id}',
+                         'expirationDateTime': (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()}
+
+    def store(self, parent_id, name, content):
+        with self.drive.lock:
+            existing = next((item for item in self.drive.children(parent_id) if item['name'] == name), None)
+            if existing:
+                self.drive.touch(existing)
+                self.drive.set_content(existing, bytes(content))
+                return existing
+            return self.drive.add(name, parent_id, content=bytes(content))
+
+    def download(self, item_id, headers):
+        content = self.drive.content.get(item_id)
+        if content is None:
+            return 404, {}, {'error': {'code': 'itemNotFound'}}
+        item = self.drive.items[item_id]
+        response_headers = {'ETag': item['etag'], 'Accept-Ranges': 'bytes',
+                            'Content-Disposition': f'attachment; filename="{item["name"]}"'}
+
+        byte_range = re.fullmatch(r'bytes=(\d*)-(\d*)', headers.get('Range', ''))
+        if byte_range:
+            start = int(byte_range.group(1) or 0)
+            end = min(int(byte_range.group(2) or len(content) - 1), len(content) - 1)
+            response_headers['Content-Range'] = f'bytes {start}-{end}/{len(content)}'
+            return 206, response_headers, content[start:end + 1]
+        return 200, response_headers, content
+
+    def upload(self, method, session_id, headers, body):
+        session = self.upload_sessions.get(session_id)
+        if session is None:
+            return 404, {}, {'error': {'code': 'itemNotFound'}}
+        if method == 'GET':
+            return 200, {}, {'nextExpectedRanges': [f"{len(session['data'])}-"]}
+        if method == 'DELETE':
+            self.upload_sessions.pop(session_id)
+            return 204, {}, None
+
+        # '*': the total size is not known yet, the last chunk gives it
+        start, end, total = re.fullmatch(r'bytes (\d+)-(\d+)/(\d+|\*)', headers['Content-Range']).groups()
+        start, end = int(start), int(end)
+        if start != len(session['data']):
+            return 416, {}, {'error': {'code': 'invalidRange'}}
+        session['data'].extend(body)
+        if total == '*' or end + 1 < int(total):
+            return 202, {}, {'nextExpectedRanges': [f'{end + 1}-']}
+
+        self.upload_sessions.pop(session_id)
+        return 201, {}, self.drive_item(self.store(session['parent_id'], session['name'], session['data']))
+
+    def batch(self, body):
+        responses = []
+        for request in body['requests']:
+            url = urlparse(request['url'])
+            try:
+                status, headers, response = self.handle(request['method'], '/v1.0' + url.path, parse_query(url.query),
+                                                        request.get('headers', {}), request.get('body'))
+            except DuplicateQueryOption as e:
+                status, headers, response = e.response()
+            responses.append({'id': request['id'], 'status': status, 'headers': headers,
+                              'body': response if not isinstance(response, bytes) else None})
+        return 200, {}, {'responses': responses}
+
+    routes = [
+        (r'/sites', {'GET': sites}),
+        (r'/sites/([^/]+)/drive/root', {'GET': root}),
+        (r'/sites/([^/]+)/drive/root/delta', {'GET': delta}),
+        (r"/sites/([^/]+)/drive/root/search\(q='(.*)'\)", {'GET': search}),
+        (r'/sites/([^/]+)/drive/root:/(.*?):/children', {'GET': path_children}),
+        (r'/sites/([^/]+)/drive/root:/(.*?):?', {'GET': by_path}),
+        (r'/sites/([^/]+)/drive/items/([^/:]+)', {'GET': get_item, 'PATCH': update_item, 'DELETE': delete_item}),
+        (r'/sites/([^/]+)/drive/items/([^/:]+)/children', {'GET': children}),
+        (r'/sites/([^/]+)/drive/items/([^/:]+)/content', {'GET': content}),
+        (r'/sites/([^/]+)/drive/items/([^/:]+)/copy', {'POST': copy_item}),
+        (r'/sites/([^/]+)/drive/items/([^/:]+):/(.+?):/content', {'PUT': put_content}),
+        (r'/sites/([^/]+)/drive/items/([^/:]+):/(.+?):/createUploadSession', {'POST': create_upload_session}),
+        (r'/sites/([^/]+)/lists', {'GET': lists}),
+        (r'/sites/([^/]+)/lists/([^/]+)/items', {'GET': list_items}),
+    ]
+
+
+class DuplicateQueryOption(ValueError):
+    """Graph answers 400 when a query option is given more than once"""
+
+    def response(self):
+        message = f"Query option '{self.args[0]}' was specified more than once, but it must be specified at most once."
+        return 400, {}, {'error': {'code': 'BadRequest', 'message': message}}
+
+
+def parse_query(query):
+    parsed = {}
+    for key, values in parse_qs(query).items():
+        if len(values) > 1:
+            raise DuplicateQueryOption(key)
+        parsed[key] = values[0]
+    return parsed
+
+
+def matches_filter(item, expression, list_items=False):
+    """The subset of $filter the client builds: content type and date comparisons joined with 'and'"""
+    if not expression:
+        return True
+    for condition in expression.split(' and '):
+        field, operator, value = condition.split(' ', 2)
+        value = value.strip("'")
+        if field in ('file', 'folder'):
+            holds = (field == 'folder') == item['folder']
+        elif field == 'fields/ContentType':
+            holds = ('Folder' if item['folder'] else 'Document') == value
+        elif field in ('createdDateTime', 'lastModifiedDateTime', 'fields/Created', 'fields/Modified'):
+            actual = item['created'] if 'reated' in field else item['modified']
+            limit = datetime.fromisoformat(value.replace('Z', '+00:00'))
+            holds = actual >= limit if operator == 'ge' else actual < limit
+        else:
+            continue
+        if not holds:
+            return False
+    return True
+
+
+class GraphServer(ThreadingHTTPServer):
+    # concurrent clients connect in bursts, the default listen backlog of 5 drops SYNs that are only retried after 1s
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class GraphHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are separate writes, Nagle + delayed ACK would add ~40ms to every response
+    disable_nagle_algorithm = True
+    graph = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        if self.graph.latency or self.graph.jitter:
+            time.sleep(self.graph.latency + random.uniform(0, self.graph.jitter))
+
+        try:
+            status, headers, payload = self.graph.handle(self.command, url.path, parse_query(url.query), self.headers, body)
+        except DuplicateQueryOption as e:
+            status, headers, payload = e.response()
+        if isinstance(payload, (dict, list)):
+            payload = json.dumps(payload).encode()
+            headers = {'Content-Type': 'application/json', **headers}
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload or b'')))
+        self.end_headers()
+        if payload and self.command != 'HEAD':
+            self.wfile.write(payload)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_HEAD = respond
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many extra seconds per request')
+    parser.add_argument('--page-size', type=int, default=200)
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of requests answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--files', type=int, default=10, help='documents per folder')
+    parser.add_argument('--file-size', type=int, default=64 * 1024)
+    args = parser.parse_args()
+
+    drive = MockDrive(args.depth, args.fanout, args.files, args.file_size)
+    graph = MockGraph(drive, port=args.port, latency=args.latency, jitter=args.jitter, page_size=args.page_size,
+                      throttle_rate=args.throttle_rate, retry_after=args.retry_after)
+    print(f'mock Graph serving {len(drive.items)} items on {graph.url}')
+    graph.server.serve_forever()
@@ -0,0 +1,81 @@
+#!/usr/local/bin/python3
+"""
+Micro-benchmark for TreeIndex over synthetic folder trees
+
+Run from the repository root:
+    python -m benchmarks.tree_index
+    python -m benchmarks.tree_index --sizes 10000 100000 --fanout 5
+"""
+import argparse
+import random
+import sys
+import time
+from common.tree import TreeIndex
+
+
+def synthetic_items(size, fanout, folder_ratio=0.3, seed=0):
+    """Flat list of items shaped like list_drives_and_items output, parents always listed first"""
+    rng = random.Random(seed)
+    items = [{'name': 'Root Drive', 'id': 'root', 'parent_id': None, 'content_type': 'Folder'}]
+    folders = ['root']
+    child_counts = {'root': 0}
+
+    for i in range(1, size):
+        # attach to a recent folder that still has room, so depth grows with size
+        parent_id = folders[rng.randrange(max(len(folders) - fanout, 0), len(folders))]
+        if child_counts[parent_id] >= fanout * 4:
+            parent_id = folders[-1]
+        child_counts[parent_id] += 1
+
+        content_type = 'Folder' if rng.random() < folder_ratio else 'Document'
+        item_id = f'item-{i}'
+        items.append({'name': f'{content_type}-{i}', 'id': item_id, 'parent_id': parent_id, 'content_type': content_type})
+        if content_type == 'Folder':
+            folders.append(item_id)
+            child_counts[item_id] = 0
+
+    return items
+
+
+def deep_chain(size):
+    """One folder nested inside the next, far beyond the recursion limit"""
+    return [{'name': f'Folder-{i}', 'id': i, 'parent_id': i - 1 if i else None, 'content_type': 'Folder'} for i in range(size)]
+
+
+def timed(label, fn):
+    start = time.perf_counter()
+    result = fn()
+    print(f'  {label:<28} {(time.perf_counter() - start) * 1000:>10.1f} ms')
+    return result
+
+
+def run(sizes, fanout):
+    for size in sizes:
+        items = synthetic_items(size, fanout)
+        deepest = items[-1]['id']
+        print(f'{size} items (fanout ~{fanout})')
+
+        tree = timed('build', lambda: TreeIndex(items))
+        timed('children x 10k', lambda: [tree.children(item['id']) for item in items[:10000]])
+        descendants = timed('bfs all descendants', lambda: sum(1 for _ in tree.iter_descendants('root')))
+        timed('dfs all descendants', lambda: sum(1 for _ in tree.iter_descendants('root', order='dfs')))
+        timed('subtree counts (first)', lambda: tree.subtree_count('root'))
+        timed('subtree counts (cached)', lambda: tree.subtree_count(deepest))
+        depth = timed('ancestors of last item', lambda: sum(1 for _ in tree.ancestors(deepest)))
+        timed('path of last item', lambda: tree.path(deepest))
+        print(f'  descendants: {descendants}, depth of last item: {depth}')
+
+    chain_size = max(sys.getrecursionlimit() * 10, 10000)
+    print(f'{chain_size} items in a single chain')
+    chain = TreeIndex(deep_chain(chain_size))
+    timed('dfs all descendants', lambda: sum(1 for _ in chain.iter_descendants(0, order='dfs')))
+    timed('subtree counts', lambda: chain.subtree_count(0))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--fanout', type=int, default=10)
+    args = parser.parse_args()
+
+    run(args.sizes, args.fanout)
@@ -0,0 +1,528 @@
+#!/usr/local/bin/python3
+import asyncio
+import cgi
+import contextlib
+import hashlib
+import os
+import time
+import weakref
+import aiohttp
+import common.logger as logger_common
+import common.session as session_common
+import common.throttle as throttle_common
+import common.metrics as metrics_common
+from common.token_cache import token_cache, token_key
+from common.graph import sharepoint_url, login_url, default_page_size, GraphRequestError, drive_item_details, drive_item_select, odata_query
+
+max_concurrency = int(os.getenv('ASYNC_MAX_CONCURRENCY', 50))
+download_chunk_size = 1024 * 1024
+
+# one semaphore per tenant (per event loop) caps in-flight Graph requests across all clients of that tenant
+_tenant_semaphores = weakref.WeakKeyDictionary()
+
+
+def tenant_semaphore(tenant_id, limit=max_concurrency):
+    semaphores = _tenant_semaphores.setdefault(asyncio.get_running_loop(), {})
+    if tenant_id not in semaphores:
+        semaphores[tenant_id] = asyncio.Semaphore(limit)
+    return semaphores[tenant_id]
+
+
+class AsyncSharepoint:
+    """
+    asyncio counterpart of Sharepoint, built on aiohttp
+
+    async with AsyncSharepoint(tenant_id, client_id, client_secret) as sharepoint:
+        site_id = await sharepoint.get_site_id_by_name('Test Site')
+        async for item in sharepoint.iter_drive_items_by_path(site_id, '/Three/Nested/Folders'):
+            ...
+
+    Methods mirror Sharepoint: failures are logged and return None. In-flight requests are capped
+    per tenant by ASYNC_MAX_CONCURRENCY, and paced and retried with the same rate limiter and
+    backoff policy as the sync client (common/throttle.py).
+    """
+
+    def __init__(self, tenant_id, client_id, client_secret, session=None, max_concurrency=max_concurrency):
+        self.grant_type = 'client_credentials'
+        self.tenant_id = tenant_id
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.scope = f"{sharepoint_url}/.default"
+        self.max_concurrency = max_concurrency
+        self.session = session
+        # an injected session (e.g. AsyncClientRegistry's shared one) belongs to the caller and is never closed here
+        self._owns_session = session is None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def get_session(self):
+        # aiohttp sessions must be created inside the running loop
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=session_common.pool_size, force_close=not session_common.keep_alive)
+            self.session = aiohttp.ClientSession(connector=connector, auto_decompress=True)
+            self._owns_session = True
+        return self.session
+
+    async def close(self):
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+
+    # SHAREPOINT LOGIN (shares the token cache with the sync client)
+    async def login(self):
+        return await token_cache.get_token_async(token_key(self.tenant_id, self.client_id, self.client_secret, self.scope), self.fetch_access_token)
+
+    async def fetch_access_token(self):
+        data = {
+            'grant_type': self.grant_type,
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'scope': self.scope
+        }
+
+        try:
+            async with self.get_session().post(f'{login_url}/{self.tenant_id}/oauth2/v2.0/token', data=data) as response:
+
+                # check rest request was successful
+                if response.status in (200, 201, 204):
+                    logger_common.logger.info(
+                        f'logged into sharepoint with application id: {self.client_id}. Response: {response.status}')
+                    return await response.json()
+
+                # if rest request unsuccessful
+                else:
+                    logger_common.logger.error(
+                        f'cannot login to sharepoint with application id: {self.client_id}. Error: {response.status} - {await response.read()}')
+
+        # if attempt at rest request failed or above failed to return results
+        except Exception as e:
+            logger_common.logger.error(e, exc_info=True)
+            logger_common.logger.error(
+                f'cannot login to sharepoint with application id: {self.client_id}')
+
+    async def get_header(self, extra_headers={}):
+        access_token = await self.login()
+        return {
+            "Authorization": "Bearer " + access_token,
+            "Content-Type": "application/json",
+            "If-Match": '*',
+            **extra_headers
+        }
+
+    @contextlib.asynccontextmanager
+    async def send(self, method, url, headers, **kwargs):
+        """
+        Opens a Graph response under the tenant's concurrency cap and rate limiter, retrying throttled
+        requests (honouring Retry-After) and failed idempotent ones with jittered backoff.
+        The tenant's slot is given back once the response headers arrive, reading or relaying the
+        body does not hold it.
+        """
+        limiter = throttle_common.limiter_for(self.tenant_id)
+        semaphore = tenant_semaphore(self.tenant_id, self.max_concurrency)
+        data = kwargs.get('data')
+        replayable = data is None or isinstance(data, (bytes, str)) or hasattr(data, 'seek')
+        position = data.tell() if hasattr(data, 'seek') else None
+
+        for attempt in range(throttle_common.max_retries + 1):
+            if attempt and position is not None:
+                data.seek(position)
+
+            can_retry = attempt < throttle_common.max_retries and replayable
+            error = None
+            async with semaphore:
+                await asyncio.sleep(limiter.acquire())
+                try:
+                    with metrics_common.GraphCall(method, url, throttle_common.body_size(data)) as call:
+                        response = await self.get_session().request(method, url, headers=headers, **kwargs)
+                        call.done(response.status, response.headers)
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    if not (can_retry and method in throttle_common.idempotent_methods):
+                        raise
+                    error = e
+
+            if error is not None:
+                logger_common.logger.error(f'{method} {url} failed, retrying. Error: {error}')
+                metrics_common.graph_retries.inc(reason='connection_error')
+                await asyncio.sleep(throttle_common.backoff_delay(attempt))
+                continue
+
+            retry_after = throttle_common.parse_retry_after(response.headers.get('Retry-After'))
+            throttled = throttle_common.is_throttled(response.status, response.headers)
+            if throttled:
+                limiter.on_throttled(retry_after)
+            elif response.status < 400:
+                limiter.on_success()
+
+            if not can_retry or not (throttled or (response.status in throttle_common.retry_statuses
+                                                   and method in throttle_common.idempotent_methods)):
+                async with response:
+                    yield response
+                return
+
+            delay = throttle_common.backoff_delay(attempt, retry_after)
+            logger_common.logger.error(f'{method} {url} returned {response.status}, retrying in {delay:.1f}s')
+            metrics_common.graph_retries.inc(reason='throttled' if throttled else 'server_error')
+            await response.read()
+            response.release()
+            await asyncio.sleep(delay)
+
+    async def request_json(self, method, url, extra_headers={}, **kwargs):
+        """
+        Sends one Graph request through send()
+
+        :return (status, parsed json body or None)
+        """
+        header = await self.get_header(extra_headers)
+        async with self.send(method, url, header, **kwargs) as response:
+            if response.status in (200, 201, 204):
+                body = await response.json() if response.content_type == 'application/json' else None
+                return response.status, body
+            return response.status, await response.read()
+
+    # Follow @odata.nextLink and yield each item of a collection as its page arrives
+    async def iter_collection(self, url, extra_headers={}, page_size=None, select=None, filter=None, orderby=None, expand=None):
+        params = odata_query(select, filter, orderby, page_size or default_page_size, expand)
+
+        while url:
+            status, body = await self.request_json('GET', url, extra_headers, params=params)
+
+            # check rest request was successful
+            if status in (200, 201, 204):
+                logger_common.logger.info(
+                    f'retrieved page of {len(body.get("value", []))} items. Info: {status}')
+                for item in body.get('value', []):
+                    yield item
+
+                # the next link already carries the original query
+                url = body.get('@odata.nextLink')
+                params = None
+
+            # if rest request unsuccessful
+            else:
+                raise GraphRequestError(f'cannot get page: {url}. Error: {status} - {body}')
+
+    async def get_site_id_by_name(self, site_name):
+        try:
+            site_id = None
+            # search for site name and return first one
+            async for site in self.iter_collection(f"{sharepoint_url}/v1.0/sites?search={site_name}"):
+                if site['displayName'] == site_name:
+                    site_id = site['id'].split(",")[1]
+
+            logger_common.logger.info(f'retrieved sharepoint site: {site_name}')
+            return site_id
+
+        # if attempt at rest request failed or above failed to return results
+        except Exception as e:
+            logger_common.logger.error(e, exc_info=True)
+            logger_common.logger.error(
+                f'cannot get sharepoint site:  {site_name}')
+
+    # Get name and ID of root drive
+    async def get_root_drive_details(self, site_id):
+        try:
+            status, body = await self.request_json('GET', f"{sharepoint_url}/v1.0/sites/{site_id}/drive/root")
+
+            # check rest request was successful
+            if status in (200, 201, 204):
+                logger_common.logger.info(
+                    f'retrieved root drive details. Info: {status}')
+                return {
+                    "name": body.get('name'),
+                    "id": body.get('id')
+                }
+
+            # if rest request unsuccessful
+            else:
+                logger_common.logger.error(
+                    f'cannot get folder: root drive. Error: {status} - {body}')
+
+        # if attempt at rest request failed or above failed to return results
+        except Exception as e:
+            logger_common.logger.error(e, exc_info=True)
+            logger_common.logger.error(
+                f'cannot get root drive details.')
+
+    # Get Name and ID of Sharepoint List(s)
+    async def iter_list_details(self, site_id, page_size=None):
+        async for item in self.iter_collection(
+                f"{sharepoint_url}/v1.0/sites/{site_id}/lists",
+                {"Prefer": 'allowthrottleablequeries'}, page_size):
+            yield {'name': item['name'], 'id': item['id']}
+
+    async def get_list_details(self, site_id, list_name=[], page_size=None):
+        try:
+            return [item async for item in self.iter_list_details(site_id, page_size)
+                    if len(list_name) == 0 or item['name'] in list_name]
+
+        except Exception as e:
+            logger_common.logger.error(e, exc_info=True)
+            logger_common.logger.error(
+                f'cannot get list: details')
+
+    async def get_drive_id_by_name(self, site_id, drive_name):
+        try:
+            drive_id = ""
+            # search for folder name and return id
+            async for drive in self.iter_collection(f"{sharepoint_url}/v1.0/sites/{site_id}/drive/root/search(q='{drive_name}')"):
+                if drive['name'] == drive_name:
+                    drive_id = drive['id']
+
+            logger_common.logger.info(f'retrieved folder: {drive_name}')
+            return drive_id
+
+        # if attempt at rest request failed or above failed to return results
+        except Exception as e:
+            logger_common.logger.error(e, exc_info=True)
+            logger_common.logger.error(
+                f'cannot get folder:  {drive_name}')
+
+    # List folder and file details by path
+    async def iter_drive_items_by_path(self, site_id, drive_path, page_size=None, select=drive_item_select, include=None, orderby=None):
+        async for item in self.iter_collection(
+                f"{sharepoint_url}/v1.0/sites/{site_id}/drive/root:/{drive_path}:/children",
+                page_size=page_size, select=select, orderby=orderby):
+            # filtered here, /children of SharePoint drives cannot evaluate $filter (see odata_filter)
+            details = drive_item_details(item)
+            if not include or include(details):
+                yield details
+
+    async def list_drive_items_by_path(self, site_id, drive_path, page_size=None, include=None, orderby=None):
+        try:
+            return [item async for item in self.iter_drive_items_by_path(site_id, drive_path, page_size, include=include, orderby=orderby)]
+
+        except Exception as e:
+            logger_common.logger.error(e, exc_info=True)
+            logger_common.logger.error(
+                f'Cannot get items in drive path: {drive_path}')
+
+    async def iter_drive_items_by_id(self, site_id, drive_id, page_size=None, select=drive_item_select, include=None, orderby=None):
+        async for item in self.iter_collection(
+                f"{sharepoint_url}/v1.0/sites/{site_id}/drive/items/{drive_id}/children",
+                page_size=page_size, select=select, orderby=orderby):
+            # filtered here, /children of SharePoint drives cannot evaluate $filter (see odata_filter)
+            details = drive_item_details(item)
+            if not include or include(details):
+                yield details
+
+    async def list_drive_items_by_id(self, site_id, drive_id, page_size=None, include=None, orderby=None):
+        try:
+            return [item async for item in self.iter_drive_items_by_id(site_id, drive_id, page_size, include=include, orderby=orderby)]
+
+        except Exception as e:
+            logger_common.logger.error(e, exc_info=True)
+            logger_common.logger.error(
+                f'Cannot list items in for drive id: {drive_id}')
+
+    async def get_item_id_by_name(self, site_id, drive_id, item_name, page_size=None):
+        try:
+            # search for item name and return id, stopping at the first page that has it
+            async for item in self.iter_drive_items_by_id(site_id, drive_id, page_size):
+                if item['name'] == item_name:
+                    return item['id']
+            return ""
+
+        # if attempt at rest request failed or above failed to return results
+        except Exception as e:
+            logger_common.logger.error(e, exc_info=True)
+            logger_common.logger.error(
+                f'cannot get item:  {item_name}')
+
+    async def download_item_by_id(self, site_id, item_id, local_file_directory):
+        try:
+            header = await self.get_header()
+            async with self.send(
+                    'GET', f"{sharepoint_url}/v1.0/sites/{site_id}/drive/items/{item_id}/content",
+                    header) as response:
+
+                # if rest request unsuccessful
+                if response.status not in (200, 201, 204):
+                    logger_common.logger.error(
+                        f'Could not download a file. Error: {response.status} - {await response.read()}')
+                    return
+
+                params = cgi.parse_header(response.headers.get('Content-Disposition', ''))[-1]
+                if 'filename' not in params:
+                    logger_common.logger.error(
+                        f'Could not find a file for download. Error: {response.status}')
+                    return
+
+                filename = os.path.basename(params['filename'])
+                abs_path = os.path.join(local_file_directory, filename)
+
+                # write in a thread so the event loop never blocks on disk
+                with open(abs_path, 'wb') as target:
+                    async for chunk in response.content.iter_chunked(download_chunk_size):
+                        await asyncio.to_thread(target.write, chunk)
+
+                logger_common.logger.info(
+                    f'downloaded item: {item_id}. Info: {response.status}')
+                return filename
+
+        # if attempt at rest request failed or above failed to return results
+        except Exception as e:
+            logger_common.logger.error(e, exc_info=True)
+            logger_common.logger.error(
+                f'Could not find a file for download')
+
+    # Open the content stream of an item (optionally a byte range of it) for relaying
+    @contextlib.asynccontextmanager
+    async def open_item_stream(self, site_id, item_id, range_header=None, if_range=None):
+        """
+        async with sharepoint.open_item_stream(site_id, item_id, 'bytes=0-1023') as response:
+            async for chunk in response.content.iter_chunked(download_chunk_size):
+                ...
+
+        Yields the aiohttp response (200, 206 or 416), or None if the item could not be opened
+        """
+        # relay the bytes as stored so Content-Length and ranges stay valid
+        extra_headers = {"Accept-Encoding": 'identity'}
+        if range_header:
+            extra_headers['Range'] = range_header
+        if if_range:
+            extra_headers['If-Range'] = if_range
+
+        async with contextlib.AsyncExitStack() as stack:
+            item_stream = None
+            try:
+                header = await self.get_header(extra_headers)
+                response = await stack.enter_async_context(self.send(
+                    'GET', f"{sharepoint_url}/v1.0/sites/{site_id}/drive/items/{item_id}/content", header))
+
+                # check rest request was successful (416: the requested range is outside the file)
+                if response.status in (200, 206, 416):
+                    logger_common.logger.info(
+                        f'opened item stream: {item_id}. Range: {range_header}. Info: {response.status}')
+                    item_stream = response
+
+                # if rest request unsuccessful
+                else:
+                    logger_common.logger.error(
+                        f'Could not open item stream. Error: {response.status} - {await response.read()}')
+
+            # if attempt at rest request failed or above failed to return results
+            except Exception as e:
+                logger_common.logger.error(e, exc_info=True)
+                logger_common.logger.error(
+                    f'Could not open item stream: {item_id}')
+
+            yield item_stream
+
+    async def move_item_to_new_drive(self, site_id, item_id, target_folder_id, target_file_name):
+        data = {
+            'parentReference': {
+                'id': target_folder_id
+            },
+            'name': target_file_name
+        }
+
+        try:
+            status, body = await self.request_json(
+                'PATCH', f"{sharepoint_url}/v1.0/sites/{site_id}/drive/items/{item_id}", json=data)
+
+            # check rest request was successful
+            if status in (200, 201, 204):
+                logger_common.logger.info(
+                    f'moved item: {item_id} to folder: {target_folder_id} with filename {target_file_name}. Info: {status}')
+                return body
+
+            # if rest request unsuccessful
+            else:
+                logger_common.logger.error(
+                    f'Could not move file. Error: {status} - {body}')
+
+        # if attempt at rest request failed or above failed to return results
+        except Exception as e:
+            logger_common.logger.error(e, exc_info=True)
+            logger_common.logger.error(
+                f'Could not move file')
+
+    async def upload_file_to_drive(self, site_id, local_file_path, local_file_name, target_drive_id, target_file_name):
+        file_path = os.path.join(local_file_path, local_file_name)
+
+        try:
+            # aiohttp reads file payloads in an executor, so the upload streams without blocking the loop
+            with open(file_path, 'rb') as data:
+                status, body = await self.request_json(
+                    'PUT', f"{sharepoint_url}/v1.0/sites/{site_id}/drive/items/{target_drive_id}:/{target_file_name}:/content",
+                    {"Content-Type": "application/octet-stream"}, data=data)
+
+            # check rest request was successful
+            if status in (200, 201, 204):
+                logger_common.logger.info(
+                    f'uploaded file: {file_path} to SharePoint folder: {target_drive_id} with filename {target_file_name}. Info: {status}')
+                return body
+
+            # if rest request unsuccessful
+            else:
+                logger_common.logger.error(
+                    f'Could not upload file. Error: {status} - {body}')
+
+        # if attempt at rest request failed or above failed to return results
+        except Exception as e:
+            logger_common.logger.error(e, exc_info=True)
+            logger_common.logger.error(
+                f'Could not upload file')
+
+    async def delete_item_by_id(self, site_id, item_id):
+        try:
+            status, body = await self.request_json('DELETE', f"{sharepoint_url}/v1.0/sites/{site_id}/drive/items/{item_id}")
+
+            # check rest request was successful
+            if status in (200, 201, 204):
+                logger_common.logger.info(
+                    f'deleted item: {item_id}. Info: {status}')
+                return True
+
+            # if rest request unsuccessful
+            else:
+                logger_common.logger.error(
+                    f'Could not delete item {item_id}. Error: {status} - {body}')
+
+        # if attempt at rest request failed or above failed to return results
+        except Exception as e:
+            logger_common.logger.error(e, exc_info=True)
+            logger_common.logger.error(
+                f'Could not delete item {item_id}')
+
+
+class AsyncClientRegistry:
+    """
+    Registry of AsyncSharepoint clients keyed by credentials, for a server running one event loop
+    per worker (see async_app.py). All clients share one aiohttp session, opened by start() and
+    closed by close(), so the connection pool is shared across tenants. Clients unused for
+    idle_timeout seconds are dropped.
+    """
+
+    def __init__(self, idle_timeout=900):
+        self.idle_timeout = idle_timeout
+        self.session = None
+        self._clients = {}
+
+    async def start(self):
+        # the tenant semaphores cap in-flight requests, the pool only needs to keep connections alive
+        connector = aiohttp.TCPConnector(limit=0, force_close=not session_common.keep_alive)
+        self.session = aiohttp.ClientSession(connector=connector, auto_decompress=True)
+
+    def get(self, tenant_id, client_id, client_secret):
+        key = (tenant_id, client_id, hashlib.sha256(client_secret.encode()).hexdigest())
+        now = time.monotonic()
+
+        for idle_key in [key for key, entry in self._clients.items() if now - entry['last_used'] > self.idle_timeout]:
+            self._clients.pop(idle_key)
+            logger_common.logger.info(f'evicted idle async sharepoint client for application id: {idle_key[1]}')
+
+        entry = self._clients.get(key)
+        if not entry:
+            entry = self._clients[key] = {'client': AsyncSharepoint(tenant_id, client_id, client_secret, session=self.session)}
+        entry['last_used'] = now
+
+        return entry['client']
+
+    async def close(self):
+        self._clients.clear()
+        if self.session is not None:
+            await self.session.close()
@@ -0,0 +1,227 @@
+#!/usr/local/bin/python3
+import time
+from concurrent.futures import Future
+import common.logger as logger_common
+import common.throttle as throttle_common
+from common.graph import sharepoint_url, default_page_size, GraphRequestError, drive_item_select
+
+# Graph accepts at most 20 sub-requests per $batch POST
+max_batch_size = 20
+retry_statuses = (429, 500, 502, 503, 504)
+
+
+class BatchFuture(Future):
+    """Future for one sub-request; asking for its result sends the batch it is queued in"""
+
+    def __init__(self, batch):
+        super().__init__()
+        self.batch = batch
+
+    def result(self, timeout=None):
+        if not self.done():
+            self.batch.flush()
+        return super().result(timeout)
+
+
+class GraphBatch:
+    """
+    Queues Graph sub-requests and sends them through /$batch, up to 20 per POST
+
+    with sharepoint.batch() as batch:
+        children = [batch.list_children(site_id, folder_id) for folder_id in folder_ids]
+    [future.result() for future in children]
+
+    Sub-requests that are throttled or fail with a server error are retried on their own
+    (up to max_retries times); requests chained with depends_on are always sent together.
+    """
+
+    def __init__(self, client, max_retries=3):
+        self.client = client
+        self.max_retries = max_retries
+        self._pending = []
+        self._futures = {}
+        self._next_id = 0
+        self._retry_delay = 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def add(self, method, url, body=None, headers=None, depends_on=None):
+        """
+        Queues a sub-request and returns its future
+
+        :param method: 'GET', 'POST', 'PATCH', 'PUT' or 'DELETE'
+        :param url: url relative to the Graph version, e.g. f"/sites/{site_id}/drive/items/{item_id}"
+        :param body: json body for POST/PATCH/PUT
+        :param depends_on: futures (from this batch) that must succeed before this request runs
+        :return BatchFuture resolving to the response body
+        """
+        depends_on = [future.request_id for future in depends_on or []]
+        if len(self._pending) >= max_batch_size and not set(depends_on) & {r['id'] for r in self._pending}:
+            self.flush()
+
+        self._next_id += 1
+        request = {'id': str(self._next_id), 'method': method, 'url': url}
+        if body is not None:
+            request['body'] = body
+            request['headers'] = {'Content-Type': 'application/json', **(headers or {})}
+        elif headers:
+            request['headers'] = headers
+        if depends_on:
+            request['dependsOn'] = depends_on
+
+        future = BatchFuture(self)
+        future.request_id = request['id']
+        self._pending.append(request)
+        self._futures[request['id']] = future
+
+        return future
+
+    def list_children(self, site_id, item_id, page_size=None):
+        return self.add('GET', f"/sites/{site_id}/drive/items/{item_id}/children?$top={page_size or default_page_size}&$select={drive_item_select}")
+
+    def get_item(self, site_id, item_id):
+        return self.add('GET', f"/sites/{site_id}/drive/items/{item_id}")
+
+    def move_item(self, site_id, item_id, target_folder_id, target_file_name, depends_on=None):
+        future = self.add('PATCH', f"/sites/{site_id}/drive/items/{item_id}",
+                          {'parentReference': {'id': target_folder_id}, 'name': target_file_name}, depends_on=depends_on)
+        return self._forget_when_done(future, site_id, item_id, target_file_name)
+
+    def copy_item(self, site_id, item_id, target_folder_id, target_file_name=None, depends_on=None):
+        # Graph copies asynchronously, the sub-request succeeds with 202 once the copy has been accepted
+        body = {'parentReference': {'id': target_folder_id}}
+        if target_file_name:
+            body['name'] = target_file_name
+        future = self.add('POST', f"/sites/{site_id}/drive/items/{item_id}/copy", body, depends_on=depends_on)
+        return self._forget_when_done(future, site_id, None, target_file_name)
+
+    def delete_item(self, site_id, item_id, depends_on=None):
+        future = self.add('DELETE', f"/sites/{site_id}/drive/items/{item_id}", depends_on=depends_on)
+        return self._forget_when_done(future, site_id, item_id)
+
+    def _forget_when_done(self, future, site_id, item_id, name=None):
+        # cached name -> id lookups of the client go stale once the change succeeds
+        future.add_done_callback(lambda done: done.exception() or self.client.forget_item(site_id, item_id, name))
+        return future
+
+    def flush(self):
+        """Sends every queued sub-request, retrying the failed ones individually"""
+        pending, self._pending = self._pending, []
+
+        for attempt in range(self.max_retries + 1):
+            if not pending:
+                break
+            if attempt:
+                time.sleep(self._retry_delay)
+
+            self._drop_completed_dependencies(pending)
+            self._retry_delay = 2 ** attempt
+            retries = []
+            for chunk in self._chunks(pending):
+                retries.extend(self._send(chunk))
+            pending = retries
+
+        for request in pending:
+            self._futures.pop(request['id']).set_exception(
+                GraphRequestError(f"gave up on batch request {request['method']} {request['url']} after {self.max_retries} retries"))
+
+    def _drop_completed_dependencies(self, requests):
+        # a dependency that is not in this send has already completed (or been flushed earlier)
+        request_ids = {request['id'] for request in requests}
+        for request in requests:
+            if 'dependsOn' in request:
+                request['dependsOn'] = [d for d in request['dependsOn'] if d in request_ids]
+                if not request['dependsOn']:
+                    del request['dependsOn']
+
+    def _chunks(self, requests):
+        """Splits requests into POST-sized chunks, keeping dependency chains in the same chunk"""
+        groups = {}
+        group_of = {}
+        for request in requests:
+            dependency_groups = sorted({group_of[d] for d in request.get('dependsOn', []) if d in group_of}, key=int)
+            group = dependency_groups[0] if dependency_groups else request['id']
+
+            # a request depending on several chains joins them into one
+            for other in dependency_groups[1:]:
+                for grouped in groups.pop(other):
+                    group_of[grouped['id']] = group
+                    groups[group].append(grouped)
+                groups[group].sort(key=lambda r: int(r['id']))
+
+            group_of[request['id']] = group
+            groups.setdefault(group, []).append(request)
+
+        chunk = []
+        for group in groups.values():
+            if len(group) > max_batch_size:
+                for request in group:
+                    self._futures.pop(request['id']).set_exception(
+                        ValueError(f'more than {max_batch_size} chained batch requests'))
+                continue
+            if len(chunk) + len(group) > max_batch_size:
+                yield chunk
+                chunk = []
+            chunk.extend(group)
+
+        if chunk:
+            yield chunk
+
+    def _send(self, chunk):
+        """Posts one chunk, resolves the futures it can and returns the sub-requests to retry"""
+        try:
+            access_token = self.client.login()
+            if not access_token:
+                raise GraphRequestError(f'cannot login to sharepoint with application id: {self.client.client_id}')
+            header = {
+                "Authorization": "Bearer " + access_token,
+                "Content-Type": "application/json"
+            }
+
+            response = self.client.session.post(f"{sharepoint_url}/v1.0/$batch", json={'requests': chunk}, headers=header)
+
+            # if rest request unsuccessful retry the whole chunk
+            if response.status_code not in (200, 201, 204):
+                logger_common.logger.error(
+                    f'cannot send batch of {len(chunk)} requests. Error: {response.status_code} - {response.content}')
+                self._retry_delay = max(self._retry_delay, throttle_common.parse_retry_after(response.headers.get('Retry-After')) or 0)
+                return chunk
+
+            logger_common.logger.info(f'sent batch of {len(chunk)} requests. Info: {response.status_code}')
+            responses = {r['id']: r for r in response.json().get('responses', [])}
+
+        # if attempt at rest request failed retry the whole chunk
+        except Exception as e:
+            logger_common.logger.error(e, exc_info=True)
+            return chunk
+
+        retries = []
+        retried_ids = set()
+        for request in chunk:
+            sub_response = responses.get(request['id'], {'status': 503})
+            status = sub_response['status']
+
+            if 200 <= status < 300:
+                self._futures.pop(request['id']).set_result(sub_response.get('body'))
+
+            # retry throttled/server errors, and requests that only failed because their dependency is retried
+            elif status in retry_statuses or (status == 424 and set(request.get('dependsOn', [])) & retried_ids):
+                # seconds or an HTTP date, anything else falls back to the backoff delay
+                retry_after = throttle_common.parse_retry_after((sub_response.get('headers') or {}).get('Retry-After'))
+                if retry_after:
+                    self._retry_delay = max(self._retry_delay, retry_after)
+                retries.append(request)
+                retried_ids.add(request['id'])
+
+            else:
+                logger_common.logger.error(
+                    f"batch request failed: {request['method']} {request['url']}. Error: {status} - {sub_response.get('body')}")
+                self._futures.pop(request['id']).set_exception(
+                    GraphRequestError(f"{request['method']} {request['url']}. Error: {status} - {sub_response.get('body')}"))
+
+        return retries
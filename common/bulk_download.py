@@ -0,0 +1,222 @@
+#!/usr/local/bin/python3
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import common.logger as logger_common
+import common.hashing as hashing_common
+from common.graph import GraphRequestError
+
+bulk_download_workers = int(os.getenv('BULK_DOWNLOAD_WORKERS', 8))
+# items larger than this are fetched as parallel byte ranges (Sharepoint.download_item_segmented)
+segmented_download_threshold = int(os.getenv('SEGMENTED_DOWNLOAD_THRESHOLD', 64 * 1024 * 1024))
+
+
+class BulkDownloader:
+    """
+    Downloads many items into one directory with bounded concurrency
+
+    downloader = BulkDownloader(sharepoint, site_id, '/data/sharepoint')
+    summary = downloader.run(sharepoint.walk(site_id, '/Three/Nested/Folders'))
+
+    Item metadata is fetched through $batch, 20 items per request. A file already in the target
+    directory is skipped when the manifest shows it was downloaded from the same content (cTag)
+    and it has not been touched since, or, failing that, when its size and quickXorHash match.
+    Every item gets one JSON line in the manifest (item id, path, size, hash, duration, status),
+    the latest line for an item id being the current one.
+    """
+
+    def __init__(self, client, site_id, target_directory, workers=bulk_download_workers, manifest_path=None,
+                 progress=None, segment_threshold=segmented_download_threshold):
+        """
+        :param client: Sharepoint client
+        :param manifest_path: JSON lines manifest (defaults to manifest.jsonl in the target directory)
+        :param progress: callable(stats) called after each item, stats as returned by stats()
+        """
+        self.client = client
+        self.site_id = site_id
+        self.target_directory = target_directory
+        self.workers = workers
+        self.manifest_path = manifest_path or os.path.join(target_directory, 'manifest.jsonl')
+        self.progress = progress or self.log_progress
+        self.segment_threshold = segment_threshold
+        self.counts = {'total': 0, 'downloaded': 0, 'skipped': 0, 'failed': 0}
+        self.bytes_downloaded = 0
+        self.started = None
+        self._lock = threading.Lock()
+
+    def run(self, items):
+        """
+        :param items: item ids and/or item details as returned by the listing methods and walk (folders are ignored)
+        :return summary of the run, see stats()
+        """
+        os.makedirs(self.target_directory, exist_ok=True)
+        item_ids = list(dict.fromkeys(
+            item if isinstance(item, str) else item['id']
+            for item in items if isinstance(item, str) or item.get('content_type') != 'Folder'))
+        self.counts['total'] = len(item_ids)
+        self.started = time.monotonic()
+
+        previous = self.load_manifest()
+        details = self.fetch_details(item_ids)
+        paths = self.assign_paths(item_ids, details)
+
+        with open(self.manifest_path, 'a') as manifest, ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.download, item_id, details.get(item_id), paths.get(item_id), previous.get(item_id))
+                       for item_id in item_ids]
+
+            for future in as_completed(futures):
+                entry = future.result()
+                with self._lock:
+                    self.counts[entry['status']] += 1
+                manifest.write(json.dumps(entry) + '\n')
+                manifest.flush()
+                self.progress(self.stats())
+
+        summary = self.stats()
+        logger_common.logger.info(f'bulk download finished. Summary: {summary}')
+        return summary
+
+    def stats(self):
+        with self._lock:
+            seconds = time.monotonic() - self.started
+            return {
+                **self.counts,
+                'done': self.counts['downloaded'] + self.counts['skipped'] + self.counts['failed'],
+                'bytes': self.bytes_downloaded,
+                'seconds': round(seconds, 3),
+                'bytes_per_second': self.bytes_downloaded / max(seconds, 1e-6)
+            }
+
+    def log_progress(self, stats):
+        logger_common.logger.info(
+            f"bulk download: {stats['done']}/{stats['total']} items "
+            f"({stats['downloaded']} downloaded, {stats['skipped']} skipped, {stats['failed']} failed). "
+            f"Throughput: {stats['bytes_per_second'] / (1024 * 1024):.2f} MB/s")
+
+    def load_manifest(self):
+        entries = {}
+        try:
+            with open(self.manifest_path) as manifest:
+                for line in manifest:
+                    entry = json.loads(line)
+                    if entry['status'] in ('downloaded', 'skipped'):
+                        entries[entry['item_id']] = entry
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def fetch_details(self, item_ids):
+        with self.client.batch() as batch:
+            futures = {item_id: batch.get_item(self.site_id, item_id) for item_id in item_ids}
+
+        details = {}
+        for item_id, future in futures.items():
+            try:
+                details[item_id] = future.result()
+            except Exception as e:
+                logger_common.logger.error(f'cannot get item: {item_id}. Error: {e}')
+        return details
+
+    def assign_paths(self, item_ids, details):
+        # items with the same name in different folders would overwrite each other, later ones get their id appended
+        paths, taken = {}, set()
+        for item_id in item_ids:
+            if item_id not in details:
+                continue
+            name = os.path.basename(details[item_id]['name'])
+            if name in taken:
+                stem, extension = os.path.splitext(name)
+                name = f'{stem} ({item_id}){extension}'
+            taken.add(name)
+            paths[item_id] = os.path.join(self.target_directory, name)
+        return paths
+
+    def download(self, item_id, item, path, previous):
+        started = time.monotonic()
+        entry = {'item_id': item_id, 'path': path}
+        try:
+            if item is None:
+                raise GraphRequestError(f'cannot get item: {item_id}')
+            if 'file' not in item:
+                raise GraphRequestError(f'item: {item_id} is not a file')
+
+            expected_hash = item['file'].get('hashes', {}).get('quickXorHash')
+            entry.update({'name': item['name'], 'size': item['size'], 'ctag': item.get('cTag')})
+
+            if self.unchanged(path, item, expected_hash, previous):
+                entry.update({'status': 'skipped', 'quickxor': expected_hash or (previous or {}).get('quickxor'),
+                              'mtime': os.stat(path).st_mtime})
+                return self.finish(entry, started)
+
+            if item['size'] > self.segment_threshold:
+                if not self.client.download_item_segmented(self.site_id, item_id, os.path.dirname(path),
+                                                           filename=os.path.basename(path)):
+                    raise GraphRequestError(f'cannot download item: {item_id}')
+                quickxor = expected_hash
+            else:
+                quickxor = self.download_whole(item_id, item, path, expected_hash)
+
+            with self._lock:
+                self.bytes_downloaded += item['size']
+            stat = os.stat(path)
+            entry.update({'status': 'downloaded', 'quickxor': quickxor, 'mtime': stat.st_mtime})
+
+        except Exception as e:
+            logger_common.logger.error(e, exc_info=True)
+            logger_common.logger.error(f'Could not download item: {item_id}')
+            entry.update({'status': 'failed', 'error': str(e)})
+
+        return self.finish(entry, started)
+
+    def finish(self, entry, started):
+        entry['duration'] = round(time.monotonic() - started, 3)
+        return entry
+
+    def unchanged(self, path, item, expected_hash, previous):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        if stat.st_size != item['size']:
+            return False
+
+        # same content as last time and the local copy has not been touched since
+        if previous and previous.get('ctag') and previous['ctag'] == item.get('cTag') and previous.get('mtime') == stat.st_mtime:
+            return True
+
+        return bool(expected_hash) and hashing_common.quickxor_file(path) == expected_hash
+
+    def download_whole(self, item_id, item, path, expected_hash):
+        """Streams an item from its pre-authenticated download url, hashing it on the way to disk"""
+        download_url = item.get('@microsoft.graph.downloadUrl')
+        part_path = path + '.part'
+        quickxor = hashing_common.QuickXorHash()
+
+        try:
+            response = self.client.session.get(download_url, stream=True) if download_url else None
+            # download urls expire after a while, a long running job may need a fresh one
+            if response is None or response.status_code in (401, 403):
+                if response is not None:
+                    response.close()
+                download_url = self.client.get_item_download_details(self.site_id, item_id)['@microsoft.graph.downloadUrl']
+                response = self.client.session.get(download_url, stream=True)
+
+            with response:
+                if response.status_code != 200:
+                    raise GraphRequestError(f'cannot download item: {item_id}. Error: {response.status_code}')
+                with open(part_path, 'wb') as target:
+                    for chunk in response.iter_content(chunk_size=1024 * 1024):
+                        quickxor.update(chunk)
+                        target.write(chunk)
+
+            if expected_hash and quickxor.b64digest() != expected_hash:
+                raise GraphRequestError(f'quickXorHash of downloaded item: {item_id} does not match')
+
+            os.replace(part_path, path)
+            return quickxor.b64digest()
+
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
@@ -0,0 +1,141 @@
+#!/usr/local/bin/python3
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import common.logger as logger_common
+import common.metrics as metrics_common
+from common.state import JsonStateStore
+
+content_cache_dir = os.getenv('CONTENT_CACHE_DIR', 'resources/cache/content')
+content_cache_max_bytes = int(os.getenv('CONTENT_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+
+
+class ContentCache:
+    """
+    Local cache of downloaded item content, shared between worker processes
+
+    Content is stored once per sha256 under blobs/, and items/ maps each item id to the eTag
+    the content was downloaded with. Every file is written to a temporary name and moved into
+    place, so readers in other processes only ever see complete files. Least recently used
+    blobs are evicted (by modification time, which is bumped on every hit) once the cache
+    grows past max_bytes.
+    """
+
+    def __init__(self, directory=content_cache_dir, max_bytes=content_cache_max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.blob_directory = os.path.join(directory, 'blobs')
+        self.index = JsonStateStore(os.path.join(directory, 'items'))
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_directory, digest)
+
+    def lookup(self, item_id):
+        """Returns the cached entry of an item, or None if it was never cached or its content was evicted"""
+        entry = self.index.load(item_id)
+        if entry and os.path.exists(self.blob_path(entry['sha256'])):
+            return entry
+        return None
+
+    def hit(self, entry, target_path):
+        """Copies cached content to target_path after the server confirmed it is still current"""
+        blob_path = self.blob_path(entry['sha256'])
+        self._copy(blob_path, target_path)
+        os.utime(blob_path)
+
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += entry['size']
+
+    def store(self, item_id, etag, name, stream, target_path):
+        """
+        Streams freshly downloaded content into the cache and to target_path
+
+        :return the new cache entry
+        """
+        with self._lock:
+            self.misses += 1
+
+        os.makedirs(self.blob_directory, exist_ok=True)
+        descriptor, temp_path = tempfile.mkstemp(dir=self.blob_directory, suffix='.tmp')
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(descriptor, 'wb') as target:
+                for chunk in iter(lambda: stream.read(1024 * 1024), b''):
+                    digest.update(chunk)
+                    target.write(chunk)
+                    size += len(chunk)
+            os.replace(temp_path, self.blob_path(digest.hexdigest()))
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+        entry = {'etag': etag, 'name': name, 'size': size, 'sha256': digest.hexdigest()}
+        self.index.save(item_id, entry)
+        self._copy(self.blob_path(entry['sha256']), target_path)
+        self.evict()
+
+        return entry
+
+    def invalidate(self, item_id):
+        self.index.delete(item_id)
+
+    def evict(self):
+        """Removes the least recently used blobs until the cache fits in max_bytes"""
+        try:
+            blobs = [entry for entry in os.scandir(self.blob_directory) if not entry.name.endswith('.tmp')]
+        except FileNotFoundError:
+            return
+
+        sizes = {}
+        for blob in blobs:
+            try:
+                stat = blob.stat()
+                sizes[blob.path] = (stat.st_mtime, stat.st_size)
+            # another process may have evicted it already
+            except FileNotFoundError:
+                pass
+
+        total = sum(size for _, size in sizes.values())
+        for path, (_, size) in sorted(sizes.items(), key=lambda blob: blob[1][0]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                logger_common.logger.info(f'evicted {size} bytes from content cache: {path}')
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'bytes_saved': self.bytes_saved,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
+
+    def _copy(self, source_path, target_path):
+        # copy next to the target first so a concurrent reader never sees half a file
+        descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(target_path)), suffix='.tmp')
+        os.close(descriptor)
+        try:
+            shutil.copyfile(source_path, temp_path)
+            os.replace(temp_path, target_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+
+content_cache = ContentCache()
+metrics_common.cache_gauge('sharepoint_content_cache', 'Downloaded content cache hits, misses, bytes saved and hit ratio', content_cache.stats)
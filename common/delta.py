@@ -0,0 +1,15 @@
+#!/usr/local/bin/python3
+import os
+from common.state import JsonStateStore
+
+delta_state_dir = os.getenv('DELTA_STATE_DIR', 'resources/state/delta')
+
+
+class DeltaStateStore(JsonStateStore):
+    """
+    Per drive, the Graph delta link and the items seen so far. If a run crashes before saving,
+    the previous delta link is simply used again on the next run.
+    """
+
+    def __init__(self, directory=delta_state_dir):
+        super().__init__(directory)
@@ -0,0 +1,118 @@
+#!/usr/local/bin/python3
+import os
+from datetime import datetime, time, timezone
+from common.item import DriveItem
+
+sharepoint_url = os.getenv('SHAREPOINT_URL')
+login_url = os.getenv('SHAREPOINT_LOGIN_URL', 'https://login.microsoftonline.com')
+default_page_size = int(os.getenv('SHAREPOINT_PAGE_SIZE', 200))
+
+
+# driveItem properties drive_item_details uses, Graph leaves the rest out of listings that $select them
+drive_item_select = 'id,name,parentReference,file,folder,createdDateTime,lastModifiedDateTime'
+
+
+class GraphRequestError(Exception):
+    pass
+
+
+def odata_query(select=None, filter=None, orderby=None, top=None, expand=None):
+    """
+    OData query parameters for a Graph request, leaving out the ones not given
+
+    :param select: properties to return, e.g. 'id,name' or ['id', 'name']
+    :param filter: $filter expression, see odata_filter
+    :param orderby: e.g. 'lastModifiedDateTime desc' or ['name', 'createdDateTime desc']
+    :param top: page size
+    :param expand: relationships to expand, e.g. 'driveItem($select=id,name)'
+    """
+    params = {'$select': select, '$filter': filter, '$orderby': orderby, '$top': top, '$expand': expand}
+    return {key: value if isinstance(value, (str, int)) else ','.join(value) for key, value in params.items() if value}
+
+
+def odata_filter(content_type=None, created_after=None, created_before=None, modified_after=None, modified_before=None,
+                 list_fields=False):
+    """
+    Builds a $filter expression from the conditions given, all of which must hold
+
+    Graph only evaluates these where the endpoint supports them: list items filter on their columns
+    (list_fields=True, see Sharepoint.iter_drives_and_items). The driveItem /children listings of
+    SharePoint and OneDrive for Business drives do not support $filter on file, folder or dates, so
+    folder listings take item_filter(...) instead, which checks the same conditions on each item.
+
+    :param content_type: 'Document' or 'Folder'
+    :param created_after/created_before/modified_after/modified_before: date, datetime (naive = UTC) or ISO 8601 string
+    :param list_fields: filter list items on their SharePoint columns (fields/ContentType, fields/Created, ...)
+                        instead of driveItem properties
+    :return filter string, or None if no condition was given
+    """
+    conditions = []
+    if content_type and list_fields:
+        conditions.append(f"fields/ContentType eq '{content_type}'")
+    elif content_type:
+        conditions.append('folder ne null' if content_type == 'Folder' else 'file ne null')
+
+    for value, column, prop, operator in ((created_after, 'Created', 'createdDateTime', 'ge'),
+                                          (created_before, 'Created', 'createdDateTime', 'lt'),
+                                          (modified_after, 'Modified', 'lastModifiedDateTime', 'ge'),
+                                          (modified_before, 'Modified', 'lastModifiedDateTime', 'lt')):
+        if value is None:
+            continue
+        timestamp = odata_datetime(value)
+        conditions.append(f"fields/{column} {operator} '{timestamp}'" if list_fields else f"{prop} {operator} {timestamp}")
+
+    return ' and '.join(conditions) or None
+
+
+def item_filter(content_type=None, created_after=None, created_before=None, modified_after=None, modified_before=None):
+    """
+    Predicate over item details (see drive_item_details) holding the conditions odata_filter would send to Graph,
+    for listings that cannot be filtered server-side. Items without the date a condition needs do not match.
+
+    :param content_type: 'Document' or 'Folder'
+    :param created_after/created_before/modified_after/modified_before: date, datetime (naive = UTC) or ISO 8601 string
+    """
+    limits = [(key, after, parse_datetime(odata_datetime(value)))
+              for value, key, after in ((created_after, 'created_date_time', True),
+                                        (created_before, 'created_date_time', False),
+                                        (modified_after, 'last_modified_date_time', True),
+                                        (modified_before, 'last_modified_date_time', False))
+              if value is not None]
+
+    def matches(item):
+        if content_type and item['content_type'] != content_type:
+            return False
+        for key, after, limit in limits:
+            if item.get(key) is None or (parse_datetime(item[key]) >= limit) != after:
+                return False
+        return True
+
+    return matches
+
+
+def parse_datetime(value):
+    # Graph timestamps end in Z and may carry fractions of a second
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def odata_datetime(value):
+    if isinstance(value, str):
+        return value
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, time.min)
+    if value.tzinfo:
+        value = value.astimezone(timezone.utc)
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+# Shape a Graph driveItem into the item details returned by the listing methods
+def drive_item_details(item):
+    return DriveItem(
+        name=item['name'],
+        id=item['id'],
+        parent_id=item['parentReference']['id'],
+        #parent_name=item['parentReference']['name'],
+        content_type='Document' if 'file' in item or item.get('@microsoft.graph.downloadUrl') else 'Folder',
+        created_date_time=item.get('createdDateTime'),
+        last_modified_date_time=item.get('lastModifiedDateTime')
+    )
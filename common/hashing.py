@@ -0,0 +1,67 @@
+#!/usr/local/bin/python3
+import base64
+
+# QuickXorHash parameters (the hash SharePoint/OneDrive for Business report in file.hashes.quickXorHash)
+width_in_bits = 160
+shift = 11
+block_size = width_in_bits  # byte i is XORed in at bit (i * 11) % 160, so the pattern repeats every 160 bytes
+
+
+class QuickXorHash:
+    """
+    QuickXorHash with a hashlib-style interface
+
+    Instead of shifting every byte into the 160-bit state, bytes that share a position modulo 160
+    are XORed together first (whole buffers at a time as big integers) and only the 160 column
+    values are shifted in when the digest is taken.
+    """
+
+    def __init__(self, data=b''):
+        self.length = 0
+        self._columns = 0
+        self.update(data)
+
+    def update(self, data):
+        if not data:
+            return
+
+        # leading zero bytes line the data up with its position in the stream without changing the XOR
+        offset = self.length % block_size
+        padded = bytes(offset) + bytes(data) + bytes(-(offset + len(data)) % block_size)
+        self.length += len(data)
+
+        # fold the buffer in halves until one 160 byte block remains
+        value = int.from_bytes(padded, 'little')
+        blocks = len(padded) // block_size
+        while blocks > 1:
+            half = blocks // 2
+            low_bits = half * block_size * 8
+            value = (value & ((1 << low_bits) - 1)) ^ (value >> low_bits)
+            blocks -= half
+
+        self._columns ^= value
+
+    def digest(self):
+        state = 0
+        mask = (1 << width_in_bits) - 1
+        for position, value in enumerate(self._columns.to_bytes(block_size, 'little')):
+            if value:
+                bit = (position * shift) % width_in_bits
+                state ^= ((value << bit) | (value >> (width_in_bits - bit))) & mask
+
+        digest = bytearray(state.to_bytes(width_in_bits // 8, 'little'))
+        for i, value in enumerate(self.length.to_bytes(8, 'little')):
+            digest[width_in_bits // 8 - 8 + i] ^= value
+        return bytes(digest)
+
+    def b64digest(self):
+        return base64.b64encode(self.digest()).decode()
+
+
+def quickxor_file(path, read_size=4 * 1024 * 1024):
+    """base64 QuickXorHash of a file, as found in driveItem file.hashes.quickXorHash"""
+    quickxor = QuickXorHash()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(read_size), b''):
+            quickxor.update(block)
+    return quickxor.b64digest()
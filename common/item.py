@@ -0,0 +1,46 @@
+#!/usr/local/bin/python3
+import sys
+from collections.abc import Mapping
+
+fields = ('name', 'id', 'parent_id', 'content_type', 'created_date_time', 'last_modified_date_time')
+# dates are only present when the listing fetched them, so items without them keep the four keys they always had
+optional_fields = ('created_date_time', 'last_modified_date_time')
+
+
+def intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class DriveItem(Mapping):
+    """
+    Compact record of one folder or document, as returned by the listing, walk and delta methods
+
+    A slotted object instead of a dict: no per-item hash table, and the parent ids and content types
+    repeated across a listing are interned, so siblings share one string. It reads like the dicts it
+    replaces (item['name'], item.get('parent_id'), dict(item), {**item}, comparison with a dict) and
+    like an object (item.name). Use dict(item) where a real dict is needed, e.g. for json.
+    """
+
+    __slots__ = fields
+
+    def __init__(self, name, id, parent_id, content_type, created_date_time=None, last_modified_date_time=None):
+        self.name = name
+        self.id = id
+        self.parent_id = intern(parent_id)
+        self.content_type = intern(content_type)
+        self.created_date_time = created_date_time
+        self.last_modified_date_time = last_modified_date_time
+
+    def __getitem__(self, key):
+        if key in fields and (key not in optional_fields or getattr(self, key) is not None):
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return (field for field in fields if field not in optional_fields or getattr(self, field) is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f'DriveItem({dict(self)!r})'
@@ -1,21 +1,125 @@
 #!/usr/local/bin/python3
+import atexit
+import json
 import logging
-from concurrent_log_handler import ConcurrentRotatingFileHandler
+import logging.handlers
 import os
+import queue
+import random
+from concurrent_log_handler import ConcurrentRotatingFileHandler
+import common.metrics as metrics_common
 
 log_name = os.getenv('LOG_FILENAME')
 log_path = os.getenv('LOG_PATH')
+# records waiting for the background writer, anything beyond this is dropped rather than blocking a request
+log_queue_size = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+# 'text' or 'json' (one object per line)
+log_format = os.getenv('LOG_FORMAT', 'text').lower()
+# fraction of INFO records kept, warnings and errors are always written
+log_info_sample_rate = float(os.getenv('LOG_INFO_SAMPLE_RATE', 1.0))
 
-def rotational_logger():
-    logger = logging.getLogger(__name__)
-    logger.setLevel(logging.DEBUG)
-    formatter = logging.Formatter('%(asctime)s:%(levelname)s:%(message)s')
+log_records_dropped = metrics_common.registry.counter(
+    'sharepoint_log_records_dropped_total', 'Log records not written, by reason (queue_full, sampled)', ('reason',))
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+            'process': record.process
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+class InfoSampler(logging.Filter):
+    """Keeps a random `rate` fraction of records below WARNING"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate:
+            return True
+        log_records_dropped.inc(reason='sampled')
+        return False
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the background listener, dropping them if its queue is full instead of waiting"""
+
+    def prepare(self, record):
+        # the listener formats the record, only make it safe to pass between threads
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_dropped.inc(reason='queue_full')
+
+
+class FlushingQueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # wait for room rather than fail when stopping with a full queue
+        self.queue.put(self._sentinel)
+
+
+def file_handler():
     log_filename = os.path.join(log_path, log_name) + '.log'
     handler = ConcurrentRotatingFileHandler(log_filename, maxBytes=10*1024*1024, backupCount=5)
-    handler.setFormatter(formatter)
+    if log_format == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(message)s'))
+    return handler
+
+
+def start_listener(handler):
+    # request threads only enqueue, the file lock and the write happen on the listener's thread
+    handler.queue = queue.Queue(maxsize=log_queue_size)
+    handler.listener = FlushingQueueListener(handler.queue, file_handler(), respect_handler_level=True)
+    handler.listener.start()
+
+
+def stop_listener(handler):
+    # writes out whatever is still queued
+    if handler.listener._thread is not None:
+        handler.listener.stop()
+
+
+def rotational_logger():
+    # a stable name, so importing this module under another name (as some runners do) reuses the same logger
+    logger = logging.getLogger('python-sharepoint-app')
+    logger.setLevel(logging.DEBUG)
+
+    if any(handler.name == 'sharepoint-queue' for handler in logger.handlers):
+        return logger
+
+    handler = DroppingQueueHandler(None)
+    handler.set_name('sharepoint-queue')
+    handler.addFilter(InfoSampler(log_info_sample_rate))
+    start_listener(handler)
     logger.addHandler(handler)
 
+    atexit.register(stop_listener, handler)
+    # the listener thread does not survive a fork (e.g. gunicorn --preload), each child starts its own
+    os.register_at_fork(after_in_child=lambda: start_listener(handler))
+
     return logger
 
 
-logger = rotational_logger()
\ No newline at end of file
+logger = rotational_logger()
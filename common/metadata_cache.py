@@ -0,0 +1,95 @@
+#!/usr/local/bin/python3
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# lookup type -> (ttl seconds, max entries); override with e.g. METADATA_CACHE_SITE_TTL / METADATA_CACHE_SITE_SIZE
+default_policies = {
+    'site': (3600, 256),
+    'root_drive': (3600, 256),
+    'list': (900, 256),
+    'drive': (300, 1024),
+    'item': (60, 4096)
+}
+negative_ttl = int(os.getenv('METADATA_CACHE_NEGATIVE_TTL', 30))
+
+
+def policies_from_env():
+    return {
+        kind: (int(os.getenv(f'METADATA_CACHE_{kind.upper()}_TTL', ttl)),
+               int(os.getenv(f'METADATA_CACHE_{kind.upper()}_SIZE', size)))
+        for kind, (ttl, size) in default_policies.items()
+    }
+
+
+class MetadataCache:
+    """
+    Thread-safe TTL/LRU cache of name -> id lookups, one LRU per lookup type
+
+    Lookups that found nothing ("" or []) are cached as well, for negative_ttl seconds, so a
+    missing name is not searched for on every call. Failed lookups (None) are never cached.
+    """
+
+    def __init__(self, policies=None, negative_ttl=negative_ttl):
+        self.policies = policies or policies_from_env()
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {kind: OrderedDict() for kind in self.policies}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, kind, key, load):
+        """Returns the cached value for key, calling load() and caching its result on a miss"""
+        with self._lock:
+            entries = self._entries[kind]
+            entry = entries.get(key)
+            if entry and entry[1] > time.monotonic():
+                entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        value = load()
+        if value is not None:
+            self.put(kind, key, value)
+        return value
+
+    def put(self, kind, key, value):
+        ttl, max_size = self.policies[kind]
+        if not value:
+            ttl = min(ttl, self.negative_ttl)
+
+        with self._lock:
+            entries = self._entries[kind]
+            entries[key] = (value, time.monotonic() + ttl)
+            entries.move_to_end(key)
+            while len(entries) > max_size:
+                entries.popitem(last=False)
+
+    def invalidate(self, kind=None, match=None):
+        """
+        Drops cached lookups
+
+        :param kind: lookup type to invalidate, all types if None
+        :param match: optional callable(key, value) selecting the entries to drop, all entries if None
+        """
+        with self._lock:
+            for entry_kind, entries in self._entries.items():
+                if kind not in (None, entry_kind):
+                    continue
+                if match is None:
+                    entries.clear()
+                    continue
+                for key in [key for key, (value, _) in entries.items() if match(key, value)]:
+                    del entries[key]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': sum(len(entries) for entries in self._entries.values()),
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,269 @@
+#!/usr/local/bin/python3
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+# latency buckets in seconds, from a cached token lookup to a large download
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Metric:
+    """A named metric with one value (or histogram) per combination of label values"""
+
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def _label_text(self, key, extra=()):
+        pairs = [*zip(self.labels, key), *extra]
+        if not pairs:
+            return ''
+        escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{label}="{value}"' for (label, _), value in zip(pairs, escaped)) + '}'
+
+    def samples(self):
+        with self._lock:
+            return [(f'{self.name}{self._label_text(key)}', value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(f'{name} {format_value(value)}' for name, value in self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), function=None):
+        """:param function: optional callable returning {label values tuple: value}, read on every scrape"""
+        super().__init__(name, help, labels)
+        self.function = function
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self):
+        if not self.function:
+            return super().samples()
+        return [(f'{self.name}{self._label_text(tuple(map(str, key)))}', value) for key, value in self.function().items()]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=default_buckets):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # [cumulative bucket counts, sum, count]
+            state = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append((f'{self.name}_bucket{self._label_text(key, [("le", format_value(bound))])}', bucket_count))
+                samples.append((f'{self.name}_bucket{self._label_text(key, [("le", "+Inf")])}', count))
+                samples.append((f'{self.name}_sum{self._label_text(key)}', total))
+                samples.append((f'{self.name}_count{self._label_text(key)}', count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=(), function=None):
+        return self.register(Gauge(name, help, labels, function))
+
+    def histogram(self, name, help, labels=(), buckets=default_buckets):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+def format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+
+graph_request_seconds = registry.histogram(
+    'sharepoint_graph_request_duration_seconds', 'Latency of Graph calls by operation', ('operation', 'method'))
+graph_requests = registry.counter(
+    'sharepoint_graph_requests_total', 'Graph calls by operation and response status', ('operation', 'method', 'status'))
+graph_retries = registry.counter(
+    'sharepoint_graph_retries_total', 'Graph calls retried, by reason (throttled, server_error, connection_error)', ('reason',))
+graph_throttled = registry.counter(
+    'sharepoint_graph_throttled_total', 'Graph responses asking the client to slow down (429, 503 + Retry-After)', ('operation',))
+graph_bytes = registry.counter(
+    'sharepoint_graph_bytes_total', 'Bytes sent to and received from Graph (as declared by Content-Length)', ('operation', 'direction'))
+graph_in_flight = registry.gauge(
+    'sharepoint_graph_requests_in_flight', 'Graph calls currently waiting for a response')
+http_request_seconds = registry.histogram(
+    'sharepoint_http_request_duration_seconds', 'Latency of this API by route, including streamed bodies', ('route', 'method'))
+http_requests = registry.counter(
+    'sharepoint_http_requests_total', 'Requests to this API by route and status', ('route', 'method', 'status'))
+http_in_flight = registry.gauge(
+    'sharepoint_http_requests_in_flight', 'Requests to this API currently being served')
+
+# ids, paths and pre-authenticated urls would make every call its own series
+_id_segment = re.compile(r'/(sites|items|lists|drives|columns|contentTypes)/[^/:]+')
+_path_segment = re.compile(r":/[^:]*(:|$)")
+_search_segment = re.compile(r"search\(q='[^']*'\)")
+
+
+def graph_operation(method, url):
+    """Low cardinality name for a Graph call, e.g. 'GET /sites/{id}/drive/items/{id}/children'"""
+    parsed = urlparse(url)
+    if parsed.path.endswith('/oauth2/v2.0/token'):
+        return 'token'
+    if 'graph.microsoft' not in (parsed.hostname or '') and '/v1.0/' not in parsed.path:
+        # pre-authenticated download and upload session urls
+        return 'upload_session' if method == 'PUT' or 'uploadSession' in parsed.path else 'download'
+
+    path = parsed.path.split('/v1.0', 1)[-1]
+    path = _path_segment.sub(lambda match: ':/{path}' + match.group(1), path)
+    path = _search_segment.sub("search(q='{query}')", path)
+    return _id_segment.sub(lambda match: f'/{match.group(1)}/{{id}}', path)
+
+
+class GraphCall:
+    """Times one Graph call: `with GraphCall(method, url) as call: ... call.done(status, headers)`"""
+
+    def __init__(self, method, url, request_bytes=0):
+        self.method = method
+        self.operation = graph_operation(method, url)
+        self.request_bytes = request_bytes
+        self.status = 'error'
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        graph_in_flight.inc()
+        return self
+
+    def done(self, status, headers):
+        self.status = status
+        if status == 429 or (status == 503 and 'Retry-After' in headers):
+            graph_throttled.inc(operation=self.operation)
+        received = headers.get('Content-Length')
+        if received and received.isdigit():
+            graph_bytes.inc(int(received), operation=self.operation, direction='received')
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        graph_in_flight.dec()
+        graph_request_seconds.observe(time.perf_counter() - self.started, operation=self.operation, method=self.method)
+        graph_requests.inc(operation=self.operation, method=self.method, status=self.status)
+        if self.request_bytes:
+            graph_bytes.inc(self.request_bytes, operation=self.operation, direction='sent')
+
+
+def cache_gauge(name, help, stats):
+    """Exposes a cache's stats() (hits, misses, hit_ratio, ...) as one gauge labelled by stat"""
+    return registry.gauge(name, help, ('stat',),
+                          lambda: {(stat,): value for stat, value in stats().items() if isinstance(value, (int, float))})
+
+
+def instrument_flask(app):
+    """Records latency, status and in-flight requests for every route of a Flask app"""
+    from flask import g, request
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+        http_in_flight.inc()
+
+    @app.after_request
+    def record(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        method, status = request.method, response.status_code
+
+        # streamed responses are only finished once their body has been sent
+        def finish():
+            http_in_flight.dec()
+            http_request_seconds.observe(time.perf_counter() - started, route=route, method=method)
+            http_requests.inc(route=route, method=method, status=status)
+
+        response.call_on_close(finish)
+        return response
+
+    return app
+
+
+def instrument_aiohttp(app):
+    """Records latency, status and in-flight requests for every route of an aiohttp application"""
+    from aiohttp import web
+
+    @web.middleware
+    async def record(request, handler):
+        started = time.perf_counter()
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else 'unmatched'
+        status = 500
+        http_in_flight.inc()
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            http_in_flight.dec()
+            http_request_seconds.observe(time.perf_counter() - started, route=route, method=request.method)
+            http_requests.inc(route=route, method=request.method, status=status)
+
+    app.middlewares.append(record)
+    return app
@@ -0,0 +1,215 @@
+#!/usr/local/bin/python3
+import csv
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import common.logger as logger_common
+import common.sharepoint as sharepoint_common
+from common.graph import GraphRequestError
+from common.item import fields as item_fields
+from common.plan import compile_plan
+
+pipeline_workers = int(os.getenv('PIPELINE_WORKERS', 8))
+# sites of one tenant crawled at once, they share its Graph throttling budget
+pipeline_tenant_concurrency = int(os.getenv('PIPELINE_TENANT_CONCURRENCY', 4))
+
+
+class Site:
+    """A site being crawled, as handed to sinks"""
+
+    def __init__(self, tenant_id, name, client, site_id):
+        self.tenant_id = tenant_id
+        self.name = name
+        self.client = client
+        self.site_id = site_id
+
+    @property
+    def key(self):
+        return f'{self.tenant_id}/{self.name}'
+
+
+class JsonLinesSink:
+    """Appends one JSON line per discovered document, tagged with its site"""
+
+    def __init__(self, path):
+        self.file = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def write(self, site, item):
+        with self._lock:
+            self.file.write(json.dumps({'tenant_id': site.tenant_id, 'site': site.name, **item}) + '\n')
+
+    def finish(self, site):
+        with self._lock:
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class CsvSink:
+    """Writes one CSV row per discovered document, tagged with its site"""
+
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=['tenant_id', 'site', *item_fields], extrasaction='ignore')
+        self.writer.writeheader()
+        self._lock = threading.Lock()
+
+    def write(self, site, item):
+        with self._lock:
+            self.writer.writerow({'tenant_id': site.tenant_id, 'site': site.name, **item})
+
+    def finish(self, site):
+        with self._lock:
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class DownloadSink:
+    """Downloads each site's documents into <directory>/<tenant id>/<site name> once the site has been crawled"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.items = {}
+        self.summaries = {}
+        self._lock = threading.Lock()
+
+    def write(self, site, item):
+        with self._lock:
+            self.items.setdefault(site.key, []).append(item)
+
+    def finish(self, site):
+        with self._lock:
+            items = self.items.pop(site.key, [])
+        self.summaries[site.key] = site.client.download_items(site.site_id, items, os.path.join(self.directory, site.key))
+
+    def close(self):
+        pass
+
+
+class PipelineRunner:
+    """
+    Crawls every site configured in a directory of config files concurrently, streaming the documents found to a sink
+
+    runner = PipelineRunner(JsonLinesSink('files.jsonl'))
+    summary = runner.run('./config')
+
+    Configs are grouped by site (and credentials) and compiled into one plan per site (see common/plan.py).
+    Sites run on a thread pool, at most PIPELINE_TENANT_CONCURRENCY at a time per tenant: each tenant's sites
+    wait in their own queue and are only handed to the pool when one of the tenant's slots frees up, so a
+    busy tenant never ties up workers that other tenants' sites could use. Clients, tokens and name lookups
+    are shared between sites of the same credentials. A site that fails is logged and reported in the
+    summary ('failed', or 'partial' when only some of its folders could be listed), the others carry on.
+    """
+
+    def __init__(self, sink, workers=pipeline_workers, tenant_concurrency=pipeline_tenant_concurrency, today=None):
+        """
+        :param sink: object with write(site, item), finish(site) and close(), e.g. JsonLinesSink, CsvSink or DownloadSink
+        :param today: date look_back_days count back from (defaults to today)
+        """
+        self.sink = sink
+        self.workers = workers
+        self.tenant_concurrency = tenant_concurrency
+        self.today = today
+
+    def run(self, config_directory):
+        """:return {'<tenant id>/<site name>': {'status', 'documents', 'seconds', 'error' or 'errors'}}"""
+        # sites waiting for a slot of their tenant, in config order
+        queued = {}
+        for (credentials, site_name), configurations in self.load_sites(config_directory).items():
+            queued.setdefault(credentials[0], deque()).append((credentials, site_name, configurations))
+
+        summary = {}
+        started = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                running = {}
+
+                def submit_next(tenant_id):
+                    credentials, site_name, configurations = queued[tenant_id].popleft()
+                    future = executor.submit(self.crawl_site, credentials, configurations)
+                    running[future] = (tenant_id, f'{tenant_id}/{site_name}')
+
+                # fill every tenant's slots, taking one site per tenant in turn so none waits behind another
+                for _ in range(self.tenant_concurrency):
+                    for tenant_id in [tenant_id for tenant_id in queued if queued[tenant_id]]:
+                        submit_next(tenant_id)
+
+                while running:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        tenant_id, key = running.pop(future)
+                        summary[key] = future.result()
+                        if queued[tenant_id]:
+                            submit_next(tenant_id)
+        finally:
+            self.sink.close()
+
+        failed = [key for key, result in summary.items() if result['status'] != 'ok']
+        logger_common.logger.info(
+            f'pipeline crawled {len(summary)} sites in {time.monotonic() - started:.1f}s. Failed or partial: {failed or "none"}')
+        return summary
+
+    def load_sites(self, config_directory):
+        sites = {}
+        for filename in sorted(os.listdir(config_directory)):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(config_directory, filename)) as file:
+                    configuration = json.load(file)
+                configuration['site_name']
+            except (ValueError, KeyError, TypeError) as e:
+                logger_common.logger.error(f'Could not read config: {filename}, skipping it. Error: {e!r}')
+                continue
+
+            # configs may name their own application, otherwise the one in the environment is used
+            credentials = (configuration.get('tenant_id') or os.getenv('TENANT_ID'),
+                           configuration.get('client_id') or os.getenv('CLIENT_ID'),
+                           configuration.get('client_secret') or os.getenv('CLIENT_SECRET'))
+            sites.setdefault((credentials, configuration['site_name']), []).append(configuration)
+        return sites
+
+    def crawl_site(self, credentials, configurations):
+        site_name = configurations[0]['site_name']
+        started = time.monotonic()
+        result = {'status': 'ok', 'documents': 0}
+
+        try:
+            site_plan = compile_plan(configurations, self.today).sites[0]
+            client = sharepoint_common.clients.get(*credentials)
+
+            site_id = client.get_site_id_by_name(site_name)
+            if not site_id:
+                raise GraphRequestError(f'cannot get sharepoint site: {site_name}')
+            site = Site(credentials[0], site_name, client, site_id)
+
+            seen = set()
+            errors = []
+            for item in site_plan.run(client, site_id, errors):
+                if item['id'] not in seen:
+                    seen.add(item['id'])
+                    self.sink.write(site, item)
+            self.sink.finish(site)
+            result['documents'] = len(seen)
+
+            # folders that could not be listed or walked, failed when none of them could
+            if errors:
+                sources = len(site_plan.listings) + len(site_plan.walks)
+                result.update({'status': 'failed' if len(errors) >= sources and not seen else 'partial', 'errors': errors})
+
+        # one bad site (missing, no access, bad config) must not stop the others
+        except Exception as e:
+            logger_common.logger.error(e, exc_info=True)
+            logger_common.logger.error(f'Could not crawl site: {site_name}')
+            result.update({'status': 'failed', 'error': str(e)})
+
+        result['seconds'] = round(time.monotonic() - started, 3)
+        logger_common.logger.info(f'crawled site: {site_name}. Result: {result}')
+        return result
@@ -0,0 +1,274 @@
+#!/usr/local/bin/python3
+import math
+from datetime import date, datetime, timedelta
+from urllib.parse import quote
+import common.logger as logger_common
+from common.batch import max_batch_size
+from common.graph import GraphRequestError, drive_item_details, drive_item_select, item_filter
+
+
+class Walk:
+    """A folder whose subfolders are walked, and the rules evaluated against the folders it lists"""
+
+    def __init__(self, path, cutoff):
+        self.path = path
+        self.cutoff = cutoff
+        # subfolders walked separately (with a looser date limit), pruned from this walk
+        self.exclude = set()
+        # folder path -> {'all': cutoff or None, 'names': {name: cutoff}} for documents directly in that folder
+        self.rules = {}
+
+
+class SitePlan:
+    """
+    The Graph calls needed for one site: walks, plain folder listings (with the date limit pushed
+    to Graph) and direct lookups of named files, folder id lookups and named files sent via $batch
+    """
+
+    def __init__(self, site_name):
+        self.site_name = site_name
+        self.walks = []
+        self.listings = {}
+        self.lookups = {}
+        self.configurations = 0
+        self.entries = 0
+        self.subfolder_entries = 0
+
+    def folder_paths(self):
+        """Folders whose id is needed to evaluate the walks"""
+        paths = set()
+        for walk in self.walks:
+            paths.update([walk.path, *walk.exclude, *walk.rules])
+        return paths
+
+    def batch_requests(self):
+        return math.ceil((len(self.folder_paths()) + len(self.lookups)) / max_batch_size)
+
+    def planned_calls(self):
+        # walks list one page per folder of their subtree, only the first is counted
+        return 1 + self.batch_requests() + len(self.listings) + len(self.walks)
+
+    def unplanned_calls(self):
+        # a site lookup per config file, a listing per entry and a walk per entry with get_subfolder_files
+        return self.configurations + self.entries + self.subfolder_entries
+
+    def run(self, client, site_id, errors=None):
+        """
+        Yields the planned documents of the site
+
+        :param errors: list that folders which could not be listed or walked are appended to, as 'path: error'
+        """
+        errors = [] if errors is None else errors
+        with client.batch() as batch:
+            folder_ids = {path: batch.add('GET', f'{item_url(site_id, path)}?$select=id') for path in self.folder_paths()}
+            lookups = {key: batch.add('GET', f'{item_url(site_id, *key)}?$select={drive_item_select}') for key in self.lookups}
+
+        for (path, name), future in lookups.items():
+            try:
+                item = drive_item_details(future.result())
+            except GraphRequestError:
+                logger_common.logger.info(f'file not found: {name} in folder: {path}')
+                continue
+            if item['content_type'] == 'Document' and created_since(item, self.lookups[(path, name)]):
+                yield item
+
+        for path, cutoff in self.listings.items():
+            try:
+                yield from self.iter_listing(client, site_id, path, cutoff)
+            except Exception as e:
+                logger_common.logger.error(e, exc_info=True)
+                logger_common.logger.error(f'Cannot list items in folder: {path}')
+                errors.append(f'{path}: {e}')
+
+        for walk in self.walks:
+            ids = {}
+            for path in [walk.path, *walk.exclude, *walk.rules]:
+                try:
+                    ids[path] = folder_ids[path].result()['id']
+                except GraphRequestError:
+                    logger_common.logger.info(f'folder not found: {path}')
+
+            if walk.path not in ids:
+                logger_common.logger.error(f'Cannot walk folder: {walk.path}')
+                errors.append(f'{walk.path}: folder not found')
+                continue
+            try:
+                yield from run_walk(client, site_id, walk, ids, errors)
+            except Exception as e:
+                logger_common.logger.error(e, exc_info=True)
+                logger_common.logger.error(f'Cannot walk folder: {walk.path}')
+                errors.append(f'{walk.path}: {e}')
+
+    def iter_listing(self, client, site_id, path, cutoff):
+        # checked on each listed item, like run_walk does
+        include = item_filter(content_type='Document', created_after=cutoff)
+        if path == '/':
+            return client.iter_drive_items_by_id(site_id, 'root', include=include)
+        return client.iter_drive_items_by_path(site_id, path.lstrip('/'), include=include)
+
+    def describe(self):
+        lines = [f"site: {self.site_name} ({self.entries} entries)"]
+        lines.extend(f"  walk {walk.path} created since {walk.cutoff}"
+                     + (f", pruning {', '.join(sorted(walk.exclude))}" if walk.exclude else '') for walk in self.walks)
+        lines.extend(f"  list {path} created since {cutoff}" for path, cutoff in self.listings.items())
+        lines.extend(f"  look up {path.rstrip('/')}/{name} created since {cutoff}" for (path, name), cutoff in self.lookups.items())
+        lines.append(f"  calls: {self.planned_calls()} planned ({self.batch_requests()} $batch), "
+                     f"{self.unplanned_calls()} without planning")
+        return lines
+
+
+class ExecutionPlan:
+    """
+    plan = compile_plan(configurations)
+    print('\\n'.join(plan.describe()))        # dry run
+    documents = list(plan.run(sharepoint))    # each document once, look_back_days already applied
+    """
+
+    def __init__(self, sites):
+        self.sites = sites
+
+    def planned_calls(self):
+        return sum(site.planned_calls() for site in self.sites)
+
+    def unplanned_calls(self):
+        return sum(site.unplanned_calls() for site in self.sites)
+
+    def describe(self):
+        lines = [line for site in self.sites for line in site.describe()]
+        lines.append(f"total calls: {self.planned_calls()} planned, {self.unplanned_calls()} without planning "
+                     f"(walks count one call, they make one more per subfolder)")
+        return lines
+
+    def run(self, client, errors=None):
+        seen = set()
+        for site in self.sites:
+            site_id = client.get_site_id_by_name(site.site_name)
+            if not site_id:
+                logger_common.logger.error(f'cannot get sharepoint site: {site.site_name}, skipping it')
+                continue
+
+            for item in site.run(client, site_id, errors):
+                if item['id'] not in seen:
+                    seen.add(item['id'])
+                    yield item
+
+
+def compile_plan(configurations, today=None):
+    """
+    Compiles folder_and_file_paths configurations into the fewest Graph calls that return the same documents
+
+    - configurations for the same site are merged, and each site is looked up once
+    - nested walks (get_subfolder_files) are merged into the outer walk, unless the inner one looks back
+      further, in which case the outer walk prunes it
+    - folders and named files inside a walk are evaluated against the walk's listings, no extra calls
+    - other folders are listed once each, keeping the documents created within look_back_days
+    - other named files are looked up by path, 20 per $batch request
+
+    :param configurations: parsed config files ({"site_name", "default_look_back_days", "folder_and_file_paths"})
+    :param today: date look_back_days count back from (defaults to today)
+    """
+    today = today or date.today()
+    sites = {}
+
+    for configuration in configurations:
+        site = sites.setdefault(configuration['site_name'], {'plan': SitePlan(configuration['site_name']),
+                                                             'walks': {}, 'listings': {}, 'lookups': {}})
+        site['plan'].configurations += 1
+        for entry in configuration['folder_and_file_paths']:
+            look_back_days = entry.get('look_back_days') or configuration['default_look_back_days']
+            # documents created after today - look_back_days, to the day
+            cutoff = today - timedelta(days=look_back_days) + timedelta(days=1)
+            path = normalise_path(entry['folder_path'])
+
+            site['plan'].entries += 1
+            if entry.get('get_subfolder_files'):
+                site['plan'].subfolder_entries += 1
+                keep_earliest(site['walks'], path, cutoff)
+            if entry.get('file_names'):
+                for name in entry['file_names']:
+                    keep_earliest(site['lookups'], (path, name), cutoff)
+            else:
+                keep_earliest(site['listings'], path, cutoff)
+
+    return ExecutionPlan([plan_site(**site) for site in sites.values()])
+
+
+def plan_site(plan, walks, listings, lookups):
+    # outer walks first, so each walk is compared with the innermost walk already kept around it
+    for path in sorted(walks, key=depth):
+        outer = covering_walk(plan.walks, path, strict=True)
+        if outer and outer.cutoff <= walks[path]:
+            continue
+        if outer:
+            # documents directly in the pruned folder still fall under the outer walk's date limit
+            outer.exclude.add(path)
+            keep_earliest(listings, path, outer.cutoff)
+        plan.walks.append(Walk(path, walks[path]))
+
+    for path, cutoff in listings.items():
+        walk = covering_walk(plan.walks, path)
+        if walk is None:
+            plan.listings[path] = cutoff
+        elif path == walk.path or cutoff < walk.cutoff:
+            walk.rules.setdefault(path, {'all': None, 'names': {}})['all'] = cutoff
+
+    for (path, name), cutoff in lookups.items():
+        walk = covering_walk(plan.walks, path)
+        if walk is None:
+            if path not in plan.listings or cutoff < plan.listings[path]:
+                plan.lookups[(path, name)] = cutoff
+        elif path == walk.path or cutoff < walk.cutoff:
+            walk.rules.setdefault(path, {'all': None, 'names': {}})['names'][name] = cutoff
+
+    return plan
+
+
+def run_walk(client, site_id, walk, ids, errors=None):
+    excluded = {ids[path] for path in walk.exclude if path in ids}
+    rules = {ids[path]: rule for path, rule in walk.rules.items() if path in ids}
+
+    # start from the folder id already resolved, so the path is not looked up again
+    for item in client.walk(site_id, ids[walk.path], exclude=lambda folder: folder['id'] in excluded, errors=errors):
+        rule = rules.get(item['parent_id'], {'all': None, 'names': {}})
+        cutoffs = [rule['all'], rule['names'].get(item['name'])]
+        # documents in subfolders fall under the walk's own date limit
+        if item['parent_id'] != ids[walk.path]:
+            cutoffs.append(walk.cutoff)
+
+        cutoffs = [cutoff for cutoff in cutoffs if cutoff is not None]
+        if cutoffs and created_since(item, min(cutoffs)):
+            yield item
+
+
+def covering_walk(walks, path, strict=False):
+    """The innermost walk whose subtree contains path (or starts at it, unless strict)"""
+    covering = [walk for walk in walks if is_under(path, walk.path) or (not strict and path == walk.path)]
+    return max(covering, key=lambda walk: depth(walk.path), default=None)
+
+
+def created_since(item, cutoff):
+    created = item.get('created_date_time')
+    return created is not None and datetime.fromisoformat(created.replace('Z', '+00:00')).date() >= cutoff
+
+
+def item_url(site_id, path, name=None):
+    path = f"{path.rstrip('/')}/{name}" if name else path
+    if path == '/':
+        return f"/sites/{site_id}/drive/root"
+    return f"/sites/{site_id}/drive/root:{quote(path)}"
+
+
+def keep_earliest(cutoffs, key, cutoff):
+    cutoffs[key] = min(cutoffs.get(key, cutoff), cutoff)
+
+
+def normalise_path(path):
+    return '/' + '/'.join(part for part in path.split('/') if part)
+
+
+def depth(path):
+    return len([part for part in path.split('/') if part])
+
+
+def is_under(path, folder):
+    return path != folder and (folder == '/' or path.startswith(folder + '/'))
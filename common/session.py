@@ -0,0 +1,33 @@
+#!/usr/local/bin/python3
+import os
+import requests
+from common.throttle import ThrottlingAdapter, limiter_for
+
+pool_size = int(os.getenv('HTTP_POOL_SIZE', 20))
+pool_block = os.getenv('HTTP_POOL_BLOCK', 'false').lower() == 'true'
+keep_alive = os.getenv('HTTP_KEEP_ALIVE', 'true').lower() == 'true'
+gzip = os.getenv('HTTP_GZIP', 'true').lower() == 'true'
+
+
+def create_session(pool_size=pool_size, pool_block=pool_block, keep_alive=keep_alive, gzip=gzip, tenant_id=None):
+    """
+    Creates a requests session with a pooled HTTPAdapter so connections (and their TLS handshakes)
+    are reused across Graph calls, and requests are paced and retried through common/throttle.py
+
+    :param pool_size: maximum number of connections kept open per host
+    :param pool_block: wait for a free connection instead of opening an extra, unpooled one
+    :param keep_alive: keep connections open between requests
+    :param gzip: ask the server for compressed responses
+    :param tenant_id: share the tenant's adaptive rate limiter (requests are only retried, not paced, without one)
+    :return requests.Session
+    """
+    session = requests.Session()
+    limiter = limiter_for(tenant_id) if tenant_id else None
+    adapter = ThrottlingAdapter(limiter, pool_connections=pool_size, pool_maxsize=pool_size, pool_block=pool_block)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    session.headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+    session.headers['Accept-Encoding'] = 'gzip, deflate' if gzip else 'identity'
+
+    return session
@@ -1,36 +1,111 @@
 #!/usr/local/bin/python3
 from datetime import datetime
 import sys
-import requests
 import os
+import hashlib
+import threading
+import time
 import cgi
+import queue
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 import common.logger as logger_common
+from common.token_cache import token_cache, token_key
+import common.session as session_common
+import common.metrics as metrics_common
+from common.tree import TreeIndex
+from common.item import DriveItem
+from common.graph import sharepoint_url, login_url, default_page_size, GraphRequestError, drive_item_details, drive_item_select, odata_query
+from common.batch import GraphBatch
+from common.delta import DeltaStateStore
+import common.upload as upload_common
+import common.hashing as hashing_common
+from common.content_cache import content_cache
+from common.metadata_cache import MetadataCache
+from common.bulk_download import BulkDownloader, bulk_download_workers
+
+# delta pages only need what the sync keeps, plus the facets marking folders, the root and deletions
+delta_select = 'id,name,parentReference,file,folder,root,deleted'
+
+download_workers = int(os.getenv('DOWNLOAD_WORKERS', 8))
+download_segment_size = int(os.getenv('DOWNLOAD_SEGMENT_SIZE', 16 * 1024 * 1024))
+
+
+class ClientRegistry:
+    """
+    Thread-safe registry of Sharepoint clients keyed by credentials, so concurrent requests for
+    different tenants never share (or overwrite) a client. Clients unused for idle_timeout seconds
+    are evicted and their sessions closed.
+    """
 
-sharepoint_url = os.getenv('SHAREPOINT_URL')
-
+    def __init__(self, idle_timeout=900):
+        self.idle_timeout = idle_timeout
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, tenant_id, client_id, client_secret):
+        key = (tenant_id, client_id, hashlib.sha256(client_secret.encode()).hexdigest())
+        now = time.monotonic()
+
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if not entry:
+                entry = self._clients[key] = {'client': Sharepoint(tenant_id, client_id, client_secret)}
+            entry['last_used'] = now
+
+            return entry['client']
+
+    def evict_idle(self):
+        with self._lock:
+            self._evict_idle(time.monotonic())
+
+    # Name -> id lookup cache stats summed over the live clients
+    def metadata_stats(self):
+        with self._lock:
+            stats = [entry['client'].metadata.stats() for entry in self._clients.values()]
+        hits, misses = sum(s['hits'] for s in stats), sum(s['misses'] for s in stats)
+        return {
+            'hits': hits,
+            'misses': misses,
+            'entries': sum(s['entries'] for s in stats),
+            'hit_ratio': hits / (hits + misses) if hits + misses else 0.0
+        }
 
-class Singleton(type):
-    _instances = {}
+    def close(self):
+        with self._lock:
+            for entry in self._clients.values():
+                entry['client'].close()
+            self._clients.clear()
 
-    def __call__(cls, *args, **kwargs):
-        if cls not in cls._instances:
-            cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
-        else:
-            cls._instances[cls].__init__(*args, **kwargs)
-        return cls._instances[cls]
+    def _evict_idle(self, now):
+        for key in [key for key, entry in self._clients.items() if now - entry['last_used'] > self.idle_timeout]:
+            self._clients.pop(key)['client'].close()
+            logger_common.logger.info(f'evicted idle sharepoint client for application id: {key[1]}')
 
 
-class Sharepoint(metaclass=Singleton):
-    def __init__(self, tenant_id, client_id, client_secret):
+class Sharepoint:
+    def __init__(self, tenant_id, client_id, client_secret, session=None):
         self.grant_type = 'client_credentials'
         self.tenant_id = tenant_id
         self.client_id = client_id
         self.client_secret = client_secret
         self.scope = f"{sharepoint_url}/.default"
+        self.session = session or session_common.create_session(tenant_id=tenant_id)
+        self.metadata = MetadataCache()
+
+    def close(self):
+        self.session.close()
 
-    # SHAREPOINT LOGIN
+    # Queue Graph calls into $batch requests (see common/batch.py)
+    def batch(self, max_retries=3):
+        return GraphBatch(self, max_retries)
+
+    # SHAREPOINT LOGIN (served from the shared token cache, only hits AAD when the token is missing or expiring)
     def login(self):
+        return token_cache.get_token(token_key(self.tenant_id, self.client_id, self.client_secret, self.scope), self.fetch_access_token)
+
+    def fetch_access_token(self):
         data = {
             'grant_type': self.grant_type,
             'client_id': self.client_id,
@@ -39,13 +114,13 @@ class Sharepoint(metaclass=Singleton):
         }
 
         try:
-            response = requests.post(f'https://login.microsoftonline.com/{self.tenant_id}/oauth2/v2.0/token', data=data)
+            response = self.session.post(f'{login_url}/{self.tenant_id}/oauth2/v2.0/token', data=data)
 
             # check rest request was successful
             if response.status_code in (200, 201, 204):
                 logger_common.logger.info(
                     f'logged into sharepoint with application id: {self.client_id}. Response: {response.status_code}')
-                return response.json().get('access_token')
+                return response.json()
 
             # if rest request unsuccessful
             else:
@@ -58,7 +133,96 @@ class Sharepoint(metaclass=Singleton):
             logger_common.logger.error(
                 f'cannot login to sharepoint with application id: {self.client_id}')
 
+    # Follow @odata.nextLink and yield each item of a collection as its page arrives
+    def iter_collection(self, url, extra_headers={}, page_size=None, select=None, filter=None, orderby=None, expand=None, next_link=False):
+        """
+        Lazily yields the items of a Graph collection across all of its pages
+
+        Note: If a collection exceeds the default page size (200 items),
+        the @odata.nextLink property is returned in the response to indicate
+        more items are available and provide the request URL for the next page of items.
+
+        :param url: collection url, e.g. f"{sharepoint_url}/v1.0/sites/{site_id}/drive/items/{drive_id}/children"
+        :param extra_headers: headers to add to the defaults, e.g. {"Prefer": 'allowthrottleablequeries'}
+        :param page_size: $top for each page (defaults to SHAREPOINT_PAGE_SIZE)
+        :param select/filter/orderby/expand: OData query options applied server-side (see common.graph.odata_query)
+        :param next_link: url is an @odata.nextLink, which already carries the query (Graph rejects repeated options)
+        :raises GraphRequestError: if a page cannot be retrieved
+        """
+        params = None if next_link else odata_query(select, filter, orderby, page_size or default_page_size, expand)
+
+        while url:
+            # log in per page so a long stream never outlives its access token
+            access_token = self.login()
+            header = {
+                "Authorization": "Bearer " + access_token,
+                "Content-Type": "application/json",
+                "If-Match": '*',
+                **extra_headers
+            }
+
+            response = self.session.get(url, headers=header, params=params)
+
+            # check rest request was successful
+            if response.status_code in (200, 201, 204):
+                body = response.json()
+                logger_common.logger.info(
+                    f'retrieved page of {len(body.get("value", []))} items. Info: {response.status_code}')
+
+                yield from body.get('value', [])
+
+                # the next link already carries the original query
+                url = body.get('@odata.nextLink')
+                params = None
+
+            # if rest request unsuccessful
+            else:
+                raise GraphRequestError(f'cannot get page: {url}. Error: {response.status_code} - {response.content}')
+
+    # Pick the named items out of a listing, stopping as soon as all of them have been seen
+    def select_items_by_name(self, items, target_item_names):
+        found = {}
+        for item in items:
+            if item['name'] in target_item_names:
+                found.setdefault(item['name'], item)
+                if len(found) == len(set(target_item_names)):
+                    break
+
+        target_items_named = []
+        for target_item in target_item_names:
+            # throws error if file name doesn't exist
+            lookup = found.get(target_item)
+            if not lookup:
+                sys.exit(f"{target_item} does not exist")
+                #raise ValueError(f"{target_item} does not exist")
+
+            target_items_named.append(lookup)
+        return target_items_named
+
+    # Name -> id lookups are served from the metadata cache, the fetch_* methods always ask Graph
     def get_site_id_by_name(self, site_name):
+        return self.metadata.get_or_load('site', site_name, lambda: self.fetch_site_id_by_name(site_name))
+
+    def get_root_drive_details(self, site_id):
+        return self.metadata.get_or_load('root_drive', site_id, lambda: self.fetch_root_drive_details(site_id))
+
+    def get_list_details(self, site_id, list_name=[], page_size=None):
+        return self.metadata.get_or_load('list', (site_id, tuple(list_name)),
+                                         lambda: self.fetch_list_details(site_id, list_name, page_size))
+
+    def get_drive_id_by_name(self, site_id, drive_name):
+        return self.metadata.get_or_load('drive', (site_id, drive_name), lambda: self.fetch_drive_id_by_name(site_id, drive_name))
+
+    def get_item_id_by_name(self, site_id, drive_id, item_name, page_size=None):
+        return self.metadata.get_or_load('item', (site_id, drive_id, item_name),
+                                         lambda: self.fetch_item_id_by_name(site_id, drive_id, item_name, page_size))
+
+    # Drop cached lookups that a move, upload or delete may have made stale
+    def forget_item(self, site_id, item_id=None, name=None):
+        self.metadata.invalidate('drive', lambda key, value: key[0] == site_id and (value == item_id or key[1] == name))
+        self.metadata.invalidate('item', lambda key, value: key[0] == site_id and (value == item_id or item_id in key or key[2] == name))
+
+    def fetch_site_id_by_name(self, site_name):
         access_token = self.login()
         header = {
             "Authorization": "Bearer " + access_token,
@@ -67,7 +231,7 @@ class Sharepoint(metaclass=Singleton):
         }
 
         try:
-            response = requests.get(
+            response = self.session.get(
                 f"{sharepoint_url}/v1.0/sites?search={site_name}",
                 headers=header)
 
@@ -76,6 +240,7 @@ class Sharepoint(metaclass=Singleton):
                 logger_common.logger.info(
                     f'retrieved sharepoint site: {site_name}. Info: {response.status_code}')
                 sites = response.json().get('value')
+                site_id = ""
 
                 # search for site name and return first one
                 for site in sites:
@@ -96,7 +261,7 @@ class Sharepoint(metaclass=Singleton):
                 f'cannot get sharepoint site:  {site_name}')
 
     # Get name and ID of root drive
-    def get_root_drive_details(self, site_id):
+    def fetch_root_drive_details(self, site_id):
         access_token = self.login()
         header = {
             "Authorization": "Bearer " + access_token,
@@ -105,7 +270,7 @@ class Sharepoint(metaclass=Singleton):
         }
 
         try:
-            response = requests.get(
+            response = self.session.get(
                 f"{sharepoint_url}/v1.0/sites/{site_id}/drive/root",
                 headers=header)
             # check rest request was successful
@@ -129,40 +294,28 @@ class Sharepoint(metaclass=Singleton):
                 f'cannot get root drive details.')
     
     # Get Name and ID of Sharepoint List(s)
-    def get_list_details(self, site_id, list_name=[]): 
-        access_token = self.login()
-        header = {
-            "Authorization": "Bearer " + access_token,
-            "Content-Type": "application/json",
-            "If-Match": '*',
-            "Prefer": 'allowthrottleablequeries'
-        }
+    def iter_list_details(self, site_id, page_size=None):
+        for item in self.iter_collection(
+                f"{sharepoint_url}/v1.0/sites/{site_id}/lists",
+                {"Prefer": 'allowthrottleablequeries'}, page_size):
+            yield {'name': item['name'], 'id': item['id']}
 
+    def fetch_list_details(self, site_id, list_name=[], page_size=None):
         try:
-            if response.status_code in (200, 201, 204):
-                logger_common.logger.info(
-                    f'retrieved list details. Info: {response.status_code}')
-                response = requests.get(
-                f"{sharepoint_url}/v1.0/sites/{site_id}/lists",
-                headers=header)
-                
-                if len(list_name) == 0:
-                    return [ { 'name': item['name'], 'id': item['id'] } for item in response.json().get('value')]
-                else:
-                    return [ { 'name': item['name'], 'id': item['id'] } for item in response.json().get('value') if item['name'] in list_name ]
-            else:
-              logger_common.logger.error(
-                    f'cannot get list: details. Error: {response.status_code} - {response.content}')
-                
+            lists = [item for item in self.iter_list_details(site_id, page_size)
+                     if len(list_name) == 0 or item['name'] in list_name]
+            logger_common.logger.info(f'retrieved list details: {len(lists)} lists')
+            return lists
+
         except Exception as e:
             logger_common.logger.error(e, exc_info=True)
             logger_common.logger.error(
                 f'cannot get list: details')
-    
+
     # Get Parent and Child structure using IDs 
     def get_parent_child_structure_by_ids(self, items, child_id_key, parent_id_key, *args):
         """
-        Groups all children ids under their parent id
+        Groups all descendant ids under their parent id (kept for callers of the old map, prefer TreeIndex)
         
         :param obj:
                     items = [
@@ -178,155 +331,176 @@ class Sharepoint(metaclass=Singleton):
         :param parent_id_key: 'parent'
         :param *args: 'some_arg' <-- the name of any extra keys to be associated with the child
         :return map of parents mapped to list of children
-            {1: [{'id': 2, 'some_arg': 'folder'}, {'id': 6, 'some_arg': 'file'}, {'id': 3, 'some_arg': 'folder'}, {'id': 7, 'some_arg': 'folder'}, {'id': 4, 'some_arg': 'file'}], 2: [{'id': 3, 'some_arg': 'folder'}, {'id': 7, 'some_arg': 'folder'}, {'id': 4, 'some_arg': 'file'}, {'id': 4, 'some_arg': 'file'}], 3: [{'id': 4, 'some_arg': 'file'}], 4: [], 5: [], 6: [], 7: []}
+            {1: [{'id': 2, 'some_arg': 'folder'}, {'id': 6, 'some_arg': 'file'}, {'id': 3, 'some_arg': 'folder'}, {'id': 7, 'some_arg': 'folder'}, {'id': 4, 'some_arg': 'file'}], 2: [{'id': 3, 'some_arg': 'folder'}, {'id': 7, 'some_arg': 'folder'}, {'id': 4, 'some_arg': 'file'}], 3: [{'id': 4, 'some_arg': 'file'}], 4: [], 5: [], 6: [], 7: []}
         """
-        def crawl_relatives(relatives, families):
-            if len(relatives) and len(families[relatives[0][child_id_key]]) and families[relatives[0][child_id_key]][0] != relatives[-1][child_id_key]:
-                crawl_relatives(families[relatives[0][child_id_key]], families)
-                relatives += families[relatives[0][child_id_key]]
+        tree = TreeIndex(items, child_id_key, parent_id_key)
 
+        return {
+            item_id: [{child_id_key: child[child_id_key], **{a: child[a] for a in args}} for child in tree.iter_descendants(item_id)]
+            for item_id in tree.items
+        }
+    
+    # List folder, subfolder and file details (returns items and a TreeIndex over them)
+    def iter_drives_and_items(self, site_id, list_id, folders_only=False, page_size=None, filter=None, orderby=None):
+        """
+        :param filter: $filter on the list item columns, e.g. odata_filter(created_after=..., list_fields=True)
+        """
+        # filter to apply
+        if folders_only:
+            filter = " and ".join(f for f in ("fields/ContentType eq 'Folder'", filter) if f)
+
+        # only fetch the properties used below instead of the whole list item, drive item and all columns
+        for item in self.iter_collection(
+                f"{sharepoint_url}/v1.0/sites/{site_id}/lists/{list_id}/items",
+                {"Prefer": 'allowthrottleablequeries'}, page_size, select='id,contentType', filter=filter, orderby=orderby,
+                expand='driveItem($select=id,name,parentReference),fields($select=ContentType)'):
+            # get relevant item details
+            yield DriveItem(
+                name=item['driveItem']['name'],
+                id=item['driveItem']['id'],
+                parent_id=item['driveItem']['parentReference']['id'],
+                #parent_name=item['driveItem']['parentReference']['name'],
+                content_type=item.get('contentType', {}).get('name')
+            )
+
+    def list_drives_and_items(self, site_id, list_id, root_drive_id, folders_only=False, page_size=None):
+        try:
+            items = list(self.iter_drives_and_items(site_id, list_id, folders_only, page_size))
+            logger_common.logger.info(
+                f'list subfolders and files in folder: {len(items)} items')
 
-        families = {item[child_id_key]: [] for item in items}
+            # add root drive details
+            items.append(DriveItem('Root Drive', root_drive_id, None, 'Folder'))
 
-        for item in items:
-            if item[parent_id_key] is not None:
-                item_dict = {}
-                if args:
-                    for a in args:
-                        item_dict[child_id_key] = item[child_id_key]
-                        item_dict[a] = item[a]
-                else:
-                    item_dict[child_id_key] = item[child_id_key]
-                
-                families[item[parent_id_key]].append(item_dict)
-            
-        
-        for relatives in families.values():
-            crawl_relatives(relatives, families)
-        
-        families = {k: [dict(s) for s in set(frozenset(d.items()) for d in v)] for k, v in families.items()}
+            return {
+                        "items": items,
+                        "tree": TreeIndex(items, 'id', 'parent_id')
+                    }
 
-        return families
-    
-    # List folder, subfolder and file details (returns items and parent-child structured items)
-    def list_drives_and_items(self, site_id, list_id, root_drive_id, folders_only=False): 
-        access_token = self.login()
-        header = {
-            "Authorization": "Bearer " + access_token,
-            "Content-Type": "application/json",
-            "If-Match": '*',
-            "Prefer": 'allowthrottleablequeries'
-        }
+        except Exception as e:
+            logger_common.logger.error(e, exc_info=True)
+            logger_common.logger.error(
+                f'cannot get items in list: {list_id}')
 
-        # filter to append
-        if folders_only:
-            uri_filter = "&$filter=fields/ContentType eq 'Folder'"
-        else:
-            uri_filter = ""
+    # Incrementally sync a drive with Graph delta queries, folding the changes into a cached TreeIndex
+    def sync_drive_delta(self, site_id, drive_id=None, state_store=None, page_size=None):
+        """
+        The first run enumerates the whole drive; later runs only fetch what changed since the
+        delta link saved by the previous run.
 
-        try:
-            response = requests.get(
-            f"{sharepoint_url}/v1.0/sites/{site_id}/lists/{list_id}/items?$expand=driveItem,fields{uri_filter}",
-            headers=header)
+        :param drive_id: document library id (defaults to the site's default drive)
+        :param state_store: DeltaStateStore holding delta links and cached items
+        :return {'created': [items], 'modified': [items], 'deleted': [items], 'tree': TreeIndex}
+        """
+        state_store = state_store or DeltaStateStore()
+        drive_url = f"{sharepoint_url}/v1.0/sites/{site_id}/drives/{drive_id}" if drive_id else f"{sharepoint_url}/v1.0/sites/{site_id}/drive"
+        key = drive_url.split('/v1.0/', 1)[1]
+
+        state = state_store.load(key) or {}
+        tree = TreeIndex(DriveItem(**item) for item in state.get('items', []))
+        previous_items = dict(tree.items)
+        # a saved delta link already carries the original query, Graph rejects repeated options
+        url = state.get('delta_link') or f"{drive_url}/root/delta"
+        params = None if state.get('delta_link') else odata_query(delta_select, top=page_size or default_page_size)
+        created, modified, deleted = {}, {}, {}
 
-            # check rest request was successful
-            if response.status_code in (200, 201, 204):
+        try:
+            while True:
+                access_token = self.login()
+                header = {
+                    "Authorization": "Bearer " + access_token,
+                    "Content-Type": "application/json"
+                }
+
+                response = self.session.get(url, headers=header, params=params)
+
+                # delta link expired, start again from a full enumeration
+                if response.status_code == 410:
+                    logger_common.logger.info(f'delta link expired for: {key}, resyncing')
+                    tree = TreeIndex()
+                    url, params = f"{drive_url}/root/delta", odata_query(delta_select, top=page_size or default_page_size)
+                    created, modified, deleted = {}, {}, {}
+                    continue
+
+                # if rest request unsuccessful
+                if response.status_code not in (200, 201, 204):
+                    raise GraphRequestError(f'cannot get delta: {key}. Error: {response.status_code} - {response.content}')
+
+                body = response.json()
+                for item in body.get('value', []):
+                    if 'deleted' in item:
+                        for removed in tree.remove(item['id']):
+                            created.pop(removed['id'], None)
+                            modified.pop(removed['id'], None)
+                            if removed['id'] in previous_items:
+                                deleted[removed['id']] = removed
+                        continue
+
+                    details = DriveItem(
+                        name=item.get('name'),
+                        id=item['id'],
+                        parent_id=item.get('parentReference', {}).get('id'),
+                        content_type='Folder' if 'folder' in item or 'root' in item else 'Document'
+                    )
+                    (modified if details.id in previous_items else created)[details.id] = details
+                    tree.add(details)
+
+                # the next link already carries the original query
+                params = None
+                if body.get('@odata.nextLink'):
+                    url = body['@odata.nextLink']
+                    continue
+
+                # after a resync anything cached that was not enumerated again has gone
+                for item_id in previous_items.keys() - tree.items.keys() - deleted.keys():
+                    deleted[item_id] = previous_items[item_id]
+
+                state_store.save(key, {'delta_link': body['@odata.deltaLink'], 'items': [dict(item) for item in tree.items.values()]})
                 logger_common.logger.info(
-                    f'list subfolders and files in folder. Info: {response.status_code}')
-
-                
-                # get relevant item details
-                items = [
-                    {
-                        'name': item['driveItem']['name'],
-                        'id': item['driveItem']['id'],
-                        'parent_id': item['driveItem']['parentReference']['id'],
-                        #'parent_name': item['driveItem']['parentReference']['name'],
-                        'content_type': item.get('contentType', {}).get('name')
-                    }
-                for item in response.json().get('value')]
-                # add root drive details
-                items.append({ 'name': 'Root Drive', 'id': root_drive_id, 'parent_id': None, 'content_type': 'Folder'})      
-
-                # get parent-child item structure
-                structured_items = self.get_parent_child_structure_by_ids(items, 'id', 'parent_id', 'name', 'content_type')
+                    f'synced drive: {key}. Created: {len(created)}, modified: {len(modified)}, deleted: {len(deleted)}')
 
                 return {
-                            "items": items, 
-                            "items_parent_child_ids": structured_items
-                        }
-            
-            # if rest request unsuccessful
-            else:
-                logger_common.logger.error(
-                    f'cannot get items. Error: {response.status_code} - {response.content}')
-                
+                    "created": list(created.values()),
+                    "modified": list(modified.values()),
+                    "deleted": list(deleted.values()),
+                    "tree": tree
+                }
+
         except Exception as e:
             logger_common.logger.error(e, exc_info=True)
             logger_common.logger.error(
-                f'error')
+                f'cannot sync drive: {key}')
 
     # List folder and file details by path
-    def list_drive_items_by_path(self, site_id, drive_path, target_item_names=[]):
-        access_token = self.login()
-        header = {
-            "Authorization": "Bearer " + access_token,
-            "Content-Type": "application/json",
-            "If-Match": '*'
-        }
-
+    def iter_drive_items_by_path(self, site_id, drive_path, page_size=None, select=drive_item_select, include=None, orderby=None):
+        """
+        :param select: driveItem properties to fetch (by default only those drive_item_details uses)
+        :param include: predicate(item) -> bool, e.g. item_filter(content_type='Document', created_after=...)
+        :param orderby: e.g. 'name' or 'lastModifiedDateTime desc'
+        """
+        for item in self.iter_collection(
+                f"{sharepoint_url}/v1.0/sites/{site_id}/drive/root:/{drive_path}:/children",
+                page_size=page_size, select=select, orderby=orderby):
+            # filtered here, /children of SharePoint drives cannot evaluate $filter (see odata_filter)
+            details = drive_item_details(item)
+            if not include or include(details):
+                yield details
+
+    def list_drive_items_by_path(self, site_id, drive_path, target_item_names=[], page_size=None, include=None, orderby=None):
         try:
-            response = requests.get(
-            f"{sharepoint_url}/v1.0/sites/{site_id}/drive/root:/{drive_path}:/children",
-            headers=header)
-            
-            # check rest request was successful
-            if response.status_code in (200, 201, 204):
-                logger_common.logger.info(
-                    f'retrieved items: Info: {response.status_code}')
-
-                items = [
-                        {
-                            'name': item['name'],
-                            'id': item['id'],
-                            'parent_id': item['parentReference']['id'],
-                            #'parent_name': item['parentReference']['name'],
-                            'content_type': 'Document' if item.get('@microsoft.graph.downloadUrl', {}) else 'Folder'
-                        }
-                    for item in response.json().get('value')]
-                
-                
-                if len(target_item_names) == 0:
-                    return items
-                else:
-                    target_items_named = []
-                    for target_item in target_item_names:
-                        # throws error if file name doesn't exist
-                        lookup = next(filter(lambda x: x['name'] == target_item, items), None)
-                        if not lookup:
-                            sys.exit(f"{target_item} does not exist")
-                            #raise ValueError(f"{target_item} does not exist")
-                            
-                        target_items_named.append(lookup)
-                    return target_items_named
-            
-            # if rest request unsuccessful
+            items = self.iter_drive_items_by_path(site_id, drive_path, page_size, include=include, orderby=orderby)
+
+            if len(target_item_names) == 0:
+                return list(items)
             else:
-                logger_common.logger.error(
-                    f'Cannot get items in drive path: {drive_path}. Error: {response.status_code} - {response.content}')
+                return self.select_items_by_name(items, target_item_names)
 
         except Exception as e:
             logger_common.logger.error(e, exc_info=True)
             logger_common.logger.error(
-                f'error')
-        
-        """
-        Note: If a collection exceeds the default page size (200 items), 
-        the @odata.nextLink property is returned in the response to indicate 
-        more items are available and provide the request URL for the next page of items.
-        """
+                f'Cannot get items in drive path: {drive_path}')
 
-    def get_drive_id_by_name(self, site_id, drive_name):
+    def fetch_drive_id_by_name(self, site_id, drive_name):
         access_token = self.login()
         header = {
             "Authorization": "Bearer " + access_token,
@@ -335,7 +509,17 @@ class Sharepoint(metaclass=Singleton):
         }
 
         try:
-            response = requests.get(
+            # a folder at the root of the drive can be addressed by path, which is quicker and
+            # (unlike search) not eventually consistent
+            response = self.session.get(
+                f"{sharepoint_url}/v1.0/sites/{site_id}/drive/root:/{drive_name}",
+                params={'$select': 'id,name'}, headers=header)
+            if response.status_code == 200:
+                logger_common.logger.info(
+                    f'retrieved folder: {drive_name}. Info: {response.status_code}')
+                return response.json()['id']
+
+            response = self.session.get(
                 f"{sharepoint_url}/v1.0/sites/{site_id}/drive/root/search(q='{drive_name}')",
                 headers=header)
             drive_id = ""
@@ -363,58 +547,136 @@ class Sharepoint(metaclass=Singleton):
             logger_common.logger.error(
                 f'cannot get folder:  {drive_name}')
 
-    def list_drive_items_by_id(self, site_id, drive_id, target_item_names=[]):
-        access_token = self.login()
-        header = {
-            "Authorization": "Bearer " + access_token,
-            "Content-Type": "application/json",
-            "If-Match": '*'
-        }
+    def iter_drive_items_by_id(self, site_id, drive_id, page_size=None, select=drive_item_select, include=None, orderby=None):
+        for item in self.iter_collection(
+                f"{sharepoint_url}/v1.0/sites/{site_id}/drive/items/{drive_id}/children",
+                page_size=page_size, select=select, orderby=orderby):
+            # filtered here, /children of SharePoint drives cannot evaluate $filter (see odata_filter)
+            details = drive_item_details(item)
+            if not include or include(details):
+                yield details
 
+    def list_drive_items_by_id(self, site_id, drive_id, target_item_names=[], page_size=None, include=None, orderby=None):
         try:
-            response = requests.get(f"{sharepoint_url}/v1.0/sites/{site_id}/drive/items/{drive_id}/children",
-                                    headers=header)
+            items = self.iter_drive_items_by_id(site_id, drive_id, page_size, include=include, orderby=orderby)
 
-            # check rest request was successful
-            if response.status_code in (200, 201, 204):
-                logger_common.logger.info(
-                    f'retrieved items: Info: {response.status_code}')
-
-                items = [
-                        {
-                            'name': item['name'],
-                            'id': item['id'],
-                            'parent_id': item['parentReference']['id'],
-                            'content_type': 'Document' if item.get('@microsoft.graph.downloadUrl', {}) else 'Folder'
-                        }
-                    for item in response.json().get('value')]
-                
-                
-                if len(target_item_names) == 0:
-                    return items
-                else:
-                    target_items_named = []
-                    for target_item in target_item_names:
-                        # throws error if file name doesn't exist
-                        lookup = next(filter(lambda x: x['name'] == target_item, items), None)
-                        if not lookup:
-                            sys.exit(f"{target_item} does not exist")
-                            #raise ValueError(f"{target_item} does not exist")
-                            
-                        target_items_named.append(lookup)
-                    return target_items_named
-            
-            # if rest request unsuccessful
+            if len(target_item_names) == 0:
+                return list(items)
             else:
-                logger_common.logger.error(
-                    f'Cannot list items in for drive id: {drive_id}. Error: {response.status_code} - {response.content}')
+                return self.select_items_by_name(items, target_item_names)
 
         except Exception as e:
             logger_common.logger.error(e, exc_info=True)
             logger_common.logger.error(
                 f'Cannot list items in for drive id: {drive_id}')
 
-    def get_item_id_by_name(self, site_id, drive_id, item_name):
+    # List the children of many folders with one $batch request per 20 folders
+    def list_drive_items_by_ids(self, site_id, drive_ids, page_size=None):
+        """
+        :param drive_ids: folder ids to list
+        :return {drive_id: [items]}, folders that could not be listed map to None
+        """
+        with self.batch() as batch:
+            futures = {drive_id: batch.list_children(site_id, drive_id, page_size) for drive_id in drive_ids}
+
+        items_by_id = {}
+        for drive_id, future in futures.items():
+            try:
+                body = future.result()
+                items = [drive_item_details(item) for item in body.get('value', [])]
+
+                # the batch only returns the first page of each folder
+                if body.get('@odata.nextLink'):
+                    items.extend(drive_item_details(item) for item in self.iter_collection(body['@odata.nextLink'], next_link=True))
+
+                items_by_id[drive_id] = items
+
+            except Exception as e:
+                logger_common.logger.error(e, exc_info=True)
+                logger_common.logger.error(
+                    f'Cannot list items in for drive id: {drive_id}')
+                items_by_id[drive_id] = None
+
+        return items_by_id
+
+    # Walk a folder tree breadth-first on a thread pool, yielding documents as they are discovered
+    def walk(self, site_id, path_or_id='/', max_depth=None, workers=8, include=None, exclude=None, page_size=None, errors=None):
+        """
+        :param path_or_id: folder path starting with '/' (e.g. '/Three/Nested/Folders') or a folder id
+        :param max_depth: levels below the start folder to descend (1 = its direct children only)
+        :param workers: folders listed concurrently
+        :param include: predicate(document) -> bool, only matching documents are yielded
+        :param exclude: predicate(folder) -> bool, matching folders are pruned without being listed
+        :param errors: list that folders which could not be listed are appended to, as 'folder: error'
+        """
+        discovered = queue.Queue()
+
+        def list_folder(folder_id, drive_path, depth):
+            try:
+                if drive_path:
+                    items = self.iter_drive_items_by_path(site_id, drive_path, page_size)
+                else:
+                    items = self.iter_drive_items_by_id(site_id, folder_id, page_size)
+                for item in items:
+                    discovered.put((item, depth))
+
+            except Exception as e:
+                logger_common.logger.error(e, exc_info=True)
+                logger_common.logger.error(
+                    f'Cannot list items in for drive id: {folder_id or drive_path}')
+                if errors is not None:
+                    errors.append(f'{folder_id or drive_path}: {e}')
+
+            # tell the walker this folder is finished
+            finally:
+                discovered.put((None, depth))
+
+        if path_or_id.strip('/') == '':
+            start = ('root', None)
+        elif path_or_id.startswith('/'):
+            # drive paths are relative to the root, root://A/B would be a different (empty) name
+            start = (None, path_or_id.strip('/'))
+        else:
+            start = (path_or_id, None)
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            executor.submit(list_folder, *start, 1)
+            outstanding = 1
+
+            while outstanding:
+                item, depth = discovered.get()
+                if item is None:
+                    outstanding -= 1
+
+                elif item['content_type'] == 'Folder':
+                    if (max_depth is None or depth < max_depth) and not (exclude and exclude(item)):
+                        executor.submit(list_folder, item['id'], None, depth + 1)
+                        outstanding += 1
+
+                elif not include or include(item):
+                    yield item
+
+        # stop listing folders nobody is waiting for if the caller stops early
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def fetch_item_id_by_name(self, site_id, drive_id, item_name, page_size=None):
+        try:
+            # search for item name and return id, stopping at the first page that has it
+            item_id = next((item['id'] for item in self.iter_drive_items_by_id(site_id, drive_id, page_size)
+                            if item['name'] == item_name), "")
+            logger_common.logger.info(f'retrieved item: {item_name}. Found: {bool(item_id)}')
+
+            return item_id
+
+        # if attempt at rest request failed or above failed to return results
+        except Exception as e:
+            logger_common.logger.error(e, exc_info=True)
+            logger_common.logger.error(
+                f'cannot get item:  {item_name}')
+
+    def download_item_by_id(self, site_id, item_id, local_file_directory, use_cache=True):
         access_token = self.login()
         header = {
             "Authorization": "Bearer " + access_token,
@@ -422,81 +684,214 @@ class Sharepoint(metaclass=Singleton):
             "If-Match": '*'
         }
 
+        # revalidate cached content instead of downloading it again
+        cached = content_cache.lookup(item_id) if use_cache else None
+        if cached:
+            del header["If-Match"]
+            header["If-None-Match"] = cached['etag']
+
         try:
-            response = requests.get(f"{sharepoint_url}/v1.0/sites/{site_id}/drive/items/{drive_id}/children",
-                                    headers=header)
+            # close the streamed response so its connection goes back to the pool
+            with self.session.get(
+                    f"{sharepoint_url}/v1.0/sites/{site_id}/drive/items/{item_id}/content",
+                    stream=True, headers=header) as response:
+
+                filename = ""
+                # content has not changed since it was cached
+                if cached and response.status_code == 304:
+                    filename = os.path.basename(cached['name'])
+                    try:
+                        content_cache.hit(cached, os.path.join(local_file_directory, filename))
+                    # evicted by another process in the meantime
+                    except FileNotFoundError:
+                        content_cache.invalidate(item_id)
+                        return self.download_item_by_id(site_id, item_id, local_file_directory)
+
+                    logger_common.logger.info(
+                        f'item: {item_id} not modified, served from cache. Cache: {content_cache.stats()}')
+                    return filename
 
-            item_id = ""
-            # check rest request was successful
-            if response.status_code in (200, 201, 204):
-                logger_common.logger.info(
-                    f'retrieved item: {item_name}. Info: {response.status_code}')
-                items = response.json().get('value')
+                # check rest request was successful
+                if response.status_code in (200, 201, 204):
+                    logger_common.logger.info(
+                        f'downloaded item: {item_id}. Info: {response.status_code}')
+                    params = cgi.parse_header(
+                        response.headers.get('Content-Disposition', ''))[-1]
 
-                # search for item name and return id
-                for item in items:
-                    if item['name'] == item_name:
-                        item_id = item['id']
+                    if 'filename' not in params:
+                        logger_common.logger.error(
+                            f'Could not find a file for download. Error: {response.status_code} - {response.content}')
 
-                return item_id
+                    filename = os.path.basename(params['filename'])
+                    abs_path = os.path.join(local_file_directory, filename)
+                    # the session asks for gzip, so let urllib3 decode the body
+                    response.raw.decode_content = True
 
-            # if rest request unsuccessful
-            else:
-                logger_common.logger.error(
-                    f'cannot get item: {item_name}. Error: {response.status_code} - {response.content}')
+                    etag = response.headers.get('ETag')
+                    if use_cache and etag:
+                        content_cache.store(item_id, etag, filename, response.raw, abs_path)
+                        logger_common.logger.info(f'cached item: {item_id}. Cache: {content_cache.stats()}')
+                        return filename
+
+                    with open(abs_path, 'wb') as target:
+                        shutil.copyfileobj(response.raw, target)
+
+                        return filename
+
+                # if rest request unsuccessful
+                else:
+                    logger_common.logger.error(
+                        f'Could not download a file. Error: {response.status_code} - {response.content}')
 
 
         # if attempt at rest request failed or above failed to return results
         except Exception as e:
             logger_common.logger.error(e, exc_info=True)
             logger_common.logger.error(
-                f'cannot get item:  {item_name}')
+                f'Could not find a file for download')
+
+    # Download many items concurrently, writing a manifest and skipping files that are already up to date
+    def download_items(self, site_id, items, local_file_directory, workers=bulk_download_workers, manifest_path=None, progress=None):
+        """
+        :param items: item ids and/or item details from the listing methods or walk
+        :return summary of the run (see BulkDownloader.stats)
+        """
+        return BulkDownloader(self, site_id, local_file_directory, workers, manifest_path, progress).run(items)
 
-    def download_item_by_id(self, site_id, item_id, local_file_directory):
+    # Download a large item as byte ranges in parallel, into a preallocated file
+    def download_item_segmented(self, site_id, item_id, local_file_directory, workers=download_workers,
+                                segment_size=download_segment_size, max_retries=3, filename=None):
+        """
+        Splits the item into segment_size byte ranges fetched by `workers` threads, each writing at its
+        own offset of a preallocated file. Failed segments are retried on their own and the finished
+        file is checked against the item's size and hash before it replaces any existing copy.
+
+        :param filename: name to save the item as (defaults to the item's name)
+        :return the downloaded filename
+        """
+        part_path = None
+        try:
+            item = self.get_item_download_details(site_id, item_id)
+            filename = filename or os.path.basename(item['name'])
+            abs_path = os.path.join(local_file_directory, filename)
+            part_path = abs_path + '.part'
+            size = item['size']
+
+            # preallocate so every segment can be written in place
+            with open(part_path, 'wb') as target:
+                target.truncate(size)
+
+            download_url = {'url': item['@microsoft.graph.downloadUrl']}
+            segments = [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+
+            def download_segment(start, end):
+                for attempt in range(max_retries + 1):
+                    try:
+                        with self.session.get(download_url['url'], stream=True,
+                                              headers={'Range': f'bytes={start}-{end}', 'Accept-Encoding': 'identity'}) as response:
+
+                            # pre-authenticated download urls expire, fetch a fresh one
+                            if response.status_code in (401, 403):
+                                download_url['url'] = self.get_item_download_details(site_id, item_id)['@microsoft.graph.downloadUrl']
+                                raise GraphRequestError(f'download url expired. Error: {response.status_code}')
+                            if response.status_code != 206:
+                                raise GraphRequestError(f'cannot download bytes {start}-{end}. Error: {response.status_code}')
+
+                            written = 0
+                            with open(part_path, 'r+b') as target:
+                                target.seek(start)
+                                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                                    target.write(chunk)
+                                    written += len(chunk)
+
+                        if written != end - start + 1:
+                            raise GraphRequestError(f'segment {start}-{end} was cut short at {written} bytes')
+                        return written
+
+                    except Exception as e:
+                        if attempt == max_retries:
+                            raise
+                        logger_common.logger.error(f'retrying segment {start}-{end} of item: {item_id}. Error: {e}')
+                        time.sleep(2 ** attempt)
+
+            started = time.monotonic()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                downloaded = sum(executor.map(lambda segment: download_segment(*segment), segments))
+            bytes_per_second = downloaded / max(time.monotonic() - started, 1e-6)
+
+            # check the assembled file before it replaces anything
+            if os.path.getsize(part_path) != size:
+                raise GraphRequestError(f'downloaded size {os.path.getsize(part_path)} does not match item size {size}')
+            expected_hash = item.get('file', {}).get('hashes', {}).get('quickXorHash')
+            if expected_hash and hashing_common.quickxor_file(part_path) != expected_hash:
+                raise GraphRequestError(f'quickXorHash of downloaded item: {item_id} does not match')
+
+            os.replace(part_path, abs_path)
+            logger_common.logger.info(
+                f'downloaded item: {item_id} in {len(segments)} segments. Throughput: {bytes_per_second / (1024 * 1024):.2f} MB/s')
+            return filename
+
+        # if attempt at rest request failed or above failed to return results
+        except Exception as e:
+            logger_common.logger.error(e, exc_info=True)
+            logger_common.logger.error(
+                f'Could not download item: {item_id}')
+            if part_path and os.path.exists(part_path):
+                os.remove(part_path)
+
+    # Name, size, hashes and a pre-authenticated download url of an item
+    def get_item_download_details(self, site_id, item_id):
         access_token = self.login()
         header = {
             "Authorization": "Bearer " + access_token,
-            "Content-Type": "application/json",
-            "If-Match": '*'
+            "Content-Type": "application/json"
         }
 
-        try:
-            response = requests.get(
-                f"{sharepoint_url}/v1.0/sites/{site_id}/drive/items/{item_id}/content",
-                stream=True, headers=header)
+        response = self.session.get(
+            f"{sharepoint_url}/v1.0/sites/{site_id}/drive/items/{item_id}",
+            params={'$select': 'id,name,size,file,eTag,cTag,@microsoft.graph.downloadUrl'}, headers=header)
 
-            filename = ""
-            # check rest request was successful
-            if response.status_code in (200, 201, 204):
-                logger_common.logger.info(
-                    f'downloaded item: {item_id}. Info: {response.status_code}')
-                params = cgi.parse_header(
-                    response.headers.get('Content-Disposition', ''))[-1]
+        # check rest request was successful
+        if response.status_code in (200, 201, 204):
+            return response.json()
 
-                if 'filename' not in params:
-                    logger_common.logger.error(
-                        f'Could not find a file for download. Error: {response.status_code} - {response.content}')
+        raise GraphRequestError(f'cannot get item: {item_id}. Error: {response.status_code} - {response.content}')
 
-                filename = os.path.basename(params['filename'])
-                abs_path = os.path.join(local_file_directory, filename)
+    # Open the content stream of an item (optionally a byte range of it) for relaying, the caller closes it
+    def open_item_stream(self, site_id, item_id, range_header=None, if_range=None):
+        access_token = self.login()
+        header = {
+            "Authorization": "Bearer " + access_token,
+            # relay the bytes as stored so Content-Length and ranges stay valid
+            "Accept-Encoding": 'identity'
+        }
+        if range_header:
+            header['Range'] = range_header
+        if if_range:
+            header['If-Range'] = if_range
 
-                with open(abs_path, 'wb') as target:
-                    # response.raw.decode_content = True
-                    shutil.copyfileobj(response.raw, target)
+        try:
+            response = self.session.get(
+                f"{sharepoint_url}/v1.0/sites/{site_id}/drive/items/{item_id}/content",
+                stream=True, headers=header)
 
-                    return filename
+            # check rest request was successful (416: the requested range is outside the file)
+            if response.status_code in (200, 206, 416):
+                logger_common.logger.info(
+                    f'opened item stream: {item_id}. Range: {range_header}. Info: {response.status_code}')
+                return response
 
             # if rest request unsuccessful
             else:
                 logger_common.logger.error(
-                    f'Could not download a file. Error: {response.status_code} - {response.content}')
-
+                    f'Could not open item stream. Error: {response.status_code} - {response.content}')
+                response.close()
 
         # if attempt at rest request failed or above failed to return results
         except Exception as e:
             logger_common.logger.error(e, exc_info=True)
             logger_common.logger.error(
-                f'Could not find a file for download')
+                f'Could not open item stream: {item_id}')
 
     def move_item_to_new_drive(self, site_id, item_id, target_folder_id, target_file_name):
         access_token = self.login()
@@ -514,7 +909,7 @@ class Sharepoint(metaclass=Singleton):
         }
 
         try:
-            response = requests.patch(
+            response = self.session.patch(
                 f"{sharepoint_url}/v1.0/sites/{site_id}/drive/items/{item_id}",
                 data=str(data), headers=header)
 
@@ -522,6 +917,7 @@ class Sharepoint(metaclass=Singleton):
             if response.status_code in (200, 201, 204):
                 logger_common.logger.info(
                     f'moved item: {item_id} to folder: {target_folder_id} with filename {target_file_name}. Info: {response.status_code}')
+                self.forget_item(site_id, item_id, target_file_name)
                 return response
 
             # if rest request unsuccessful
@@ -546,14 +942,20 @@ class Sharepoint(metaclass=Singleton):
         file_path = os.path.join(local_file_path, local_file_name)
 
         try:
-            response = requests.put(
-                f"{sharepoint_url}/v1.0/sites/{site_id}/drive/items/{target_drive_id}:/{target_file_name}:/content"
-                , stream=True, headers=header, data=open(file_path, 'rb'))
+            # a single PUT is limited to small files, larger ones go through a resumable upload session
+            if os.path.getsize(file_path) > upload_common.simple_upload_limit:
+                return self.upload_large_file_to_drive(site_id, local_file_path, local_file_name, target_drive_id, target_file_name)
+
+            with open(file_path, 'rb') as data:
+                response = self.session.put(
+                    f"{sharepoint_url}/v1.0/sites/{site_id}/drive/items/{target_drive_id}:/{target_file_name}:/content"
+                    , headers=header, data=data)
 
             # check rest request was successful
             if response.status_code in (200, 201, 204):
                 logger_common.logger.info(
                     f'uploaded file: {file_path} to SharePoint folder: {target_drive_id} with filename {target_file_name}. Info: {response.status_code}')
+                self.forget_item(site_id, name=target_file_name)
                 return response
 
             # if rest request unsuccessful
@@ -567,6 +969,218 @@ class Sharepoint(metaclass=Singleton):
             logger_common.logger.error(
                 f'Could not upload file')
 
+    # Upload a large file in fixed-size ranged chunks through a resumable upload session
+    def upload_large_file_to_drive(self, site_id, local_file_path, local_file_name, target_drive_id, target_file_name,
+                                   chunk_size=upload_common.chunk_size, state_store=None, max_retries=3, progress=None):
+        """
+        The session url is persisted, so a failed chunk, or a restarted process uploading the same
+        unchanged file, resumes from the last byte Graph acknowledged.
+
+        :param chunk_size: bytes per chunk, a multiple of 320 KiB (defaults to UPLOAD_CHUNK_SIZE)
+        :param state_store: UploadStateStore holding in-progress upload sessions
+        :param progress: optional callable(bytes_sent, total_size, bytes_per_second) called after each chunk
+        :return the uploaded driveItem json
+        """
+        file_path = os.path.join(local_file_path, local_file_name)
+        state_store = state_store or upload_common.UploadStateStore()
+        key = f"{site_id}/{target_drive_id}/{target_file_name}"
+
+        try:
+            file_state = {
+                'file_path': os.path.abspath(file_path),
+                'size': os.path.getsize(file_path),
+                'modified': os.path.getmtime(file_path)
+            }
+
+            # resume only if the same, unchanged local file is being uploaded
+            offset = None
+            state = state_store.load(key)
+            if state and all(state.get(k) == v for k, v in file_state.items()):
+                upload_url = state['upload_url']
+                offset = self.get_upload_offset(upload_url)
+                if offset is not None:
+                    logger_common.logger.info(f'resuming upload of: {file_path} from byte {offset}')
+
+            if offset is None:
+                upload_url = self.create_upload_session(site_id, target_drive_id, target_file_name)['uploadUrl']
+                offset = 0
+
+            started, start_offset, failures = time.monotonic(), offset, 0
+            with open(file_path, 'rb') as file:
+                while True:
+                    state_store.save(key, {**file_state, 'upload_url': upload_url, 'offset': offset})
+                    file.seek(offset)
+                    chunk = file.read(chunk_size)
+
+                    try:
+                        offset, item = self.upload_chunk(upload_url, chunk, offset, file_state['size'])
+                        failures = 0
+
+                    except Exception as e:
+                        failures += 1
+                        if failures > max_retries:
+                            raise
+                        logger_common.logger.error(e, exc_info=True)
+                        time.sleep(2 ** failures)
+
+                        # carry on from whatever Graph last acknowledged
+                        offset = self.get_upload_offset(upload_url)
+                        if offset is None:
+                            raise GraphRequestError(f'upload session for: {file_path} has expired')
+                        continue
+
+                    bytes_per_second = (offset - start_offset) / max(time.monotonic() - started, 1e-6)
+                    if progress:
+                        progress(offset, file_state['size'], bytes_per_second)
+
+                    if item:
+                        state_store.delete(key)
+                        self.forget_item(site_id, name=target_file_name)
+                        logger_common.logger.info(
+                            f'uploaded file: {file_path} to SharePoint folder: {target_drive_id} with filename {target_file_name}. '
+                            f'Throughput: {bytes_per_second / (1024 * 1024):.2f} MB/s')
+                        return item
+
+        # if attempt at rest request failed or above failed to return results
+        except Exception as e:
+            logger_common.logger.error(e, exc_info=True)
+            logger_common.logger.error(
+                f'Could not upload file: {file_path}')
+
+    # Upload from a readable stream (e.g. an incoming request body), holding at most one chunk in memory
+    def upload_stream_to_drive(self, site_id, stream, total_size, target_drive_id, target_file_name,
+                               chunk_size=upload_common.chunk_size, max_retries=3):
+        """
+        :param stream: object with read(size), read exactly once and never rewound
+        :param total_size: bytes the stream will provide, or None if unknown. Streams of unknown size are
+                           read one chunk ahead: chunks before the last announce their total as '*'
+        :return the uploaded driveItem json
+        """
+        try:
+            buffered = b''
+            # small files go in a single PUT
+            if total_size is None or total_size <= upload_common.simple_upload_limit:
+                # one byte more than announced (or than a single PUT takes) tells a wrong or unknown size apart
+                # from a stream that ends exactly on it
+                data = upload_common.read_exactly(stream, (upload_common.simple_upload_limit if total_size is None else total_size) + 1)
+                if total_size is None and len(data) <= upload_common.simple_upload_limit:
+                    total_size = len(data)
+                if total_size is not None and len(data) != total_size:
+                    raise GraphRequestError(upload_common.size_mismatch(len(data), total_size))
+                # a stream of unknown size too large for a single PUT starts the upload session with what was read
+                buffered = data
+
+            if total_size is not None and total_size <= upload_common.simple_upload_limit:
+                access_token = self.login()
+                header = {
+                    "Authorization": "Bearer " + access_token,
+                    "Content-Type": "application/octet-stream"
+                }
+                response = self.session.put(
+                    f"{sharepoint_url}/v1.0/sites/{site_id}/drive/items/{target_drive_id}:/{target_file_name}:/content"
+                    , headers=header, data=data)
+
+                if response.status_code not in (200, 201, 204):
+                    raise GraphRequestError(f'Could not upload file. Error: {response.status_code} - {response.content}')
+
+                logger_common.logger.info(
+                    f'uploaded stream to SharePoint folder: {target_drive_id} with filename {target_file_name}. Info: {response.status_code}')
+                self.forget_item(site_id, name=target_file_name)
+                return response.json()
+
+            upload_url = self.create_upload_session(site_id, target_drive_id, target_file_name)['uploadUrl']
+            offset, started = 0, time.monotonic()
+
+            while True:
+                chunk_start = offset
+                if total_size is None:
+                    # read one byte past the chunk, the stream ending within it makes it the last chunk and gives the size
+                    buffered += upload_common.read_exactly(stream, max(chunk_size + 1 - len(buffered), 0))
+                    chunk, buffered = buffered[:chunk_size], buffered[chunk_size:]
+                    if not buffered:
+                        total_size = offset + len(chunk)
+                else:
+                    chunk = upload_common.read_exactly(stream, min(chunk_size, total_size - offset))
+                    if len(chunk) < min(chunk_size, total_size - offset):
+                        raise GraphRequestError(upload_common.size_mismatch(offset + len(chunk), total_size))
+                    # the last chunk completes the upload, so the stream must end with it
+                    if offset + len(chunk) == total_size and stream.read(1):
+                        raise GraphRequestError(upload_common.size_mismatch(total_size + 1, total_size))
+
+                # the stream can't be re-read, so a failed chunk is retried from memory
+                failures = 0
+                while offset < chunk_start + len(chunk):
+                    try:
+                        offset, item = self.upload_chunk(upload_url, chunk[offset - chunk_start:], offset,
+                                                         '*' if total_size is None else total_size)
+
+                    except Exception as e:
+                        failures += 1
+                        if failures > max_retries:
+                            raise
+                        logger_common.logger.error(e, exc_info=True)
+                        time.sleep(2 ** failures)
+
+                        offset = self.get_upload_offset(upload_url)
+                        if offset is None or not chunk_start <= offset <= chunk_start + len(chunk):
+                            raise GraphRequestError(f'cannot resume upload of: {target_file_name}')
+
+                if item:
+                    self.forget_item(site_id, name=target_file_name)
+                    bytes_per_second = total_size / max(time.monotonic() - started, 1e-6)
+                    logger_common.logger.info(
+                        f'uploaded stream to SharePoint folder: {target_drive_id} with filename {target_file_name}. '
+                        f'Throughput: {bytes_per_second / (1024 * 1024):.2f} MB/s')
+                    return item
+
+        # if attempt at rest request failed or above failed to return results
+        except Exception as e:
+            logger_common.logger.error(e, exc_info=True)
+            logger_common.logger.error(
+                f'Could not upload file: {target_file_name}')
+
+    def create_upload_session(self, site_id, target_drive_id, target_file_name, conflict_behavior='replace'):
+        access_token = self.login()
+        header = {
+            "Authorization": "Bearer " + access_token,
+            "Content-Type": "application/json"
+        }
+
+        response = self.session.post(
+            f"{sharepoint_url}/v1.0/sites/{site_id}/drive/items/{target_drive_id}:/{target_file_name}:/createUploadSession",
+            json={'item': {'@microsoft.graph.conflictBehavior': conflict_behavior}}, headers=header)
+
+        # check rest request was successful
+        if response.status_code in (200, 201, 204):
+            logger_common.logger.info(
+                f'created upload session for: {target_file_name}. Info: {response.status_code}')
+            return response.json()
+
+        raise GraphRequestError(f'cannot create upload session for: {target_file_name}. Error: {response.status_code} - {response.content}')
+
+    # Next byte an upload session expects, or None if the session has expired
+    def get_upload_offset(self, upload_url):
+        # upload urls are pre-authenticated, so no Authorization header
+        response = self.session.get(upload_url)
+        if response.status_code != 200:
+            return None
+
+        ranges = response.json().get('nextExpectedRanges', [])
+        return int(ranges[0].split('-')[0]) if ranges else None
+
+    # Send one byte range of an upload session, returning (next offset, uploaded item json once complete)
+    def upload_chunk(self, upload_url, chunk, start, total_size):
+        end = start + len(chunk) - 1
+        response = self.session.put(upload_url, data=chunk, headers={'Content-Range': f'bytes {start}-{end}/{total_size}'})
+
+        if response.status_code in (200, 201):
+            return total_size, response.json()
+        if response.status_code == 202:
+            ranges = response.json().get('nextExpectedRanges', [])
+            return (int(ranges[0].split('-')[0]) if ranges else end + 1), None
+
+        raise GraphRequestError(f'cannot upload bytes {start}-{end}. Error: {response.status_code} - {response.content}')
+
     def delete_item_by_id(self, site_id, item_id):
         access_token = self.login()
         header = {
@@ -576,7 +1190,7 @@ class Sharepoint(metaclass=Singleton):
         }
 
         try:
-            response = requests.delete(
+            response = self.session.delete(
                 f"{sharepoint_url}/v1.0/sites/{site_id}/drive/items/{item_id}"
                 , headers=header)
 
@@ -584,6 +1198,8 @@ class Sharepoint(metaclass=Singleton):
             if response.status_code in (200, 201, 204):
                 logger_common.logger.info(
                     f'deleted item: {item_id}. Info: {response.status_code}')
+                content_cache.invalidate(item_id)
+                self.forget_item(site_id, item_id)
                 return response
 
             # if rest request unsuccessful
@@ -598,6 +1214,10 @@ class Sharepoint(metaclass=Singleton):
                 f'Could not delete item {item_id}')
 
 
+clients = ClientRegistry(idle_timeout=int(os.getenv('CLIENT_IDLE_TIMEOUT', 900)))
+metrics_common.cache_gauge('sharepoint_metadata_cache', 'Name to id lookup cache hits, misses, entries and hit ratio', clients.metadata_stats)
+
+
 if __name__ == '__main__':
     sharepoint = Sharepoint(os.getenv('TENANT_ID')
                             , os.getenv('CLIENT_ID')
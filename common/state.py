@@ -0,0 +1,39 @@
+#!/usr/local/bin/python3
+import hashlib
+import json
+import os
+import tempfile
+
+
+class JsonStateStore:
+    """
+    Persists small pieces of state as one JSON file per key in a directory
+
+    Files are replaced atomically so a crashed run never leaves a half-written state behind.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+    def load(self, key):
+        try:
+            with open(self.path(key)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def save(self, key, state):
+        os.makedirs(self.directory, exist_ok=True)
+        descriptor, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(descriptor, 'w') as file:
+            json.dump({'key': key, **state}, file)
+        os.replace(temp_path, self.path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,182 @@
+#!/usr/local/bin/python3
+import email.utils
+import os
+import random
+import threading
+import time
+from requests.adapters import HTTPAdapter
+import common.logger as logger_common
+import common.metrics as metrics_common
+
+max_retries = int(os.getenv('HTTP_MAX_RETRIES', 5))
+backoff_base = float(os.getenv('HTTP_BACKOFF_BASE', 0.5))
+backoff_cap = float(os.getenv('HTTP_BACKOFF_CAP', 60))
+initial_rate = float(os.getenv('GRAPH_RATE_LIMIT', 20))
+max_rate = float(os.getenv('GRAPH_RATE_LIMIT_MAX', 200))
+
+idempotent_methods = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+retry_statuses = (500, 502, 503, 504)
+
+
+class RateLimiter:
+    """
+    Token bucket whose rate adapts to throttling (additive increase, multiplicative decrease)
+
+    Every success raises the rate by about `increase` requests/second per second of traffic, every
+    throttled response halves it (at most once per second, so a burst of 429s counts once) and
+    pauses the whole bucket for the Retry-After the server asked for. Shared by every client of
+    a tenant, since Graph throttles per tenant and per application.
+    """
+
+    def __init__(self, rate=initial_rate, max_rate=max_rate, min_rate=1, burst=None, increase=1, decrease=0.5):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst or max(rate, 1)
+        self.increase = increase
+        self.decrease = decrease
+        self.throttled = 0
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._last_decrease = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a token and returns how many seconds the caller must wait before sending.
+        Sync callers time.sleep() it and async callers asyncio.sleep() it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            deficit_wait = -self._tokens / self.rate if self._tokens < 0 else 0
+            # tokens only start refilling once a Retry-After pause is over
+            return max(self._paused_until - now, 0) + deficit_wait
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttled(self, retry_after=None):
+        with self._lock:
+            now = time.monotonic()
+            self.throttled += 1
+            if now - self._last_decrease >= 1:
+                self._refill(now)
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._tokens = min(self._tokens, 0)
+                self._last_decrease = now
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+
+            logger_common.logger.info(f'throttled by Graph, request rate lowered to {self.rate:.1f}/s')
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + max(now - max(self._updated, self._paused_until), 0) * self.rate)
+        self._updated = now
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_for(tenant_id):
+    """The RateLimiter shared by every client (sync and async) of a tenant"""
+    with _limiters_lock:
+        if tenant_id not in _limiters:
+            _limiters[tenant_id] = RateLimiter()
+        return _limiters[tenant_id]
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delay in seconds or an HTTP date), or None"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Retry-After when the server gave one, otherwise full-jitter exponential backoff"""
+    if retry_after is not None:
+        return retry_after
+    return random.uniform(0, min(backoff_cap, backoff_base * 2 ** attempt))
+
+
+def body_size(body):
+    return len(body) if isinstance(body, (bytes, str)) else 0
+
+
+def is_throttled(status, headers):
+    # Graph throttles with 429, and with 503 + Retry-After; the request was not processed, so any method can be resent
+    return status == 429 or (status == 503 and 'Retry-After' in headers)
+
+
+class ThrottlingAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that paces requests through a tenant's RateLimiter and retries throttled,
+    failed idempotent and connection-failed requests with backoff
+    """
+
+    def __init__(self, limiter=None, max_retries=max_retries, **kwargs):
+        super().__init__(**kwargs)
+        self.limiter = limiter
+        self.retries = max_retries
+
+    def send(self, request, **kwargs):
+        replayable, position = self._replayable(request.body)
+
+        for attempt in range(self.retries + 1):
+            if self.limiter:
+                time.sleep(self.limiter.acquire())
+            if attempt and position is not None:
+                request.body.seek(position)
+
+            can_retry = attempt < self.retries and replayable
+            try:
+                with metrics_common.GraphCall(request.method, request.url, body_size(request.body)) as call:
+                    response = super().send(request, **kwargs)
+                    call.done(response.status_code, response.headers)
+            # requests' ConnectionError and Timeout are OSErrors
+            except OSError as e:
+                if not (can_retry and request.method in idempotent_methods):
+                    raise
+                logger_common.logger.error(f'{request.method} {request.url} failed, retrying. Error: {e}')
+                metrics_common.graph_retries.inc(reason='connection_error')
+                time.sleep(backoff_delay(attempt))
+                continue
+
+            throttled = is_throttled(response.status_code, response.headers)
+            if throttled and self.limiter:
+                self.limiter.on_throttled(parse_retry_after(response.headers.get('Retry-After')))
+            elif response.status_code < 400 and self.limiter:
+                self.limiter.on_success()
+
+            if not can_retry or not (throttled or (response.status_code in retry_statuses and request.method in idempotent_methods)):
+                return response
+
+            delay = backoff_delay(attempt, parse_retry_after(response.headers.get('Retry-After')))
+            logger_common.logger.error(
+                f'{request.method} {request.url} returned {response.status_code}, retrying in {delay:.1f}s')
+            metrics_common.graph_retries.inc(reason='throttled' if throttled else 'server_error')
+            response.close()
+            time.sleep(delay)
+
+        return response
+
+    def _replayable(self, body):
+        # bodies that can be sent again: none, bytes/str, or a seekable file (rewound to where it started)
+        if body is None or isinstance(body, (bytes, str)):
+            return True, None
+        try:
+            return True, body.tell()
+        except (AttributeError, OSError):
+            return False, None
@@ -0,0 +1,151 @@
+#!/usr/local/bin/python3
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import weakref
+import common.logger as logger_common
+import common.metrics as metrics_common
+
+
+class TokenCache:
+    """
+    Thread-safe cache of OAuth access tokens keyed by token_key(tenant_id, client_id, client_secret, scope)
+
+    A cached token is returned until it expires (minus expiry_skew seconds). Once a token is
+    within refresh_margin seconds of expiry a single background refresh is started while callers
+    keep getting the cached token. Callers that miss wait on the same in-flight token request
+    instead of each sending their own.
+    """
+
+    def __init__(self, refresh_margin=300, expiry_skew=30):
+        self.refresh_margin = refresh_margin
+        self.expiry_skew = expiry_skew
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self._tokens = {}
+        self._key_locks = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._async_key_locks = weakref.WeakKeyDictionary()
+
+    def get_token(self, key, fetch):
+        """
+        Returns a valid access token for key, calling fetch() only when one is needed
+
+        :param key: token_key(tenant_id, client_id, client_secret, scope)
+        :param fetch: callable returning the token endpoint json, e.g. {'access_token': '...', 'expires_in': 3599}
+        :return access token or None if one could not be fetched
+        """
+        access_token = self.peek(key, fetch)
+        if access_token:
+            return access_token
+
+        with self._key_lock(key):
+            # another thread may have fetched the token while we were waiting
+            with self._lock:
+                entry = self._tokens.get(key)
+                if entry and entry['expires_at'] > time.monotonic():
+                    self.hits += 1
+                    return entry['access_token']
+                self.misses += 1
+
+            return self._fetch(key, fetch)
+
+    async def get_token_async(self, key, fetch):
+        """
+        Async counterpart of get_token, fetch is a coroutine function returning the token endpoint json.
+        Background refreshes run the coroutine on the caller's event loop.
+        """
+        loop = asyncio.get_running_loop()
+        access_token = self.peek(key, lambda: asyncio.run_coroutine_threadsafe(fetch(), loop).result(timeout=60))
+        if access_token:
+            return access_token
+
+        with self._lock:
+            key_lock = self._async_key_locks.setdefault(loop, {}).setdefault(key, asyncio.Lock())
+
+        async with key_lock:
+            # another task may have fetched the token while we were waiting
+            with self._lock:
+                entry = self._tokens.get(key)
+                if entry and entry['expires_at'] > time.monotonic():
+                    self.hits += 1
+                    return entry['access_token']
+                self.misses += 1
+
+            return self._store(key, await fetch())
+
+    def peek(self, key, fetch=None):
+        """
+        Returns the cached token for key without blocking, or None if there is no valid token.
+        If the token is close to expiry and fetch is given a background refresh is started.
+        """
+        with self._lock:
+            entry = self._tokens.get(key)
+            now = time.monotonic()
+            if not entry or entry['expires_at'] <= now:
+                return None
+
+            self.hits += 1
+            if fetch and entry['expires_at'] - now <= self.refresh_margin and key not in self._refreshing:
+                self._refreshing.add(key)
+                threading.Thread(target=self._background_refresh, args=(key, fetch), daemon=True).start()
+
+            return entry['access_token']
+
+    def invalidate(self, key):
+        with self._lock:
+            self._tokens.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'refreshes': self.refreshes,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _background_refresh(self, key, fetch):
+        try:
+            with self._key_lock(key):
+                with self._lock:
+                    self.refreshes += 1
+                self._fetch(key, fetch)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _fetch(self, key, fetch):
+        return self._store(key, fetch())
+
+    def _store(self, key, response):
+        if not response or not response.get('access_token'):
+            return None
+
+        expires_in = int(response.get('expires_in', 3599))
+        with self._lock:
+            self._tokens[key] = {
+                'access_token': response['access_token'],
+                'expires_at': time.monotonic() + max(expires_in - self.expiry_skew, 0)
+            }
+
+        logger_common.logger.info(f'cached access token for application id: {key[1]}. Cache: {self.stats()}')
+        return response['access_token']
+
+
+def token_key(tenant_id, client_id, client_secret, scope):
+    # the secret is part of the key, so a caller with the wrong secret never gets another caller's token
+    return tenant_id, client_id, hashlib.sha256((client_secret or '').encode()).hexdigest(), scope
+
+
+token_cache = TokenCache(refresh_margin=int(os.getenv('TOKEN_REFRESH_MARGIN', 300)))
+metrics_common.cache_gauge('sharepoint_token_cache', 'Access token cache hits, misses, refreshes and hit ratio', token_cache.stats)
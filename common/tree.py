@@ -0,0 +1,126 @@
+#!/usr/local/bin/python3
+from collections import deque
+
+
+class TreeIndex:
+    """
+    Parent/child index over a flat list of items (e.g. the output of list_drives_and_items)
+
+    Built in a single O(n) pass. Children lookups are O(1), descendants are iterated lazily
+    without recursion, so deep folder trees never hit the recursion limit.
+
+    :param items: [{'id': 1, 'parent_id': None, ...}, {'id': 2, 'parent_id': 1, ...}]
+    :param id_key: key holding the item id
+    :param parent_id_key: key holding the parent id (None for roots)
+    """
+
+    def __init__(self, items=(), id_key='id', parent_id_key='parent_id'):
+        self.id_key = id_key
+        self.parent_id_key = parent_id_key
+        self.items = {}
+        self._children = {}
+        self._subtree_counts = None
+
+        for item in items:
+            self.add(item)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item_id):
+        return item_id in self.items
+
+    def add(self, item):
+        """Adds an item, or replaces it (and re-parents it) if its id is already indexed"""
+        item_id = item[self.id_key]
+        existing = self.items.get(item_id)
+        if existing is not None and existing[self.parent_id_key] != item[self.parent_id_key]:
+            self._children[existing[self.parent_id_key]].remove(item_id)
+        if existing is None or existing[self.parent_id_key] != item[self.parent_id_key]:
+            self._children.setdefault(item[self.parent_id_key], []).append(item_id)
+
+        self.items[item_id] = item
+        self._subtree_counts = None
+
+    def remove(self, item_id):
+        """Removes an item and all of its descendants, returning the removed items"""
+        if item_id not in self.items:
+            return []
+
+        removed = [self.items[item_id]] + list(self.iter_descendants(item_id))
+        self._children[self.items[item_id][self.parent_id_key]].remove(item_id)
+        for item in removed:
+            del self.items[item[self.id_key]]
+            self._children.pop(item[self.id_key], None)
+
+        self._subtree_counts = None
+        return removed
+
+    def get(self, item_id):
+        return self.items.get(item_id)
+
+    def roots(self):
+        """Items without a parent, or whose parent is not in the index"""
+        return [item for item in self.items.values() if item[self.parent_id_key] not in self.items]
+
+    def child_ids(self, item_id):
+        return self._children.get(item_id, [])
+
+    def children(self, item_id):
+        return [self.items[child_id] for child_id in self.child_ids(item_id)]
+
+    def parent(self, item_id):
+        return self.items.get(self.items[item_id][self.parent_id_key])
+
+    def iter_descendants(self, item_id, order='bfs', max_depth=None):
+        """
+        Lazily yields every descendant of item_id (not the item itself)
+
+        :param order: 'bfs' (level by level) or 'dfs' (pre-order)
+        :param max_depth: only descend this many levels (1 = children only)
+        """
+        pending = deque((child_id, 1) for child_id in self.child_ids(item_id))
+        take = pending.popleft if order == 'bfs' else pending.pop
+        if order != 'bfs':
+            pending.reverse()
+
+        while pending:
+            current_id, depth = take()
+            yield self.items[current_id]
+
+            if max_depth is None or depth < max_depth:
+                child_ids = self.child_ids(current_id)
+                pending.extend((child_id, depth + 1) for child_id in (child_ids if order == 'bfs' else reversed(child_ids)))
+
+    def ancestors(self, item_id):
+        """Yields the parent, grandparent, ... of item_id up to its root"""
+        parent_id = self.items[item_id][self.parent_id_key]
+        while parent_id in self.items:
+            yield self.items[parent_id]
+            parent_id = self.items[parent_id][self.parent_id_key]
+
+    def path(self, item_id, key='name', separator='/'):
+        """e.g. 'Root Drive/Three/Nested/Folders' for the Folders item"""
+        names = [item[key] for item in self.ancestors(item_id)]
+        names.reverse()
+        names.append(self.items[item_id][key])
+        return separator.join(names)
+
+    def subtree_count(self, item_id):
+        """Number of descendants of item_id (counts for the whole tree are computed once and cached)"""
+        if self._subtree_counts is None:
+            counts = dict.fromkeys(self.items, 0)
+
+            # children always come after their parents in a bfs order, so walking it backwards
+            # finishes every child before its parent
+            order = [root[self.id_key] for root in self.roots()]
+            for current_id in order:
+                order.extend(self.child_ids(current_id))
+            for current_id in reversed(order):
+                parent_id = self.items[current_id][self.parent_id_key]
+                if parent_id in counts:
+                    counts[parent_id] += counts[current_id] + 1
+
+            self._subtree_counts = counts
+
+        return self._subtree_counts[item_id]
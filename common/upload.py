@@ -0,0 +1,94 @@
+#!/usr/local/bin/python3
+import os
+from werkzeug.sansio.multipart import MultipartDecoder, NEED_DATA, File, Data, Epilogue
+from common.state import JsonStateStore
+
+upload_state_dir = os.getenv('UPLOAD_STATE_DIR', 'resources/state/upload')
+
+# Graph requires upload session chunks to be multiples of 320 KiB
+chunk_multiple = 320 * 1024
+chunk_size = max(int(os.getenv('UPLOAD_CHUNK_SIZE', 10 * 1024 * 1024)) // chunk_multiple, 1) * chunk_multiple
+
+# files above this size go through an upload session instead of a single PUT
+simple_upload_limit = 4 * 1024 * 1024
+
+
+class UploadStateStore(JsonStateStore):
+    """Per upload, the session url and the file it belongs to, so a restarted process can resume"""
+
+    def __init__(self, directory=upload_state_dir):
+        super().__init__(directory)
+
+
+# Read exactly size bytes from a stream (socket reads can return less), fewer only at end of stream
+def read_exactly(stream, size):
+    data = bytearray()
+    while len(data) < size:
+        block = stream.read(size - len(data))
+        if not block:
+            break
+        data += block
+    return bytes(data)
+
+
+# Why a stream did not provide the announced number of bytes (received is total_size + 1 if it had more)
+def size_mismatch(received, total_size):
+    if received < total_size:
+        return f'stream ended after {received} of {total_size} bytes'
+    return f'stream is longer than {total_size} bytes'
+
+
+class MultipartFileReader:
+    """
+    File-like reader over the file part named field_name of a multipart/form-data body, decoded as it
+    streams in so the upload never has to be spooled to memory or disk
+
+    reader = MultipartFileReader(request.stream, boundary, 'file')
+    filename = reader.open()
+    chunk = reader.read(size)
+    """
+
+    def __init__(self, stream, boundary, field_name='file', read_size=64 * 1024):
+        self.stream = stream
+        self.field_name = field_name
+        self.read_size = read_size
+        self.filename = None
+        self._decoder = MultipartDecoder(boundary)
+        self._buffer = bytearray()
+        self._in_file = False
+        self._done = False
+
+    def open(self):
+        """Reads up to the start of the file part and returns its filename (None if there is no file)"""
+        while self.filename is None and not self._done:
+            self._next_event()
+        return self.filename
+
+    def read(self, size=-1):
+        while (size < 0 or len(self._buffer) < size) and not self._done:
+            self._next_event()
+
+        size = len(self._buffer) if size < 0 else size
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def _next_event(self):
+        event = self._decoder.next_event()
+
+        if event is NEED_DATA:
+            # None tells the decoder the body has ended
+            self._decoder.receive_data(self.stream.read(self.read_size) or None)
+
+        elif isinstance(event, File) and event.name == self.field_name and self.filename is None:
+            self.filename = event.filename
+            self._in_file = True
+
+        # data of other (form field) parts is skipped
+        elif isinstance(event, Data) and self._in_file:
+            self._buffer += event.data
+            if not event.more_data:
+                self._done = True
+
+        elif isinstance(event, Epilogue):
+            self._done = True
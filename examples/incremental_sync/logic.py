@@ -0,0 +1,27 @@
+import os
+import common.sharepoint as sharepoint
+
+"""
+Nightly incremental crawl: only created, modified and deleted items since the last run are fetched.
+The first run enumerates the whole drive and saves a delta link under DELTA_STATE_DIR.
+"""
+
+sharepoint_site_name = "Test Site"
+
+sharepoint_client = sharepoint.Sharepoint(os.getenv('TENANT_ID')
+                        , os.getenv('CLIENT_ID')
+                        , os.getenv('CLIENT_SECRET')
+                        )
+
+# get sharepoint site id
+sharepoint_site_id = sharepoint_client.get_site_id_by_name(sharepoint_site_name)
+
+# fetch changes since the last run and fold them into the cached folder tree
+changes = sharepoint_client.sync_drive_delta(sharepoint_site_id)
+folder_tree = changes['tree']
+
+for change_type in ('created', 'modified', 'deleted'):
+    for item in changes[change_type]:
+        if item['content_type'] == 'Document':
+            path = folder_tree.path(item['id']) if item['id'] in folder_tree else item['name']
+            print(f"{change_type}: {path}")
@@ -0,0 +1,22 @@
+import os
+import common.pipeline as pipeline
+
+"""
+Crawl every site configured in a directory of config files (same format as get_files_by_sharepoint_path/config) at once
+"""
+
+# where the documents found go: a JSON lines file, a CSV file, or straight to download
+config_directory = os.getenv('PIPELINE_CONFIG_DIR', '../get_files_by_sharepoint_path/config')
+sink_type = os.getenv('PIPELINE_SINK', 'jsonl')
+
+if sink_type == 'csv':
+    sink = pipeline.CsvSink('sharepoint_files.csv')
+elif sink_type == 'download':
+    sink = pipeline.DownloadSink(os.getenv('LOCAL_SHAREPOINT_DOWNLOADS_FOLDER'))
+else:
+    sink = pipeline.JsonLinesSink('sharepoint_files.jsonl')
+
+# sites are crawled concurrently, a site that fails is reported here without stopping the others
+summary = pipeline.PipelineRunner(sink).run(config_directory)
+for site, result in summary.items():
+    print(site, result)
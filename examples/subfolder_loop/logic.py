@@ -29,26 +29,9 @@ sharepoint_client = sharepoint.Sharepoint(os.getenv('TENANT_ID')
 # get sharepoint site id
 sharepoint_site_id = sharepoint_client.get_site_id_by_name(sharepoint_site_name)
 
-# get sharepoint root id
-sharepoint_root_drive_id = sharepoint_client.get_root_drive_details(sharepoint_site_id)['id']
-
-# get sharepoint list id
-sharepoint_root_list_id = sharepoint_client.get_list_details(sharepoint_site_id, ['Shared Documents'])
-sharepoint_root_list_id = sharepoint_root_list_id[0]['id']
-
-# only need to do this if one get_sub_folder = True
-folder_items = sharepoint_client.list_drives_and_items(
-    sharepoint_site_id
-    , sharepoint_root_list_id
-    , sharepoint_root_drive_id
-    )
-
 # 
 files_to_download = []
 
-# get folder items - parent-child relationship
-structured_folder_items = folder_items['items_parent_child_ids']
-
 # get files to download
 for folder_paths in sharepoint_folder_configuration:
     # looks up folder items and filters if file_name set
@@ -57,15 +40,13 @@ for folder_paths in sharepoint_folder_configuration:
     
     if folder_paths['get_subfolder_files']:
         # if folder with just folders in it then should not have a file_names filter so will have result here
-        sub_folders = structured_folder_items[folder_items[0]['parent_id']]
-        # loop through subfolders and add items to files to download
-        for sub_folder in sub_folders:
-            sub_folder_items = sharepoint_client.list_drive_items_by_id(sharepoint_site_id, sub_folder['id'])
-            for sub_folder_item in sub_folder_items:
-                if sub_folder_item['content_type'] == 'Document':
-                    files_to_download.append(sub_folder_item)
+        folder_id = folder_items[0]['parent_id']
+        # walk the subfolders concurrently and add their documents to files to download
+        files_to_download.extend(sharepoint_client.walk(sharepoint_site_id, folder_id, include=lambda item: item['parent_id'] != folder_id))
 
 files_to_download = [ files for files in files_to_download if files['content_type'] == 'Document']
 
+# download them all, files downloaded by an earlier run and unchanged since are skipped
+summary = sharepoint_client.download_items(sharepoint_site_id, files_to_download, os.getenv('LOCAL_SHAREPOINT_DOWNLOADS_FOLDER'))
 
-print(files_to_download)
+print(summary)
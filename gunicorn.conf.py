@@ -0,0 +1,38 @@
+"""
+gunicorn settings for production serving
+
+Flask app (all routes, threaded workers):
+    gunicorn app:app --config gunicorn.conf.py
+Async app (lookups, listings and downloads on an event loop per worker):
+    gunicorn async_app:create_app --config gunicorn.conf.py --worker-class aiohttp.GunicornWebWorker
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5010)}"
+workers = int(os.getenv('WEB_WORKERS', multiprocessing.cpu_count()))
+# threads only apply to the Flask app, each one holds a request for its whole Graph round trip
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', 16))
+# downloads are relayed for as long as they take, the timeout only catches hung workers
+timeout = int(os.getenv('WEB_TIMEOUT', 300))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+accesslog = '-'
+
+
+def post_worker_init(worker):
+    # log in with the configured application up front so the first request doesn't wait for a token
+    if worker.__class__.__name__ == 'GunicornWebWorker':
+        return
+    import common.sharepoint as sharepoint_common
+    if os.getenv('TENANT_ID') and os.getenv('CLIENT_ID') and os.getenv('CLIENT_SECRET'):
+        sharepoint_common.clients.get(os.getenv('TENANT_ID'), os.getenv('CLIENT_ID'), os.getenv('CLIENT_SECRET')).login()
+
+
+def worker_exit(server, worker):
+    # in-flight requests have been drained (or graceful_timeout passed), close pooled connections
+    if worker.__class__.__name__ == 'GunicornWebWorker':
+        return
+    import common.sharepoint as sharepoint_common
+    sharepoint_common.clients.close()
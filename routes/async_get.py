@@ -0,0 +1,119 @@
+from datetime import datetime
+from aiohttp import web
+import common.metrics as metrics_common
+from routes.get import relayed_download_headers, download_chunk_size
+
+# async counterparts of the lookup, listing and download routes in routes/get.py, served by async_app.py
+async_get = web.RouteTableDef()
+
+
+@async_get.get('/')
+async def index(request):
+    response = {
+        "status": 200,
+        "name": "python-sharepoint-application",
+        "version_api": "v1",
+        "version_code": "1.0.0",
+        "hostname": "",
+        "datetime_request": datetime.now().isoformat()
+    }
+    return web.json_response(response)
+
+
+@async_get.get('/site-name/{site_name}')
+async def get_site_id_by_name(request):
+    # get (or reuse) the sharepoint client for the request's credentials
+    sharepoint = get_client(request)
+
+    # get data
+    site_id = await sharepoint.get_site_id_by_name(request.match_info['site_name'])
+    if not site_id:
+        raise web.HTTPNotFound()
+
+    return web.Response(text=site_id)
+
+
+@async_get.get('/site-id/{site_id}/drive-name/{drive_name}')
+async def get_drive_id_by_name(request):
+    # get (or reuse) the sharepoint client for the request's credentials
+    sharepoint = get_client(request)
+
+    # get data
+    drive_id = await sharepoint.get_drive_id_by_name(request.match_info['site_id'], request.match_info['drive_name'])
+    if not drive_id:
+        raise web.HTTPNotFound()
+
+    return web.Response(text=drive_id)
+
+
+@async_get.get('/site-id/{site_id}/drive-id/{drive_id}/children')
+async def list_drive_items_by_id(request):
+    # get (or reuse) the sharepoint client for the request's credentials
+    sharepoint = get_client(request)
+
+    # get data
+    items = await sharepoint.list_drive_items_by_id(request.match_info['site_id'], request.match_info['drive_id'])
+    if not items:
+        raise web.HTTPNotFound()
+
+    return web.json_response([dict(item) for item in items])
+
+
+@async_get.get('/site-id/{site_id}/drive-id/{drive_id}/item-name/{item_name}')
+async def get_item_id_by_name(request):
+    # get (or reuse) the sharepoint client for the request's credentials
+    sharepoint = get_client(request)
+
+    # get data
+    item_id = await sharepoint.get_item_id_by_name(
+        request.match_info['site_id'], request.match_info['drive_id'], request.match_info['item_name'])
+    if not item_id:
+        raise web.HTTPNotFound()
+
+    return web.Response(text=item_id)
+
+
+@async_get.get('/site-id/{site_id}/item-id/{item_id}')
+async def download_item_by_id(request):
+    # get (or reuse) the sharepoint client for the request's credentials
+    sharepoint = get_client(request)
+
+    # relay the content stream chunk by chunk, forwarding the client's Range request
+    async with sharepoint.open_item_stream(request.match_info['site_id'], request.match_info['item_id'],
+                                           request.headers.get('Range'), request.headers.get('If-Range')) as item_stream:
+        if item_stream is None:
+            raise web.HTTPNotFound()
+
+        headers = {header: item_stream.headers[header] for header in relayed_download_headers if header in item_stream.headers}
+        headers.setdefault('Accept-Ranges', 'bytes')
+
+        response = web.StreamResponse(status=item_stream.status, headers=headers)
+        await response.prepare(request)
+        async for chunk in item_stream.content.iter_chunked(download_chunk_size):
+            await response.write(chunk)
+        await response.write_eof()
+
+        return response
+
+
+@async_get.get('/metrics')
+async def get_metrics(request):
+    return web.Response(body=metrics_common.registry.render().encode(), headers={'Content-Type': 'text/plain; version=0.0.4'})
+
+
+def get_client(request):
+    # request header
+    tenant_id = request.headers.get('tenant-id')
+    client_id = request.headers.get('client-id')
+    client_secret = request.headers.get('client-secret')
+
+    # check existence of headers
+    check_existence([tenant_id, client_id, client_secret])
+
+    return request.app['clients'].get(tenant_id, client_id, client_secret)
+
+
+def check_existence(variables):
+    for var in variables:
+        if var is None:
+            raise web.HTTPBadRequest()
@@ -0,0 +1,133 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Blueprint, Response, request, abort, stream_with_context
+import common.logger as logger_common
+import common.sharepoint as sharepoint_common
+from common.batch import max_batch_size
+
+batch = Blueprint('batch', __name__)
+
+batch_workers = int(os.getenv('BATCH_ROUTE_WORKERS', 4))
+# fields each operation needs, besides site_id and item_id
+operation_fields = {
+    'delete': [],
+    'move': ['target_folder_id', 'target_file_name'],
+    'copy': ['target_folder_id']
+}
+
+
+@batch.route('/batch', methods=['POST'])
+def run_operations():
+    """
+    Runs many delete/move/copy operations in one call, streaming one JSON line per operation as it finishes
+
+    [
+        {"op": "delete", "site_id": "...", "item_id": "..."},
+        {"op": "move", "site_id": "...", "item_id": "...", "target_folder_id": "...", "target_file_name": "..."},
+        {"op": "copy", "site_id": "...", "item_id": "...", "target_folder_id": "...", "target_file_name": "optional"}
+    ]
+
+    Operations go to Graph 20 at a time through $batch, with up to BATCH_ROUTE_WORKERS batches in flight.
+    Results come back in completion order, each carrying the index of its operation in the request.
+    """
+    # request header
+    tenant_id = request.headers.get('tenant-id')
+    client_id = request.headers.get('client-id')
+    client_secret = request.headers.get('client-secret')
+
+    # check existence of headers and body
+    check_existence([tenant_id, client_id, client_secret])
+    operations = request.get_json(silent=True)
+    if not isinstance(operations, list):
+        abort(400)
+
+    # get (or reuse) the sharepoint client for these credentials
+    sharepoint = sharepoint_common.clients.get(tenant_id, client_id, client_secret)
+
+    # invalid operations are answered straight away, the rest are sent in $batch sized chunks
+    invalid = [(index, operation) for index, operation in enumerate(operations) if validation_error(operation)]
+    valid = [(index, operation) for index, operation in enumerate(operations) if not validation_error(operation)]
+    chunks = [valid[start:start + max_batch_size] for start in range(0, len(valid), max_batch_size)]
+
+    def generate():
+        for index, operation in invalid:
+            yield result_line(index, operation, error=validation_error(operation))
+
+        executor = ThreadPoolExecutor(max_workers=batch_workers)
+        try:
+            futures = {executor.submit(run_chunk, sharepoint, chunk): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                try:
+                    lines = future.result()
+                # the response has already started, answer every operation of the chunk instead of cutting the stream
+                except Exception as e:
+                    logger_common.logger.error(e, exc_info=True)
+                    lines = [result_line(index, operation, error=str(e)) for index, operation in futures[future]]
+                yield from lines
+
+        # stop sending batches if the caller goes away
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def run_chunk(sharepoint, chunk):
+    futures = {}
+    failure = None
+    try:
+        with sharepoint.batch() as graph_batch:
+            for index, operation in chunk:
+                if operation['op'] == 'delete':
+                    future = graph_batch.delete_item(operation['site_id'], operation['item_id'])
+                elif operation['op'] == 'move':
+                    future = graph_batch.move_item(operation['site_id'], operation['item_id'],
+                                                   operation['target_folder_id'], operation['target_file_name'])
+                else:
+                    future = graph_batch.copy_item(operation['site_id'], operation['item_id'],
+                                                   operation['target_folder_id'], operation.get('target_file_name'))
+                futures[index] = future
+
+    # operations the batch could not send are reported as failed
+    except Exception as e:
+        logger_common.logger.error(e, exc_info=True)
+        failure = str(e)
+
+    lines = []
+    for index, operation in chunk:
+        future = futures.get(index)
+        if future is None or not future.done():
+            error = failure or 'operation was not sent'
+        else:
+            error = future.exception()
+            error = str(error) if error else None
+        lines.append(result_line(index, operation, error=error))
+    return lines
+
+
+def validation_error(operation):
+    if not isinstance(operation, dict) or operation.get('op') not in operation_fields:
+        return f"op must be one of: {', '.join(operation_fields)}"
+    missing = [field for field in ['site_id', 'item_id', *operation_fields[operation['op']]] if not operation.get(field)]
+    if missing:
+        return f"missing fields: {', '.join(missing)}"
+    return None
+
+
+def result_line(index, operation, error=None):
+    result = {
+        'index': index,
+        'op': operation.get('op') if isinstance(operation, dict) else None,
+        'item_id': operation.get('item_id') if isinstance(operation, dict) else None,
+        'ok': error is None
+    }
+    if error:
+        result['error'] = error
+    return json.dumps(result) + '\n'
+
+
+def check_existence(variables):
+    for var in variables:
+        if var is None:
+            abort(400)
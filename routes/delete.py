@@ -15,8 +15,8 @@ def delete_item_by_id(site_id: str, item_id: str):
     # check existence of headers and parameters
     check_existence([tenant_id, client_id, client_secret, site_id, item_id])
 
-    # login to sharepoint
-    sharepoint = sharepoint_common.Sharepoint(tenant_id, client_id, client_secret)
+    # get (or reuse) the sharepoint client for these credentials
+    sharepoint = sharepoint_common.clients.get(tenant_id, client_id, client_secret)
 
     # get data
     delete_item = sharepoint.delete_item_by_id(site_id, item_id)
@@ -1,10 +1,13 @@
 import os
 from datetime import datetime
-from flask import Blueprint, request, abort, send_from_directory
+from flask import Blueprint, Response, request, abort, send_from_directory, stream_with_context
 import common.sharepoint as sharepoint_common
 
 get = Blueprint('get', __name__)
 
+download_chunk_size = 256 * 1024
+relayed_download_headers = ('Content-Length', 'Content-Range', 'Content-Disposition', 'Content-Type', 'Accept-Ranges', 'ETag', 'Last-Modified')
+
 
 @get.route('/')
 def index():
@@ -29,8 +32,8 @@ def get_site_id_by_name(site_name: str):
     # check existence of headers and parameters
     check_existence([tenant_id, client_id, client_secret, site_name])
 
-    # login to sharepoint
-    sharepoint = sharepoint_common.Sharepoint(tenant_id, client_id, client_secret)
+    # get (or reuse) the sharepoint client for these credentials
+    sharepoint = sharepoint_common.clients.get(tenant_id, client_id, client_secret)
 
     # get data
     site_id = sharepoint.get_site_id_by_name(site_name)
@@ -50,8 +53,8 @@ def get_drive_id_by_name(site_id: str, drive_name: str):
     # check existence of headers and parameters
     check_existence([tenant_id, client_id, client_secret, site_id, drive_name])
 
-    # login to sharepoint
-    sharepoint = sharepoint_common.Sharepoint(tenant_id, client_id, client_secret)
+    # get (or reuse) the sharepoint client for these credentials
+    sharepoint = sharepoint_common.clients.get(tenant_id, client_id, client_secret)
 
     # get data
     drive_id = sharepoint.get_drive_id_by_name(site_id, drive_name)
@@ -71,15 +74,15 @@ def list_drive_items_by_id(site_id: str, drive_id: str):
     # check existence of headers and parameters
     check_existence([tenant_id, client_id, client_secret, site_id, drive_id])
 
-    # login to sharepoint
-    sharepoint = sharepoint_common.Sharepoint(tenant_id, client_id, client_secret)
+    # get (or reuse) the sharepoint client for these credentials
+    sharepoint = sharepoint_common.clients.get(tenant_id, client_id, client_secret)
 
     # get data
     drive_id = sharepoint.list_drive_items_by_id(site_id, drive_id)
     if not drive_id:
         abort(404)
 
-    return drive_id
+    return [dict(item) for item in drive_id]
 
 @get.route('/site-id/<string:site_id>/drive-id/<string:drive_id>/item-name/<string:item_name>')
 def get_item_id_by_name(site_id: str, drive_id: str, item_name: str):
@@ -91,8 +94,8 @@ def get_item_id_by_name(site_id: str, drive_id: str, item_name: str):
     # check existence of headers and parameters
     check_existence([tenant_id, client_id, client_secret, site_id, drive_id, item_name])
 
-    # login to sharepoint
-    sharepoint = sharepoint_common.Sharepoint(tenant_id, client_id, client_secret)
+    # get (or reuse) the sharepoint client for these credentials
+    sharepoint = sharepoint_common.clients.get(tenant_id, client_id, client_secret)
 
     # get data
     item_id = sharepoint.get_item_id_by_name(site_id, drive_id, item_name)
@@ -112,16 +115,34 @@ def download_item_by_id(site_id: str, item_id: str):
     # check existence of headers and parameters
     check_existence([tenant_id, client_id, client_secret, site_id, item_id])
 
-    # login to sharepoint
-    sharepoint = sharepoint_common.Sharepoint(tenant_id, client_id, client_secret)
+    # get (or reuse) the sharepoint client for these credentials
+    sharepoint = sharepoint_common.clients.get(tenant_id, client_id, client_secret)
 
-    # get data
-    download_directory = os.getenv('LOCAL_FOLDER')
-    downloaded_item = sharepoint.download_item_by_id(site_id, item_id, download_directory)
-    if not downloaded_item:
+    # download to LOCAL_FOLDER first and serve the local copy
+    if request.args.get('mode') == 'local':
+        download_directory = os.getenv('LOCAL_FOLDER')
+        downloaded_item = sharepoint.download_item_by_id(site_id, item_id, download_directory)
+        if not downloaded_item:
+            abort(404)
+
+        return send_from_directory(download_directory, downloaded_item)
+
+    # relay the content stream chunk by chunk, forwarding the client's Range request
+    item_stream = sharepoint.open_item_stream(site_id, item_id, request.headers.get('Range'), request.headers.get('If-Range'))
+    if item_stream is None:
         abort(404)
 
-    return send_from_directory(download_directory, downloaded_item)
+    headers = {header: item_stream.headers[header] for header in relayed_download_headers if header in item_stream.headers}
+    headers.setdefault('Accept-Ranges', 'bytes')
+
+    return Response(stream_with_context(relay(item_stream)), status=item_stream.status_code, headers=headers)
+
+
+def relay(item_stream):
+    try:
+        yield from item_stream.iter_content(chunk_size=download_chunk_size)
+    finally:
+        item_stream.close()
 
 
 def check_existence(variables):
@@ -0,0 +1,9 @@
+from flask import Blueprint, Response
+import common.metrics as metrics_common
+
+metrics = Blueprint('metrics', __name__)
+
+
+@metrics.route('/metrics')
+def get_metrics():
+    return Response(metrics_common.registry.render(), mimetype='text/plain; version=0.0.4')
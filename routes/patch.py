@@ -14,8 +14,8 @@ def move_item_to_drive(site_id: str, item_id: str, target_folder_id: str, target
     # check existence of headers and parameters
     check_existence([tenant_id, client_id, client_secret, site_id, item_id, target_folder_id, target_file_name])
 
-    # login to sharepoint
-    sharepoint = sharepoint_common.Sharepoint(tenant_id, client_id, client_secret)
+    # get (or reuse) the sharepoint client for these credentials
+    sharepoint = sharepoint_common.clients.get(tenant_id, client_id, client_secret)
 
     # get data
     moved_item = sharepoint.move_item_to_new_drive(site_id, item_id, target_folder_id, target_file_name)
@@ -1,6 +1,6 @@
-import os
 from flask import Blueprint, request, abort
 import common.sharepoint as sharepoint_common
+import common.upload as upload_common
 
 put = Blueprint('put', __name__)
 
@@ -12,23 +12,34 @@ def upload_file_to_drive(site_id: str, drive_id: str):
     client_id = request.headers.get('client-id')
     client_secret = request.headers.get('client-secret')
 
-    # parameters
-    uploaded_file = request.files['file']
-
     # check existence of headers and parameters
-    check_existence([tenant_id, client_id, client_secret, site_id, drive_id, uploaded_file])
+    check_existence([tenant_id, client_id, client_secret, site_id, drive_id])
+
+    # parameters (the body is streamed straight to SharePoint, never saved locally)
+    if request.mimetype == 'multipart/form-data':
+        # the file is the 'file' field. Multipart framing hides its size: an optional file-size header gives it,
+        # otherwise it is found while streaming
+        uploaded_file = upload_common.MultipartFileReader(request.stream, request.mimetype_params.get('boundary', '').encode(), 'file')
+        file_name = uploaded_file.open()
+        file_size = request.headers.get('file-size', type=int)
+    else:
+        uploaded_file = request.stream
+        file_name = request.headers.get('file-name')
+        file_size = request.content_length
+
+    check_existence([file_name])
 
-    # login to sharepoint
-    sharepoint = sharepoint_common.Sharepoint(tenant_id, client_id, client_secret)
+    # get (or reuse) the sharepoint client for these credentials
+    sharepoint = sharepoint_common.clients.get(tenant_id, client_id, client_secret)
 
-    uploaded_file.save(os.path.join(os.getenv('LOCAL_REQUESTS_DOWNLOADS_FOLDER'), uploaded_file.filename))
-    sharepoint.upload_file_to_drive(site_id, os.getenv('LOCAL_REQUESTS_DOWNLOADS_FOLDER'), uploaded_file.filename
-                                    , drive_id, uploaded_file.filename)
+    uploaded_item = sharepoint.upload_stream_to_drive(site_id, uploaded_file, file_size, drive_id, file_name)
+    if not uploaded_item:
+        abort(502)
 
-    return f"Uploaded {uploaded_file.filename}"
+    return f"Uploaded {file_name}"
 
 
 def check_existence(variables):
     for var in variables:
         if var is None:
-            abort(400)
\ No newline at end of file
+            abort(400)
@@ -0,0 +1,110 @@
+import os
+import tempfile
+import unittest
+from datetime import date
+
+os.environ.setdefault('LOG_PATH', tempfile.mkdtemp())
+os.environ.setdefault('LOG_FILENAME', 'tests')
+
+from common.item import DriveItem
+from common.plan import compile_plan, run_walk
+
+today = date(2024, 6, 30)
+
+
+def configuration(*entries, site_name='Test Site', default_look_back_days=30):
+    return {'site_name': site_name, 'default_look_back_days': default_look_back_days, 'folder_and_file_paths': list(entries)}
+
+
+def entry(folder_path, look_back_days=None, file_names=(), get_subfolder_files=False):
+    return {'folder_path': folder_path, 'file_names': list(file_names), 'look_back_days': look_back_days,
+            'get_subfolder_files': get_subfolder_files}
+
+
+def cutoff(look_back_days):
+    # documents created after today - look_back_days, to the day
+    return date.fromordinal(today.toordinal() - look_back_days + 1)
+
+
+class NestedWalkTest(unittest.TestCase):
+
+    def test_inner_walk_looking_back_less_is_merged_into_the_outer_walk(self):
+        site = compile_plan([configuration(entry('/A', 40, get_subfolder_files=True),
+                                           entry('/A/B', 10, get_subfolder_files=True))], today).sites[0]
+
+        self.assertEqual([(walk.path, walk.cutoff, walk.exclude) for walk in site.walks], [('/A', cutoff(40), set())])
+
+    def test_inner_walk_looking_back_further_is_pruned_from_the_outer_walk(self):
+        site = compile_plan([configuration(entry('/A', 10, get_subfolder_files=True),
+                                           entry('/A/B', 40, get_subfolder_files=True))], today).sites[0]
+
+        self.assertEqual([(walk.path, walk.cutoff, walk.exclude) for walk in site.walks],
+                         [('/A', cutoff(10), {'/A/B'}), ('/A/B', cutoff(40), set())])
+        self.assertEqual(site.listings, {})
+
+
+class CoveredByWalkTest(unittest.TestCase):
+
+    def test_listing_inside_a_walk_becomes_a_rule_only_when_it_looks_back_further(self):
+        site = compile_plan([configuration(entry('/A', 10, get_subfolder_files=True),
+                                           entry('/A/B', 5), entry('/A/C', 40))], today).sites[0]
+
+        self.assertEqual(site.listings, {})
+        self.assertEqual(site.walks[0].rules, {'/A': {'all': cutoff(10), 'names': {}},
+                                               '/A/C': {'all': cutoff(40), 'names': {}}})
+
+    def test_named_file_inside_a_walked_subtree_is_not_looked_up(self):
+        site = compile_plan([configuration(entry('/A', 10, get_subfolder_files=True),
+                                           entry('/A/B', 40, ['report.docx']),
+                                           entry('/D', 5, ['other.docx']))], today).sites[0]
+
+        self.assertEqual(site.walks[0].rules['/A/B'], {'all': None, 'names': {'report.docx': cutoff(40)}})
+        self.assertEqual(site.lookups, {('/D', 'other.docx'): cutoff(5)})
+
+    def test_walk_applies_folder_rules_and_its_own_date_limit(self):
+        site = compile_plan([configuration(entry('/A', 10, get_subfolder_files=True),
+                                           entry('/A/B', 40, ['report.docx']))], today).sites[0]
+        documents = [
+            DriveItem('new.docx', 'new', 'id-a', 'Document', '2024-06-25T00:00:00Z'),
+            DriveItem('old.docx', 'old', 'id-a', 'Document', '2024-06-01T00:00:00Z'),
+            DriveItem('report.docx', 'report', 'id-b', 'Document', '2024-06-01T00:00:00Z'),
+            DriveItem('other.docx', 'other', 'id-b', 'Document', '2024-06-01T00:00:00Z'),
+        ]
+
+        class Client:
+            def walk(self, site_id, folder_id, exclude=None, errors=None):
+                self.folder_id = folder_id
+                return iter(documents)
+
+        client = Client()
+        found = run_walk(client, 'site', site.walks[0], {'/A': 'id-a', '/A/B': 'id-b'})
+
+        self.assertEqual([item['id'] for item in found], ['new', 'report'])
+        self.assertEqual(client.folder_id, 'id-a')
+
+
+class PlannedCallsTest(unittest.TestCase):
+
+    def test_dry_run_reports_planned_and_unplanned_calls(self):
+        plan = compile_plan([configuration(entry('/A', 10, get_subfolder_files=True), entry('/A/B', 5)),
+                             configuration(entry('/D', 5, ['one.docx', 'two.docx']), entry('/E', 5))], today)
+        site = plan.sites[0]
+
+        # site lookup, one $batch (folder ids and named files), one listing and one walk
+        self.assertEqual(site.batch_requests(), 1)
+        self.assertEqual(site.planned_calls(), 4)
+        # two site lookups, a call per entry and a walk for the get_subfolder_files entry
+        self.assertEqual(site.unplanned_calls(), 2 + 4 + 1)
+        self.assertEqual(plan.describe()[-1],
+                         'total calls: 4 planned, 7 without planning (walks count one call, they make one more per subfolder)')
+
+    def test_sites_are_planned_separately(self):
+        plan = compile_plan([configuration(entry('/A', 10)), configuration(entry('/A', 10), site_name='Other Site')], today)
+
+        self.assertEqual([site.site_name for site in plan.sites], ['Test Site', 'Other Site'])
+        self.assertEqual(plan.planned_calls(), 4)
+        self.assertEqual(plan.unplanned_calls(), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
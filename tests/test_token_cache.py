@@ -0,0 +1,47 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+os.environ.setdefault('LOG_PATH', tempfile.mkdtemp())
+os.environ.setdefault('LOG_FILENAME', 'tests')
+
+import common.sharepoint as sharepoint_common
+from common.token_cache import TokenCache
+
+
+class TokenCacheSecretTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(sharepoint_common, 'token_cache', TokenCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.fetched = []
+        fetch = mock.patch.object(sharepoint_common.Sharepoint, 'fetch_access_token', autospec=True,
+                                  side_effect=self.fetch_access_token)
+        fetch.start()
+        self.addCleanup(fetch.stop)
+
+    def fetch_access_token(self, client):
+        self.fetched.append(client.client_secret)
+        # the token endpoint only issues tokens for the right secret
+        if client.client_secret == 'secret':
+            return {'access_token': 'token', 'expires_in': 3599}
+        return None
+
+    def test_same_secret_is_served_from_cache(self):
+        self.assertEqual(sharepoint_common.Sharepoint('tenant', 'client', 'secret').login(), 'token')
+        self.assertEqual(sharepoint_common.Sharepoint('tenant', 'client', 'secret').login(), 'token')
+        self.assertEqual(self.fetched, ['secret'])
+
+    def test_wrong_secret_forces_a_real_token_fetch(self):
+        self.assertEqual(sharepoint_common.Sharepoint('tenant', 'client', 'secret').login(), 'token')
+
+        self.assertIsNone(sharepoint_common.Sharepoint('tenant', 'client', 'wrong-secret').login())
+        self.assertIsNone(sharepoint_common.Sharepoint('tenant', 'client', '').login())
+        self.assertEqual(self.fetched, ['secret', 'wrong-secret', ''])
+
+
+if __name__ == '__main__':
+    unittest.main()